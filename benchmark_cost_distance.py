@@ -0,0 +1,63 @@
+import argparse
+import time
+import numpy
+from cost_distance import ALGORITHMS, CostSurface, bucket_layout
+
+# times the heap and bucket queue cost distance algorithms on a synthetic grid of small integer cost classes, e.g.
+#   python benchmark_cost_distance.py --size 1000 --classes 255 --sources 10
+# the time per cell of a modest grid is also scaled up to a larger one: the bucket queue's time grows with the cells,
+# the heap's a little faster with the log of its length, so the heap's estimate is a lower bound; a 10000 x 10000 grid
+# needs several GB in pure python, pass --size 10000 to measure it rather than estimate it
+
+
+def synthetic_grid(size, classes, barriers, seed):
+
+    # patchy integer classes 1 to classes, as friction surfaces reclassified from land cover tend to be, with a
+    # fraction of NoData barrier cells
+    random = numpy.random.RandomState(seed)
+    coarse = random.randint(1, classes + 1, size=((size + 15) // 16, (size + 15) // 16))
+    cost = numpy.repeat(numpy.repeat(coarse, 16, axis=0), 16, axis=1)[:size, :size].astype(numpy.float64)
+    cost[random.random_sample((size, size)) < barriers] = numpy.nan
+
+    return cost, random
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare the cost distance algorithms on a synthetic grid")
+    parser.add_argument("--size", type=int, default=1000, help="grid rows and columns")
+    parser.add_argument("--classes", type=int, default=255, help="integer cost classes, 1 to this")
+    parser.add_argument("--barriers", type=float, default=0.01, help="fraction of NoData cells")
+    parser.add_argument("--sources", type=int, default=10, help="source cells")
+    parser.add_argument("--max-distance", type=float, default=None, help="maximum cost distance")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--estimate-size", type=int, default=10000, help="grid rows and columns the timings are scaled to")
+    args = parser.parse_args()
+
+    cost, random = synthetic_grid(args.size, args.classes, args.barriers, args.seed)
+    sources = numpy.zeros(cost.shape, dtype=bool)
+    sources[random.randint(0, args.size, args.sources), random.randint(0, args.size, args.sources)] = True
+    print("{0} x {0} grid, cost classes 1 to {1}, {2} sources".format(args.size, args.classes, sources.sum()))
+
+    results = {}
+    for algorithm in ALGORITHMS:
+        surface = CostSurface(cost, algorithm=algorithm)
+        if algorithm == "Bucket":
+            layout = bucket_layout(surface.steps, surface.min_cost, surface.max_cost)
+            print("bucket width {}, {} buckets".format(*layout) if layout else "costs do not suit the bucket queue, heap used")
+        start = time.time()
+        results[algorithm] = surface.distance(sources, args.max_distance)
+        elapsed = time.time() - start
+        estimate = elapsed * (float(args.estimate_size) / args.size) ** 2
+        print("{:<8} {:10.2f} s, {:.2f} s per million cells, about {:.0f} s estimated for {} x {}".format(
+            algorithm, elapsed, elapsed * 1e6 / cost.size, estimate, args.estimate_size, args.estimate_size))
+
+    first, second = [results[algorithm] for algorithm in ALGORITHMS]
+    same = numpy.array_equal(numpy.isnan(first), numpy.isnan(second)) and numpy.allclose(first[~numpy.isnan(first)], second[~numpy.isnan(second)])
+    print("results {}".format("identical" if same else "DIFFER"))
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 import py_compile
 
-ts = ["kst-custom-tools.pyt", "contained_nearest_centroid.py", "pseudo_point.py", "percentiles.py", "run_maxent.py", "single_feature_kml.py", "sum_cost_distances.py"]
+ts = ["kst-custom-tools.pyt", "contained_nearest_centroid.py", "nearest_centroid_engine.py", "nearest_centroid_output.py", "nearest_centroid_cache.py", "point_in_polygon.py", "pseudo_point.py", "percentiles.py", "run_maxent.py", "single_feature_kml.py", "sum_cost_distances.py", "cost_distance.py", "tiled_cost_distance.py", "rasterize.py", "cost_distance_cache.py", "raster_io.py", "maxent_batch.py", "maxent_progress.py", "maxent_replicates.py", "maxent_swd.py", "maxent_run_cache.py", "maxent_resources.py", "maxent_projection.py", "maxent_postprocess.py", "maxent_results_table.py", "pool_python.py"]
 
 for t in ts:
     py_compile.compile(t)
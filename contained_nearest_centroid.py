@@ -1,6 +1,27 @@
 import arcpy
 import os
+import hashlib
+import numpy
+from collections import OrderedDict
 from datetime import datetime
+from functools import partial
+from nearest_centroid_engine import Polygon, nearest_to_centroid, tiled_nearest_to_centroid
+from nearest_centroid_cache import incremental_nearest_to_centroid
+from nearest_centroid_output import write_csv, write_geojson
+from point_in_polygon import geometry_parts
+from pool_python import use_python_for_pools
+
+PROGRESS_INTERVAL = 1000
+
+POLYGON_ID_FIELD = "poly_id"
+DISTANCE_FIELD = "cent_dist"
+RANK_FIELD = "cent_rank"
+
+# arcpy field types as reported by ListFields, mapped to the AddField type names
+FIELD_TYPES = {"OID": "LONG", "Integer": "LONG", "SmallInteger": "SHORT", "Double": "DOUBLE", "Single": "FLOAT", "String": "TEXT", "Date": "DATE"}
+
+# the arcpy-free outputs, these skip the feature class entirely
+OUTPUT_EXTENSIONS = OrderedDict([("CSV", ".csv"), ("GeoJSON", ".geojson")])
 
 
 class ContainedNearestCentroidTool(object):
@@ -60,7 +81,51 @@ class ContainedNearestCentroidTool(object):
 
         param4.defaultEnvironmentName = "workspace"
 
-        return [param0, param1, param2, param3, param4]
+        param5 = arcpy.Parameter(
+            displayName="Parallel Workers",
+            name="in_workers",
+            datatype="GPLong",
+            parameterType="Optional",
+            direction="Input")
+
+        param5.value = 1
+
+        param6 = arcpy.Parameter(
+            displayName="Tile Size (map units)",
+            name="in_tile_size",
+            datatype="GPDouble",
+            parameterType="Optional",
+            direction="Input")
+
+        param7 = arcpy.Parameter(
+            displayName="Output Format",
+            name="in_out_format",
+            datatype="GPString",
+            parameterType="Optional",
+            direction="Input")
+
+        param7.filter.list = ["Feature Class"] + list(OUTPUT_EXTENSIONS.keys())
+        param7.value = "Feature Class"
+
+        param8 = arcpy.Parameter(
+            displayName="Number of Nearest Points",
+            name="in_k",
+            datatype="GPLong",
+            parameterType="Optional",
+            direction="Input")
+
+        param8.filter.type = "Range"
+        param8.filter.list = [1, 1000000]
+        param8.value = 1
+
+        param9 = arcpy.Parameter(
+            displayName="Result Cache Folder",
+            name="in_cache_folder",
+            datatype="DEFolder",
+            parameterType="Optional",
+            direction="Input")
+
+        return [param0, param1, param2, param3, param4, param5, param6, param7, param8, param9]
 
     def isLicensed(self):
 
@@ -81,79 +146,154 @@ class ContainedNearestCentroidTool(object):
         points = parameters[2].valueAsText
         point_id_field = parameters[3].valueAsText
         out_ws = parameters[4].valueAsText
+        workers = int(parameters[5].valueAsText) if parameters[5].valueAsText else 1
+        tile_size = float(parameters[6].valueAsText) if parameters[6].valueAsText else None
+        out_format = parameters[7].valueAsText or "Feature Class"
+        k = int(parameters[8].valueAsText) if parameters[8].valueAsText else 1
+        cache_folder = parameters[9].valueAsText
+
+        try:
+            arcpy.SelectLayerByAttribute_management(points, "CLEAR_SELECTION")
+        except:
+            pass
+
+        polygon_rows, polygon_ids = read_polygons(polygons, polygon_id_field)
+        total_rows = len(polygon_rows)
+        messages.addMessage("{} > Read {} polygons".format(timestamp(), total_rows))
+
+        point_data = arcpy.da.FeatureClassToNumPyArray(points, ['OID@', 'SHAPE@X', 'SHAPE@Y', point_id_field])
+        messages.addMessage("{} > Read {} points".format(timestamp(), len(point_data)))
+
+        if workers > 1:
+            use_python_for_pools()
+            messages.addMessage("{} > Running on spatial tiles with {} workers".format(timestamp(), workers))
+            compute = partial(tiled_nearest_to_centroid, tile_size=tile_size, workers=workers)
+        else:
+            compute = nearest_to_centroid
+
+        if cache_folder:
+            cache_path = cache_file(cache_folder, polygons, points)
+            messages.addMessage("{} > Using result cache '{}'".format(timestamp(), cache_path))
+            nearest, reused, recomputed = incremental_nearest_to_centroid(polygon_rows, point_data['OID@'], point_data['SHAPE@X'], point_data['SHAPE@Y'], cache_path, k, compute)
+            messages.addMessage("{} > {} polygons reused from cache, {} recomputed".format(timestamp(), reused, recomputed))
+        else:
+            nearest = compute(polygon_rows, point_data['OID@'], point_data['SHAPE@X'], point_data['SHAPE@Y'], k=k)
 
-        tmp_poly_lyr = "tmp_poly_lyr"
-
-        poly_rows = arcpy.da.UpdateCursor(polygons, ['SHAPE@XY', 'OID@'])
-        total_rows = int(arcpy.GetCount_management(polygons).getOutput(0))
         row_num = 0
-        results = {}
-
-        for poly_row in poly_rows:
+        results = []
 
-            poly_centroid = poly_row[0]
-            polygon_id = poly_row[1]
+        for polygon, polygon_results in nearest:
 
             row_num += 1
-            messages.addMessage("{} > Processing feature {} of {} with {} = {}".format(datetime.now().strftime("%H:%M:%S%f")[:-3], row_num, total_rows, polygon_id_field, polygon_id))
-            # messages.addMessage("Processing feature ID = {}".format(polygon_id))
-
-            if arcpy.Exists(tmp_poly_lyr):
-                arcpy.Delete_management(tmp_poly_lyr)
-
-            where = '"{}" = {}'.format(polygon_id_field, polygon_id)
-            try:
-                arcpy.MakeFeatureLayer_management(polygons, tmp_poly_lyr, where)
-                # messages.addMessage("Temp layer for feature ID = {} created".format(polygon_id))
-            except:
-                messages.AddWarning("Could not created temp layer for feature ID = {}".format(polygon_id))
-                continue
+            if row_num % PROGRESS_INTERVAL == 0 or row_num == total_rows:
+                messages.addMessage("{} > Processed feature {} of {}".format(timestamp(), row_num, total_rows))
+
+            results.extend(polygon_results)
+
+        messages.addMessage("{} > {} nearest points found".format(timestamp(), len(results)))
+
+        if not results:
+            return
+
+        result_ds_name = "nearest_to_centroid_in_containing_polygon"
+        out_is_folder = arcpy.Describe(out_ws).workspaceType == "FileSystem"
+
+        try:
+            if out_format == "Feature Class":
+                if out_is_folder:
+                    result_ds_name += ".shp"
+                result_ds_name = make_output_name(result_ds_name, out_ws)
+                count = write_feature_class(points, results, polygon_ids, result_ds_name, field_type(polygons, polygon_id_field))
+            else:
+                # text outputs cannot live inside a geodatabase, so they go alongside it
+                out_folder = out_ws if out_is_folder else os.path.dirname(out_ws)
+                result_ds_name = make_output_name(result_ds_name + OUTPUT_EXTENSIONS[out_format], out_folder)
+                rows = result_rows(results, polygon_ids, point_data, point_id_field)
+                if out_format == "CSV":
+                    count = write_csv(result_ds_name, rows)
+                else:
+                    count = write_geojson(result_ds_name, rows, arcpy.Describe(points).spatialReference.name)
+            messages.addMessage("Result dataset '{}' created with {} records".format(result_ds_name, count))
+        except Exception as e:
+            messages.addErrorMessage("Error creating result dataset '{}' : {}".format(result_ds_name, e))
+
+        return
 
-            arcpy.SelectLayerByLocation_management(points, "WITHIN", tmp_poly_lyr)
 
-            count = int(arcpy.GetCount_management(points).getOutput(0))
-            # messages.addMessage("{} points within polygon".format(count))
-            if count == 0:
+def read_polygons(polygons, id_field):
+
+    # read every polygon in one cursor pass, 'SHAPE@XY' is the centroid
+    rows, ids = [], {}
+    with arcpy.da.SearchCursor(polygons, ['OID@', 'SHAPE@XY', 'SHAPE@', id_field]) as cursor:
+        for oid, centroid, shape, polygon_id in cursor:
+            if shape is None:
                 continue
+            rows.append(Polygon(oid, centroid, geometry_parts(shape)))
+            ids[oid] = polygon_id
 
-            point_search_cursor = arcpy.da.SearchCursor(points, ['SHAPE@', 'OID@'])
+    return rows, ids
 
-            poly_centroid_pt = arcpy.Point()
-            poly_centroid_pt.X, poly_centroid_pt.Y = poly_centroid
 
-            dists = [(row[1], row[0].distanceTo(poly_centroid_pt)) for row in point_search_cursor]
-            # messages.addMessage("distances are {}".format(dists))
+def write_feature_class(points, results, polygon_ids, out_name, polygon_id_type):
 
-            min_dist = min([dist for oid, dist in dists])
-            minimums = [(oid, dist) for oid, dist in dists if dist == min_dist]
-            # messages.addMessage("minimum is {}".format(minimums))
+    # the output keeps the point schema and adds the containing polygon's ID, the distance to its centroid and its rank
+    out_ws, out_fc = os.path.split(out_name)
+    arcpy.CreateFeatureclass_management(out_ws, out_fc, "POINT", template=points, spatial_reference=arcpy.Describe(points).spatialReference)
+    arcpy.AddField_management(out_name, POLYGON_ID_FIELD, polygon_id_type)
+    arcpy.AddField_management(out_name, DISTANCE_FIELD, "DOUBLE")
+    arcpy.AddField_management(out_name, RANK_FIELD, "LONG")
 
-            # if len(minimums) > 1:
-            #     messages.addMessage("multiple minimum distances, taking first found as result".format(minimums))
+    in_fields = {f.name for f in arcpy.ListFields(points)}
+    copy_fields = [f.name for f in arcpy.ListFields(out_name) if f.editable and f.type not in ["OID", "Geometry"] and f.name in in_fields]
 
-            minimums = minimums[0]
-            # messages.addMessage("Result is PointID = {} Distance = {}".format(*minimums))
+    winners = {}
+    for result in results:
+        winners.setdefault(result.point_oid, []).append(result)
 
-            results[minimums[0]] = minimums[1]
+    # one pass over the points streams the winners into the output, a point ranked for several polygons is written once per polygon
+    count = 0
+    with arcpy.da.SearchCursor(points, ['OID@', 'SHAPE@'] + copy_fields) as search_cursor, \
+            arcpy.da.InsertCursor(out_name, ['SHAPE@'] + copy_fields + [POLYGON_ID_FIELD, DISTANCE_FIELD, RANK_FIELD]) as insert_cursor:
+        for row in search_cursor:
+            for result in winners.get(row[0], []):
+                insert_cursor.insertRow(list(row[1:]) + [polygon_ids[result.polygon_oid], result.distance, result.rank])
+                count += 1
 
-        if results:
-            where = '"{}" IN {}'.format(point_id_field, tuple(results.keys()))
+    return count
 
-            arcpy.SelectLayerByAttribute_management(points, "NEW_SELECTION", where)
 
-            result_ds_name = "nearest_to_centroid_in_containing_polygon"
-            if arcpy.Describe(out_ws).workspaceType == "FileSystem":
-                result_ds_name += ".shp"
-            result_ds_name = arcpy.ValidateTableName(result_ds_name, out_ws)
-            result_ds_name = arcpy.CreateUniqueName(result_ds_name, out_ws)
-            result_ds_name = os.path.join(out_ws, result_ds_name)
+def result_rows(results, polygon_ids, point_data, point_id_field):
 
-            try:
-                arcpy.CopyFeatures_management(points, result_ds_name)
-                messages.addMessage("Result dataset '{}' created".format(result_ds_name))
-            except Exception as e:
-                messages.addErrorMessage("Error creating result dataset '{}' : {}".format(result_ds_name, e))
-                messages.addMessage("*** Export the selection in layer '{}' to save the results".format(points))
+    # (point_id, polygon_id, distance, rank, x, y) rows for the text outputs
+    order = numpy.argsort(point_data['OID@'])
+    indices = order[numpy.searchsorted(point_data['OID@'], [result.point_oid for result in results], sorter=order)]
+    for result, i in zip(results, indices):
+        yield point_data[point_id_field][i].item(), polygon_ids[result.polygon_oid], result.distance, result.rank, point_data['SHAPE@X'][i].item(), point_data['SHAPE@Y'][i].item()
 
-        return
 
+def cache_file(cache_folder, polygons, points):
+
+    # one cache per pair of input datasets
+    key = "{}|{}".format(arcpy.Describe(polygons).catalogPath, arcpy.Describe(points).catalogPath).lower()
+
+    return os.path.join(cache_folder, "nearest_centroid_{}.npz".format(hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]))
+
+
+def field_type(dataset, field_name):
+
+    field = arcpy.ListFields(dataset, field_name)[0]
+
+    return FIELD_TYPES.get(field.type, "TEXT")
+
+
+def make_output_name(like_name, out_ws):
+
+    like_name = arcpy.ValidateTableName(like_name, out_ws)
+    like_name = arcpy.CreateUniqueName(like_name, out_ws)
+
+    return os.path.join(out_ws, like_name)
+
+
+def timestamp():
+
+    return datetime.now().strftime("%H:%M:%S%f")[:-3]
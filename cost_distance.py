@@ -0,0 +1,386 @@
+import array
+import heapq
+import numpy
+import os
+import shutil
+import sys
+import tempfile
+from math import sqrt
+from multiprocessing import Pool, cpu_count
+from cost_distance_cache import write_surface
+
+# cells with this value in the cost grid are barriers, as NoData is for CostDistance
+NODATA = numpy.nan
+
+# value groups per worker in parallel runs, more groups than workers evens out the load
+GROUPS_PER_WORKER = 4
+
+# a binary heap suits any costs, a bucket queue suits costs within a modest range of each other such as small integer
+# classes, falling back to the heap when they are not
+ALGORITHMS = ["Heap", "Bucket"]
+
+# most buckets the bucket queue cycles through, past this the heap is used
+MAX_BUCKETS = 1 << 16
+
+# how a block of cells is combined into one when the grid is coarsened
+AGGREGATIONS = ["Mean", "Max"]
+
+
+def neighbour_steps(width, cell_size):
+
+    # flat index offsets of the 8 neighbours in a grid of the given width, with the factor applied to the mean of the
+    # two cells' costs, as in ArcGIS: cell size for the 4 orthogonal moves, cell size * sqrt(2) for the diagonals
+    orthogonal = cell_size / 2.0
+    diagonal = cell_size * sqrt(2.0) / 2.0
+
+    return [(-width - 1, diagonal), (-width, orthogonal), (-width + 1, diagonal),
+            (-1, orthogonal), (1, orthogonal),
+            (width - 1, diagonal), (width, orthogonal), (width + 1, diagonal)]
+
+
+def to_array(values):
+
+    # a flat array.array of doubles indexes from pure python far faster than a numpy array does
+    a = array.array("d")
+    data = numpy.ascontiguousarray(values, dtype=numpy.float64).ravel()
+    if hasattr(a, "frombytes"):
+        a.frombytes(data.tobytes())
+    else:
+        a.fromstring(data.tostring())
+
+    return a
+
+
+def flat_view(values, shared=False):
+
+    # python 3 memoryviews index as floats, so the grid is used in place; python 2 memoryviews index as bytes, so it
+    # gets a compact copy, unless the grid is shared between processes, which python 2 indexes in place, more slowly
+    values = numpy.ascontiguousarray(values, dtype=numpy.float64).ravel()
+    if sys.version_info[0] >= 3:
+        return memoryview(values)
+    if shared:
+        return values
+
+    return to_array(values)
+
+
+def pad(grid, value):
+
+    # a one cell border means neighbour lookups never fall off the grid
+    padded = numpy.empty((grid.shape[0] + 2, grid.shape[1] + 2), dtype=numpy.float64)
+    padded.fill(value)
+    padded[1:-1, 1:-1] = grid
+
+    return padded
+
+
+def dijkstra(costs, dist, seeds, steps, limit=numpy.inf):
+
+    # propagates from the seed cells, whose distances are already set in dist, through costs (NaN cells are barriers),
+    # nothing beyond limit is ever queued so propagation stops as soon as the whole frontier passes it
+    heap = [(dist[i], i) for i in seeds]
+    heapq.heapify(heap)
+    heappush, heappop = heapq.heappush, heapq.heappop
+
+    while heap:
+        d, i = heappop(heap)
+        if d > dist[i]:
+            continue
+        ci = costs[i]
+        for offset, factor in steps:
+            j = i + offset
+            cj = costs[j]
+            if cj != cj:
+                continue
+            nd = d + factor * (ci + cj)
+            if nd < dist[j] and nd <= limit:
+                dist[j] = nd
+                heappush(heap, (nd, j))
+
+    return dist
+
+
+def bucket_layout(steps, min_cost, max_cost):
+
+    # (bucket width, bucket count) for the bucket queue or None where it does not fit, with buckets as wide as the
+    # cheapest possible step no cell can improve another in the same bucket, so distances are exact, as the heap's
+    factors = [factor for offset, factor in steps]
+    if min_cost <= 0 or not numpy.isfinite(max_cost):
+        return None
+
+    width = 2.0 * min(factors) * min_cost
+    count = int(2.0 * max(factors) * max_cost / width) + 2
+    if count > MAX_BUCKETS:
+        return None
+
+    return width, count
+
+
+def dial(costs, dist, seeds, steps, limit, width, count):
+
+    # dijkstra with the heap replaced by a ring of count buckets each width wide, every step lands at least one bucket
+    # on and at most count - 1 buckets on; seeds may be spread further apart, so they join the ring as it reaches them
+    scale = 1.0 / width
+    seeds = sorted((dist[i], i) for i in seeds)
+    ring = [[] for _ in range(count)]
+    queued, s = 0, 0
+    k = int(seeds[0][0] * scale) if seeds else 0
+
+    while True:
+        while s < len(seeds) and int(seeds[s][0] * scale) < k + count:
+            d, i = seeds[s]
+            ring[max(int(d * scale), k) % count].append((d, i))
+            queued += 1
+            s += 1
+        if not queued:
+            if s == len(seeds):
+                break
+            k = int(seeds[s][0] * scale)
+            continue
+
+        bucket = ring[k % count]
+        ring[k % count] = []
+        queued -= len(bucket)
+        k += 1
+
+        for d, i in bucket:
+            if d > dist[i]:
+                continue
+            ci = costs[i]
+            for offset, factor in steps:
+                j = i + offset
+                cj = costs[j]
+                if cj != cj:
+                    continue
+                nd = d + factor * (ci + cj)
+                if nd < dist[j] and nd <= limit:
+                    dist[j] = nd
+                    ring[max(int(nd * scale), k) % count].append((nd, j))
+                    queued += 1
+
+    return dist
+
+
+def propagate(costs, dist, seeds, steps, limit=numpy.inf, algorithm="Heap", min_cost=0.0, max_cost=numpy.inf):
+
+    # the chosen algorithm where it fits the costs, the heap otherwise, both give the same distances
+    layout = bucket_layout(steps, min_cost, max_cost) if algorithm == "Bucket" else None
+    if layout:
+        return dial(costs, dist, seeds, steps, limit, *layout)
+
+    return dijkstra(costs, dist, seeds, steps, limit)
+
+
+class CostSurface(object):
+
+    def __init__(self, cost, cell_size=1.0, padded=False, algorithm="Heap"):
+
+        # cost is a 2d array with NaN for NoData, or one already padded with a NaN border by pad() when padded is set,
+        # which lets a memory-mapped grid be shared between processes without copying it
+        self.grid = numpy.asarray(cost, dtype=numpy.float64) if padded else pad(numpy.asarray(cost, dtype=numpy.float64), NODATA)
+        self.shape = self.grid.shape[0] - 2, self.grid.shape[1] - 2
+        self.width = self.grid.shape[1]
+        self.cell_size = float(cell_size)
+        self.costs = flat_view(self.grid, shared=padded)
+        self.steps = neighbour_steps(self.width, self.cell_size)
+        self.algorithm = algorithm
+
+        # fmin and fmax skip NaN without a copy of the valid cells, which a shared grid would otherwise cost
+        self.min_cost = float(numpy.fmin.reduce(self.grid, axis=None))
+        self.max_cost = float(numpy.fmax.reduce(self.grid, axis=None))
+        if numpy.isnan(self.min_cost):
+            self.min_cost, self.max_cost = 0.0, 0.0
+
+        return
+
+    def window(self, cells, max_distance=None):
+
+        # (row0, row1, col0, col1) bounding every cell that can lie within max_distance of the source cells (flat
+        # indices into the unpadded grid), no step costs less than cell size * the minimum cost, so that is the
+        # sources' extent grown by max_distance over that
+        rows, cols = self.shape
+        if max_distance in [None, ""] or self.min_cost <= 0:
+            return 0, rows, 0, cols
+
+        if not len(cells):
+            return 0, 0, 0, 0
+
+        source_rows, source_cols = numpy.asarray(cells) // cols, numpy.asarray(cells) % cols
+        reach = int(float(max_distance) // (self.cell_size * self.min_cost)) + 1
+
+        return (max(int(source_rows.min()) - reach, 0), min(int(source_rows.max()) + reach + 1, rows),
+                max(int(source_cols.min()) - reach, 0), min(int(source_cols.max()) + reach + 1, cols))
+
+    def windowed_distance(self, sources, max_distance=None):
+
+        # the cost distance over just the window the sources can reach, and the (row, col) of that window in the grid
+        sources = numpy.asarray(sources, dtype=bool)
+        if sources.shape != self.shape:
+            raise ValueError("Cost grid {} and source grid {} differ in shape".format(self.shape, sources.shape))
+
+        return self.cells_distance(numpy.flatnonzero(sources), max_distance)
+
+    def cells_distance(self, cells, max_distance=None):
+
+        # as windowed_distance, from the flat indices of the source cells, so seeding costs only the cells themselves
+        cells = numpy.asarray(cells, dtype=numpy.int64)
+        row0, row1, col0, col1 = self.window(cells, max_distance)
+        source_rows, source_cols = cells // self.shape[1], cells % self.shape[1]
+
+        sources = numpy.zeros((row1 - row0, col1 - col0), dtype=bool)
+        sources[source_rows - row0, source_cols - col0] = True
+
+        if (row0, row1, col0, col1) == (0,) + self.shape[:1] + (0,) + self.shape[1:]:
+            return self.distance(sources, max_distance), (0, 0)
+
+        window = CostSurface(self.grid[1 + row0:1 + row1, 1 + col0:1 + col1], self.cell_size, algorithm=self.algorithm)
+
+        return window.distance(sources, max_distance), (row0, col0)
+
+    def distance(self, sources, max_distance=None):
+
+        # accumulated least cost from the nearest source cell, NaN where unreachable or beyond max_distance,
+        # sources is a boolean array of the unpadded shape
+        sources = numpy.asarray(sources, dtype=bool)
+        if sources.shape != self.shape:
+            raise ValueError("Cost grid {} and source grid {} differ in shape".format(self.shape, sources.shape))
+
+        seeds = numpy.flatnonzero(pad(sources, False).astype(bool) & ~numpy.isnan(self.grid)).tolist()
+        dist = to_array(numpy.full(self.grid.size, numpy.inf))
+        for i in seeds:
+            dist[i] = 0.0
+
+        limit = numpy.inf if max_distance in [None, ""] else float(max_distance)
+        propagate(self.costs, dist, seeds, self.steps, limit, self.algorithm, self.min_cost, self.max_cost)
+
+        result = numpy.frombuffer(dist, dtype=numpy.float64).reshape(self.grid.shape)[1:-1, 1:-1].copy()
+        result[numpy.isinf(result)] = numpy.nan
+
+        return result
+
+
+def cost_distance(cost, sources, cell_size=1.0, max_distance=None, algorithm="Heap"):
+
+    return CostSurface(cost, cell_size, algorithm=algorithm).distance(sources, max_distance)
+
+
+def accumulate(total, surface, weight=1.0, offset=(0, 0)):
+
+    # adds a weighted cost surface, placed at the (row, col) offset, into a running total in place,
+    # NoData counts as zero as Con(IsNull(r), 0, r) did
+    row0, col0 = offset
+    target = total[row0:row0 + surface.shape[0], col0:col0 + surface.shape[1]]
+    reached = ~numpy.isnan(surface)
+    target[reached] += weight * surface[reached]
+
+    return total
+
+
+def expand(surface, offset, shape):
+
+    # a windowed cost surface on the full grid, NoData outside the window
+    full = numpy.empty(shape, dtype=numpy.float64)
+    full.fill(numpy.nan)
+    row0, col0 = offset
+    full[row0:row0 + surface.shape[0], col0:col0 + surface.shape[1]] = surface
+
+    return full
+
+
+def coarsen(grid, factor, method="Mean"):
+
+    # each factor x factor block from the top left as one cell, NoData cells are ignored and an all NoData block is
+    # NoData, blocks overhanging the right and bottom edges use the cells they have
+    grid = numpy.asarray(grid, dtype=numpy.float64)
+    if factor <= 1:
+        return grid
+
+    rows, cols = -(-grid.shape[0] // factor), -(-grid.shape[1] // factor)
+    blocks = numpy.empty((rows * factor, cols * factor), dtype=numpy.float64)
+    blocks.fill(numpy.nan)
+    blocks[:grid.shape[0], :grid.shape[1]] = grid
+    blocks = blocks.reshape(rows, factor, cols, factor)
+
+    valid = ~numpy.isnan(blocks)
+    count = valid.sum(axis=(1, 3))
+    if method == "Max":
+        combined = numpy.where(valid, blocks, -numpy.inf).max(axis=(1, 3))
+    else:
+        combined = numpy.where(valid, blocks, 0.0).sum(axis=(1, 3)) / numpy.maximum(count, 1)
+
+    return numpy.where(count > 0, combined, numpy.nan)
+
+
+def coarsen_cells(cells, factor, width):
+
+    # flat cell indices in a grid of the given width mapped to the cells holding them once it is coarsened, so every
+    # value keeps its sources even where several share a block
+    cells = numpy.asarray(cells, dtype=numpy.int64)
+
+    return numpy.unique((cells // width // factor) * -(-width // factor) + (cells % width) // factor)
+
+
+def parallel_cost_distance_sum(total, cost, index, values, weights, cell_size=1.0, max_distance=None, workers=None, keep_folder=None, cache_paths=None,
+                               algorithm="Heap"):
+
+    # computes the cost surface of each value in a pool of processes and adds them into total, yielding
+    # (values summed, values failed, [(value, kept surface .npy path)]) as each group of values finishes;
+    # index maps each value to its source cells as rasterize.value_index gives it, the padded cost grid is written
+    # once to a memory-mapped file every worker reads from; cache_paths maps values to where their surfaces are cached
+    if not len(values):
+        return
+
+    workers = workers or cpu_count()
+    scratch = tempfile.mkdtemp(prefix="cost_distance_")
+
+    try:
+        cost_path = os.path.join(scratch, "cost.npy")
+        numpy.save(cost_path, pad(numpy.asarray(cost, dtype=numpy.float64), NODATA))
+        empty = numpy.empty(0, dtype=numpy.int64)
+        cache_paths = cache_paths or {}
+
+        # a few groups per worker balances uneven groups, each group keeps a single partial sum
+        groups = min(len(values), workers * GROUPS_PER_WORKER)
+        jobs = [(cost_path, [index.get(float(v), empty) for v in values[g::groups]], list(values[g::groups]), list(weights[g::groups]),
+                 cell_size, max_distance, os.path.join(scratch, "partial_{}.npy".format(g)), keep_folder,
+                 [cache_paths.get(v) for v in values[g::groups]], algorithm) for g in range(groups)]
+
+        pool = Pool(workers)
+        try:
+            for done, failed, partial_path, kept in pool.imap_unordered(_sum_group, jobs):
+                total += numpy.load(partial_path)
+                os.remove(partial_path)
+                yield done, failed, kept
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _sum_group(job):
+
+    cost_path, cells, values, weights, cell_size, max_distance, partial_path, keep_folder, cache_paths, algorithm = job
+
+    surface = CostSurface(numpy.load(cost_path, mmap_mode="r"), cell_size, padded=True, algorithm=algorithm)
+    partial = numpy.zeros(surface.shape, dtype=numpy.float64)
+    done, failed, kept = [], [], []
+
+    for value_cells, value, weight, cache_path in zip(cells, values, weights, cache_paths):
+        try:
+            cost, offset = surface.cells_distance(value_cells, max_distance)
+        except Exception:
+            failed.append(value)
+            continue
+        accumulate(partial, cost, weight, offset)
+        done.append(value)
+        if cache_path:
+            write_surface(cache_path, cost, offset)
+        if keep_folder:
+            path = os.path.join(keep_folder, "{}_{}.npy".format(os.path.splitext(os.path.basename(partial_path))[0], len(done)))
+            numpy.save(path, expand(cost, offset, surface.shape))
+            kept.append((value, path))
+
+    numpy.save(partial_path, partial)
+
+    return done, failed, partial_path, kept
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import numpy
+
+# bumped whenever the layout of the cached surfaces changes, older entries then simply never match
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_MB = 1024
+
+# rows hashed at a time, so a large or memory-mapped grid is never copied whole
+HASH_BLOCK_CELLS = 1 << 22
+
+
+def grid_hash(grid):
+
+    # sha1 of a grid's shape and values, computed over blocks of rows
+    grid = numpy.asarray(grid)
+    h = hashlib.sha1(str(grid.shape).encode("ascii"))
+    step = max(1, HASH_BLOCK_CELLS // max(grid.shape[1] if grid.ndim > 1 else 1, 1))
+    for row in range(0, grid.shape[0], step):
+        h.update(numpy.ascontiguousarray(grid[row:row + step], dtype=numpy.float64).tobytes())
+
+    return h.hexdigest()
+
+
+def surface_key(cells, cost_hash, cell_size, max_distance):
+
+    # a value's surface depends only on where its sources are and on the grid it spreads over, so the value itself
+    # is left out and values with identical sources share an entry
+    h = hashlib.sha1("{}|{}|{!r}|{!r}|".format(CACHE_VERSION, cost_hash, float(cell_size),
+                                               None if max_distance in [None, ""] else float(max_distance)).encode("ascii"))
+    h.update(numpy.ascontiguousarray(cells, dtype=numpy.int64).tobytes())
+
+    return h.hexdigest()
+
+
+def write_surface(path, surface, offset):
+
+    # written under a temporary name and moved into place, so a reader never sees a half written entry; an entry
+    # that cannot be written only costs a recompute next time, so that is not an error
+    temp = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(temp, "wb") as f:
+            numpy.savez_compressed(f, surface=surface, offset=numpy.asarray(offset, dtype=numpy.int64))
+        if os.path.exists(path):
+            os.remove(temp)
+        else:
+            os.rename(temp, path)
+    except (IOError, OSError):
+        return None
+
+    return path
+
+
+class SurfaceCache(object):
+
+    def __init__(self, folder, max_mb=DEFAULT_CACHE_MB):
+
+        # one compressed .npz per surface, named by its key, the least recently used are evicted past max_mb
+        self.folder = folder
+        self.max_bytes = int(float(max_mb or DEFAULT_CACHE_MB) * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        return
+
+    def path(self, key):
+
+        return os.path.join(self.folder, "cost_{}.npz".format(key))
+
+    def get(self, key):
+
+        # (surface, offset) or None, a hit is touched so it counts as recently used
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = numpy.load(f)
+                surface, offset = data["surface"], tuple(int(i) for i in data["offset"])
+        except (IOError, OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+
+        os.utime(path, None)
+        self.hits += 1
+
+        return surface, offset
+
+    def put(self, key, surface, offset):
+
+        return write_surface(self.path(key), surface, offset)
+
+    def evict(self):
+
+        # drops the least recently used entries until the cache fits its size cap, returns how many went
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.startswith("cost_") and name.endswith(".npz"):
+                path = os.path.join(self.folder, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()
+        total = sum(size for mtime, size, path in entries)
+        evicted = 0
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            evicted += 1
+
+        return evicted
@@ -0,0 +1,236 @@
+import csv
+import filecmp
+import os
+import re
+import sys
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from multiprocessing import cpu_count
+from maxent_progress import STDOUT_LOG, open_log, stream_process
+
+try:
+    from queue import Empty, Queue
+except ImportError:
+    from Queue import Empty, Queue
+
+# share of physical memory the Maxent heaps may take together when no limit is given
+MEMORY_FRACTION = 0.75
+
+# seconds between checks on the running models
+POLL_SECONDS = 0.5
+
+# the boolean Maxent flags the tool passes through, by parameter name
+FLAGS = [("responsecurves", "responsecurves"), ("pictures", "pictures"), ("jacknife", "jackknife"), ("skipifexists", "skipifexists"),
+         ("warnings", "warnings"), ("autorun", "autorun"), ("verbose", "verbose"), ("cache_layers", "cache")]
+
+STATUS_FIELDS = ["species", "status", "return_code", "seconds", "output_directory", "log"]
+
+# one species, or one samples file, to model
+MaxentJob = namedtuple("MaxentJob", ["species", "samples", "output_directory", "command"])
+
+# how a job ended
+JobStatus = namedtuple("JobStatus", ["species", "status", "return_code", "seconds", "output_directory", "log"])
+
+
+def safe_name(name):
+
+    return re.sub(r"[^\w\-.]+", "_", name.strip()) or "species"
+
+
+def open_text(path, mode):
+
+    # the csv module wants binary files on python 2 and untranslated newlines on python 3
+    if sys.version_info[0] < 3:
+        return open(path, mode + "b")
+
+    return open(path, mode, newline="")
+
+
+def split_samples(samples_csv, out_folder):
+
+    # {species: samples csv of its own} from one samples file of many species, the species in the first column
+    with open_text(samples_csv, "r") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = OrderedDict()
+        for row in reader:
+            if row and row[0].strip():
+                rows.setdefault(row[0].strip(), []).append(row)
+
+    files = OrderedDict()
+    for species, species_rows in rows.items():
+        folder = os.path.join(out_folder, safe_name(species))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        path = os.path.join(folder, "{}.csv".format(safe_name(species)))
+
+        # the file is in the species' output directory, so an unchanged one is left alone rather than rewritten with
+        # a new modification time that would make a cached run of the species look changed
+        temp = "{}.{}.tmp".format(path, os.getpid())
+        with open_text(temp, "w") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(species_rows)
+        if os.path.exists(path) and filecmp.cmp(temp, path, shallow=False):
+            os.remove(temp)
+        else:
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(temp, path)
+        files[species] = path
+
+    return files
+
+
+def maxent_command(pars, samplesfile, outputdirectory):
+
+    # the Maxent command line as an argument list, so paths need no quoting; a .jar runs in java with the memory
+    # commitment as its heap, anything else (maxent.bat, or a stub standing in for Maxent) runs directly
+    runnable = pars["jar"]
+    if runnable.lower().endswith(".jar"):
+        command = ["java", "-mx{}m".format(pars["mem"]), "-jar", runnable]
+    else:
+        command = [runnable]
+
+    command += ["samplesfile={}".format(samplesfile), "environmentallayers={}".format(pars["environmentallayers"]),
+                "outputdirectory={}".format(outputdirectory), "outputformat={}".format(pars["outputformat"]),
+                "outputfiletype={}".format(pars["outputfiletype"])]
+    if pars.get("projection_layers") and not pars.get("parallel_projection"):
+        command.append("projectionlayers={}".format(pars["projection_layers"]))
+    command += [flag for name, flag in FLAGS if pars.get(name)]
+    if pars.get("threads"):
+        command.append("threads={}".format(pars["threads"]))
+
+    return command
+
+
+def batch_jobs(pars, samples):
+
+    # a job per species of a samples csv, or per csv in a folder, each with an output directory of its own
+    out_dir = pars["outputdirectory"]
+    if os.path.isdir(samples):
+        files = OrderedDict((os.path.splitext(fn)[0], os.path.join(samples, fn)) for fn in sorted(os.listdir(samples)) if fn.lower().endswith(".csv"))
+    else:
+        files = split_samples(samples, out_dir)
+
+    jobs = []
+    for species, path in files.items():
+        folder = os.path.join(out_dir, safe_name(species))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        jobs.append(MaxentJob(species, path, folder, maxent_command(pars, path, folder)))
+
+    return jobs
+
+
+def physical_memory_mb():
+
+    # total physical memory, or None where it cannot be found
+    try:
+        if os.name == "nt":
+            import ctypes
+
+            class MemoryStatus(ctypes.Structure):
+                _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong), ("ullTotalPhys", ctypes.c_ulonglong),
+                            ("ullAvailPhys", ctypes.c_ulonglong), ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                            ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong), ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+            status = MemoryStatus()
+            status.dwLength = ctypes.sizeof(MemoryStatus)
+            ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status))
+            return status.ullTotalPhys // (1024 * 1024)
+
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def concurrent_jobs(heap_mb, memory_mb=None, cores=None, threads=1):
+
+    # as many models at once as both the summed heaps and the cores allow, and never fewer than one
+    memory_mb = memory_mb or int((physical_memory_mb() or heap_mb) * MEMORY_FRACTION)
+    cores = cores or cpu_count()
+
+    return max(1, min(int(memory_mb) // max(int(heap_mb), 1), int(cores) // max(int(threads), 1)))
+
+
+def run_batch(jobs, slots, poll=POLL_SECONDS, on_progress=None):
+
+    # runs the jobs, slots at a time, each streaming its output to the rotating log in its output directory as a
+    # single run does, and yields a JobStatus for each as it finishes; on_progress(job, progress dict) is called on
+    # the caller's thread with what a job's output reports
+    pending = list(enumerate(jobs))
+    running, processes = {}, {}
+    events = Queue()
+    cancelled = threading.Event()
+
+    try:
+        while pending or running:
+            while pending and len(running) < slots:
+                index, job = pending.pop(0)
+                running[index] = (job, time.time())
+                thread = threading.Thread(target=run_job, args=(index, job, events, processes, cancelled))
+                thread.daemon = True
+                thread.start()
+
+            # woken now and then so a cancelled tool is noticed while every model is busy
+            try:
+                event, index, value = events.get(timeout=poll)
+            except Empty:
+                continue
+
+            job, started = running[index]
+            if event == "progress":
+                if on_progress:
+                    on_progress(job, value)
+                continue
+
+            del running[index]
+            log_path = os.path.join(job.output_directory, STDOUT_LOG)
+            if event == "not started":
+                yield JobStatus(job.species, "not started", None, 0.0, job.output_directory, log_path)
+            else:
+                yield JobStatus(job.species, "success" if value == 0 else "failure", value, round(time.time() - started, 1), job.output_directory, log_path)
+    finally:
+        # a cancelled batch does not leave models running, one about to start is stopped as it does
+        cancelled.set()
+        for index in running:
+            process = processes.get(index)
+            if process is not None and process.poll() is None:
+                process.kill()
+
+
+def run_job(index, job, events, processes, cancelled):
+
+    # runs on a thread of its own, reports (event, index, value) to run_batch: "progress" with the progress so far,
+    # then "finished" with the return code or "not started"
+    log_path = os.path.join(job.output_directory, STDOUT_LOG)
+
+    def started(process):
+        processes[index] = process
+        if cancelled.is_set():
+            process.kill()
+
+    try:
+        code = stream_process(job.command, log_path, lambda progress: events.put(("progress", index, progress)), on_start=started)
+    except OSError as e:
+        logger, handler = open_log(log_path)
+        logger.info("Could not start {}: {}".format(job.command[0], e))
+        logger.removeHandler(handler)
+        handler.close()
+        events.put(("not started", index, None))
+        return
+
+    events.put(("finished", index, code))
+
+
+def write_status_table(path, statuses):
+
+    with open_text(path, "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(STATUS_FIELDS)
+        for status in statuses:
+            writer.writerow(list(status))
+
+    return path
@@ -0,0 +1,147 @@
+import csv
+import os
+import re
+import shutil
+import tempfile
+import numpy
+from collections import OrderedDict
+from maxent_batch import open_text, safe_name
+from raster_io import EXTENSIONS, mappable, read_grid, write_bil_header
+
+# the threshold rules Maxent reports in maxentResults.csv, as "<rule> <output format> threshold" columns
+THRESHOLD_RULES = ["10 percentile training presence", "Minimum training presence", "Equal training sensitivity and specificity",
+                   "Maximum training sensitivity plus specificity", "Balance training omission, predicted area and threshold value",
+                   "Equate entropy of thresholded and original distributions"]
+
+# rows of every grid processed at a time, the memory used is a few blocks per grid whatever the grids' size
+BLOCK_ROWS = 512
+
+# NoData of the one byte class and count grids
+BYTE_NODATA = 255
+
+RESULTS_FILE = "maxentResults.csv"
+
+
+def threshold_column(fields, rule, output_format):
+
+    # the column of maxentResults.csv holding the rule's threshold in the output format's units, thresholds in
+    # other units would not apply to the prediction grids, raw output for one has no threshold columns
+    candidates = [field for field in fields if field.lower().startswith(rule.lower()) and field.lower().endswith("threshold")]
+    for field in candidates:
+        if output_format.lower() in field.lower():
+            return field
+
+    raise ValueError("No '{}' threshold column for {} output in {}, only {}".format(rule, output_format, RESULTS_FILE, candidates))
+
+
+def read_thresholds(results_csv, rule, output_format):
+
+    # {results row name: threshold} for the rule, e.g. {"species_0": 0.21, "species (average)": 0.2}
+    with open_text(results_csv, "r") as f:
+        reader = csv.DictReader(f)
+        column = threshold_column(reader.fieldnames, rule, output_format)
+        thresholds = OrderedDict()
+        for row in reader:
+            try:
+                thresholds[row[reader.fieldnames[0]]] = float(row[column])
+            except (TypeError, ValueError):
+                continue
+
+    return thresholds
+
+
+def threshold_groups(out_dir, thresholds, extension, folds=None):
+
+    # {species: [(grid path, threshold)]} of the prediction grids with a threshold in maxentResults.csv; Maxent's
+    # own replicates are <species>_<i> grids beside a "<species> (average)" row, the parallel replicates are
+    # replicate_<i>/<species> grids with <species>_<i> rows, of the folds given when some failed
+    grids = [(os.path.splitext(fn)[0], os.path.join(out_dir, fn)) for fn in sorted(os.listdir(out_dir)) if fn.endswith(extension)]
+    for folder in sorted(os.listdir(out_dir)):
+        match = re.match(r"replicate_(\d+)$", folder)
+        if match and (folds is None or int(match.group(1)) in folds) and os.path.isdir(os.path.join(out_dir, folder)):
+            grids += [("{}_{}".format(os.path.splitext(fn)[0], match.group(1)), os.path.join(out_dir, folder, fn))
+                      for fn in sorted(os.listdir(os.path.join(out_dir, folder))) if fn.endswith(extension)]
+
+    groups = OrderedDict()
+    for name, path in grids:
+        if name not in thresholds:
+            continue
+        base = re.sub(r"_\d+$", "", name)
+        species = base if "{} (average)".format(base) in thresholds else name
+        groups.setdefault(species, []).append((path, thresholds[name]))
+
+    return groups
+
+
+def threshold_ensemble(grids, thresholds, out_stem, block_rows=BLOCK_ROWS):
+
+    # streams aligned prediction grids a block of rows at a time and writes little endian BIL grids:
+    #   <out_stem>_mean and _stddev, float32, over the grids
+    #   <out_stem>_above, one byte, how many grids are at or above their own threshold
+    #   <out_stem>_binary, one byte, presence where the mean is at or above the mean threshold
+    # returns the paths written
+    scratch = tempfile.mkdtemp(prefix="maxent_postprocess_")
+    files, maps = [], []
+
+    try:
+        maps.extend(read_grid(mappable(path, scratch, str(i)), raw=True) for i, path in enumerate(grids))
+        header = maps[0].header
+        for path, grid in zip(grids, maps):
+            if grid.header[:5] != header[:5]:
+                raise ValueError("'{}' does not line up with '{}'".format(path, grids[0]))
+
+        thresholds = numpy.asarray(thresholds, dtype=numpy.float64).reshape(-1, 1, 1)
+        mean_threshold = float(thresholds.mean())
+        outputs = [("mean", "<f4", header), ("stddev", "<f4", header),
+                   ("above", "<u1", header._replace(nodata=BYTE_NODATA)), ("binary", "<u1", header._replace(nodata=BYTE_NODATA))]
+
+        paths, nodata = [], []
+        for name, dtype, out_header in outputs:
+            path = "{}_{}.bil".format(out_stem, name)
+            nodata.append(write_bil_header(path, out_header, dtype))
+            files.append(open(path, "wb"))
+            paths.append(path)
+
+        for row in range(0, header.nrows, block_rows):
+            block = numpy.empty((len(maps), min(block_rows, header.nrows - row), header.ncols), dtype=numpy.float64)
+            for i, grid in enumerate(maps):
+                block[i] = grid.data[row:row + block_rows]
+                if grid.header.nodata is not None:
+                    block[i][block[i] == grid.header.nodata] = numpy.nan
+
+            missing = numpy.isnan(block).any(axis=0)
+            mean = block.mean(axis=0)
+            with numpy.errstate(invalid="ignore"):
+                stddev = block.std(axis=0)
+                above = (block >= thresholds).sum(axis=0)
+                binary = mean >= mean_threshold
+
+            for f, value, no_value, (name, dtype, out_header) in zip(files, [mean, stddev, above, binary], nodata, outputs):
+                numpy.where(missing, no_value, value).astype(dtype).tofile(f)
+    finally:
+        for f in files:
+            f.close()
+        del maps[:]
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    return paths
+
+
+def postprocess(out_dir, rule, output_format, extension, folds=None, block_rows=BLOCK_ROWS):
+
+    # a thresholded ensemble per species of the prediction grids in out_dir, written to a postprocess folder in it,
+    # folds limits the parallel replicates to those that succeeded; returns {species: [paths]}
+    if ("." + extension) not in EXTENSIONS:
+        raise ValueError("Output file type '{}' cannot be read here, only {}".format(extension, EXTENSIONS))
+
+    thresholds = read_thresholds(os.path.join(out_dir, RESULTS_FILE), rule, output_format)
+    out_folder = os.path.join(out_dir, "postprocess")
+    if not os.path.isdir(out_folder):
+        os.makedirs(out_folder)
+
+    written = OrderedDict()
+    for species, members in threshold_groups(out_dir, thresholds, "." + extension, folds).items():
+        paths, values = zip(*members)
+        written[species] = threshold_ensemble(list(paths), list(values), os.path.join(out_folder, safe_name(species)), block_rows)
+
+    return written
@@ -0,0 +1,110 @@
+import logging
+import logging.handlers
+import re
+import subprocess
+import threading
+import time
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+# seconds between progress reports, however often Maxent prints
+PROGRESS_INTERVAL = 5.0
+
+# the rotating log of a run's console output in its output directory, a few files of this size are kept
+STDOUT_LOG = "maxent_stdout.log"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUPS = 3
+
+# what a progress report is made from, matched loosely as Maxent's wording differs between versions and options
+PROGRESS_PATTERNS = [("replicate", re.compile(r"replicate\s*#?\s*(\d+)", re.I)),
+                     ("iteration", re.compile(r"iteration\s*#?\s*(\d+)", re.I)),
+                     ("gain", re.compile(r"\bgain\b\D{0,20}?(-?\d+(?:\.\d+)?(?:[eE]-?\d+)?)", re.I)),
+                     ("species", re.compile(r"species\s*[:=]\s*(\S+)", re.I))]
+
+
+def parse_progress(line, progress):
+
+    # updates progress in place with anything the line reports, returns whether it did
+    changed = False
+    for key, pattern in PROGRESS_PATTERNS:
+        match = pattern.search(line)
+        if match and progress.get(key) != match.group(1):
+            progress[key] = match.group(1)
+            changed = True
+
+    return changed
+
+
+def progress_text(progress):
+
+    return ", ".join("{} {}".format(key, progress[key]) for key, pattern in PROGRESS_PATTERNS if key in progress)
+
+
+def open_log(path, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+
+    # a logger of its own writing bare lines to a rotating file, so a long verbose run never fills the disk
+    logger = logging.getLogger("maxent.{}".format(path))
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+
+    return logger, handler
+
+
+def read_lines(stream, name, queue):
+
+    # runs on a background thread, hands each line over as it arrives and None when the stream closes
+    for line in iter(stream.readline, b""):
+        queue.put((name, line.decode("utf-8", "replace").rstrip()))
+    stream.close()
+    queue.put((name, None))
+
+
+def stream_process(command, log_path, on_progress=None, on_stderr=None, interval=PROGRESS_INTERVAL, on_start=None):
+
+    # runs the command with its stdout and stderr read line by line on background threads, every line goes to the
+    # rotating log at log_path and none is held in memory, on_progress(progress dict) is called at most every
+    # interval seconds when something changed, on_stderr(line) for each stderr line, on_start(process) once it is
+    # running so a caller on another thread can stop it; returns the return code
+    logger, handler = open_log(log_path)
+    queue = Queue()
+    progress = {}
+
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if on_start:
+            on_start(process)
+        readers = [threading.Thread(target=read_lines, args=(process.stdout, "stdout", queue)),
+                   threading.Thread(target=read_lines, args=(process.stderr, "stderr", queue))]
+        for reader in readers:
+            reader.daemon = True
+            reader.start()
+
+        open_streams, reported, pending = len(readers), time.time(), False
+        while open_streams:
+            name, line = queue.get()
+            if line is None:
+                open_streams -= 1
+                continue
+
+            logger.info(line if name == "stdout" else "[stderr] " + line)
+            if name == "stderr" and on_stderr:
+                on_stderr(line)
+
+            pending = parse_progress(line, progress) or pending
+            if pending and on_progress and time.time() - reported >= interval:
+                on_progress(dict(progress))
+                reported, pending = time.time(), False
+
+        if pending and on_progress:
+            on_progress(dict(progress))
+
+        return process.wait()
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
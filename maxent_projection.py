@@ -0,0 +1,207 @@
+import os
+import shutil
+import tempfile
+import numpy
+from multiprocessing import Pool, cpu_count
+from raster_io import EXTENSIONS, mappable, read_grid, read_header, write_grid
+
+# the output formats a .lambdas file can be evaluated to cell by cell, cumulative needs every cell's raw value first
+PROJECTION_FORMATS = ["raw", "logistic", "cloglog"]
+
+# row bands per worker, a few each keeps the workers busy when bands differ in how much data they hold
+BANDS_PER_WORKER = 4
+
+# rows evaluated at a time inside a band, so a band's features never need more memory than this many rows
+BLOCK_ROWS = 256
+
+
+def parse_lambdas(path):
+
+    # ([(kind, variables, parameter, lambda, min, max)], {constant: value}) from a Maxent .lambdas file, features
+    # with a zero lambda are dropped as they add nothing; kinds are linear, quadratic, product, hinge, reverse_hinge,
+    # threshold and categorical, parameter is the threshold or the category
+    features, constants = [], {}
+    with open(path) as f:
+        for line in f:
+            parts = [part.strip() for part in line.split(",")]
+            if len(parts) == 2:
+                constants[parts[0]] = float(parts[1])
+                continue
+            if len(parts) != 4:
+                continue
+
+            name, weight, low, high = parts[0], float(parts[1]), float(parts[2]), float(parts[3])
+            if weight == 0.0:
+                continue
+
+            if name.startswith("'"):
+                feature = ("hinge", [name[1:]], None)
+            elif name.startswith("`"):
+                feature = ("reverse_hinge", [name[1:]], None)
+            elif name.startswith("(") and "<" in name:
+                threshold, variable = name[1:-1].split("<", 1)
+                feature = ("threshold", [variable], float(threshold))
+            elif name.startswith("(") and "=" in name:
+                variable, category = name[1:-1].split("=", 1)
+                feature = ("categorical", [variable], float(category))
+            elif name.endswith("^2"):
+                feature = ("quadratic", [name[:-2]], None)
+            elif "*" in name:
+                feature = ("product", name.split("*", 1), None)
+            else:
+                feature = ("linear", [name], None)
+
+            features.append(feature + (weight, low, high))
+
+    return features, constants
+
+
+def lambdas_variables(features):
+
+    names = []
+    for kind, variables, parameter, weight, low, high in features:
+        names.extend(v for v in variables if v not in names)
+
+    return names
+
+
+def feature_values(kind, values, parameter, low, high, clamp):
+
+    # a feature over a block of cells as Maxent computes it, scaled to 0-1 over its training range; clamping keeps
+    # scaled features inside that range, as Maxent's clamping of the variables does for linear features
+    span = (high - low) or 1.0
+    if kind == "threshold":
+        return (values[0] > parameter).astype(numpy.float64)
+    if kind == "categorical":
+        return (values[0] == parameter).astype(numpy.float64)
+    if kind == "hinge":
+        scaled = numpy.where(values[0] <= low, 0.0, (values[0] - low) / span)
+    elif kind == "reverse_hinge":
+        scaled = numpy.where(values[0] < high, (high - values[0]) / span, 0.0)
+    elif kind == "quadratic":
+        scaled = (values[0] * values[0] - low) / span
+    elif kind == "product":
+        scaled = (values[0] * values[1] - low) / span
+    else:
+        scaled = (values[0] - low) / span
+
+    return numpy.clip(scaled, 0.0, 1.0) if clamp else scaled
+
+
+def evaluate(features, constants, layers, output_format="cloglog", clamp=True):
+
+    # the model's prediction over blocks of the layers ({variable: array}, NoData as NaN), NaN wherever a variable
+    # the model uses is NoData
+    shape = list(layers.values())[0].shape
+    exponent = numpy.zeros(shape, dtype=numpy.float64)
+    with numpy.errstate(invalid="ignore"):
+        for kind, variables, parameter, weight, low, high in features:
+            exponent += weight * feature_values(kind, [layers[v] for v in variables], parameter, low, high, clamp)
+
+    raw = numpy.exp(exponent - constants.get("linearPredictorNormalizer", 0.0)) / constants.get("densityNormalizer", 1.0)
+    missing = numpy.zeros(shape, dtype=bool)
+    for values in layers.values():
+        missing |= numpy.isnan(values)
+
+    if output_format == "logistic":
+        scaled = raw * numpy.exp(constants.get("entropy", 0.0))
+        result = scaled / (1.0 + scaled)
+    elif output_format == "cloglog":
+        result = 1.0 - numpy.exp(-numpy.exp(constants.get("entropy", 0.0)) * raw)
+    else:
+        result = raw
+
+    result[missing] = numpy.nan
+
+    return result
+
+
+def projection_layers(folder, variables, scratch):
+
+    # {variable: path of a grid that can be memory-mapped} for the model's variables, ASCII grids are streamed once
+    # into .flt files in scratch so every band job maps them rather than parsing them; the layers must line up
+    found = {}
+    for fn in os.listdir(folder):
+        stem, extension = os.path.splitext(fn)
+        if stem in variables and extension.lower() in EXTENSIONS:
+            found[stem] = os.path.join(folder, fn)
+
+    missing = [v for v in variables if v not in found]
+    if missing:
+        raise ValueError("No projection layers in '{}' for the model's variables {}".format(folder, missing))
+
+    header = None
+    for variable in variables:
+        layer_header = read_header(found[variable])
+        header = header or layer_header
+        if layer_header[:5] != header[:5]:
+            raise ValueError("Projection layer '{}' does not line up with the others".format(found[variable]))
+        found[variable] = mappable(found[variable], scratch)
+
+    return found, header
+
+
+def project_lambdas(lambdas_path, layers_folder, out_path, output_format="cloglog", clamp=True, workers=None):
+
+    # the fitted model projected onto the layers folder in row bands evaluated by a pool of processes, each band
+    # written straight into its rows of a memory-mapped result, which is then written to out_path in the grid format
+    # its extension names; yields (bands done, bands) as bands finish
+    if output_format not in PROJECTION_FORMATS:
+        raise ValueError("Output format '{}' cannot be projected band by band, only {}".format(output_format, PROJECTION_FORMATS))
+
+    features, constants = parse_lambdas(lambdas_path)
+    workers = workers or cpu_count()
+    scratch = tempfile.mkdtemp(prefix="maxent_projection_")
+
+    try:
+        layers, header = projection_layers(layers_folder, lambdas_variables(features), scratch)
+        result_path = os.path.join(scratch, "projection.flt")
+        numpy.memmap(result_path, dtype="<f4", mode="w+", shape=(header.nrows, header.ncols)).flush()
+
+        band_rows = max(1, -(-header.nrows // (workers * BANDS_PER_WORKER)))
+        jobs = [(features, constants, layers, result_path, (header.nrows, header.ncols), row, min(row + band_rows, header.nrows), output_format, clamp)
+                for row in range(0, header.nrows, band_rows)]
+
+        pool = Pool(workers)
+        try:
+            for done, band in enumerate(pool.imap_unordered(_project_band, jobs), 1):
+                yield done, len(jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+        result = numpy.memmap(result_path, dtype="<f4", mode="r", shape=(header.nrows, header.ncols))
+        write_grid(out_path, result, header)
+        del result
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _project_band(job):
+
+    features, constants, layers, result_path, shape, row0, row1, output_format, clamp = job
+
+    grids = dict((variable, read_grid(path, raw=True)) for variable, path in layers.items())
+    result = numpy.memmap(result_path, dtype="<f4", mode="r+", shape=shape)
+    for row in range(row0, row1, BLOCK_ROWS):
+        end = min(row + BLOCK_ROWS, row1)
+        block = {}
+        for variable, grid in grids.items():
+            values = numpy.array(grid.data[row:end], dtype=numpy.float64)
+            if grid.header.nodata is not None:
+                values[values == grid.header.nodata] = numpy.nan
+            block[variable] = values
+        result[row:end] = evaluate(features, constants, block, output_format, clamp)
+    result.flush()
+    del result
+
+    return row0
+
+
+def projection_name(lambdas_path, layers_folder, extension):
+
+    # named as Maxent names a projection, <species>_<projection layers folder>
+    species = os.path.splitext(os.path.basename(lambdas_path))[0]
+    folder = os.path.basename(os.path.normpath(layers_folder))
+
+    return "{}_{}{}".format(species, folder, extension if extension in EXTENSIONS else ".asc")
@@ -0,0 +1,177 @@
+import csv
+import os
+import shutil
+import tempfile
+import numpy
+from collections import OrderedDict
+from maxent_batch import MaxentJob, maxent_command, open_text
+from raster_io import EXTENSIONS, mappable, read_grid, write_grid
+
+# summaries written for each prediction grid found in every replicate, as Maxent names them
+GRID_SUMMARIES = ["avg", "stddev", "min", "max"]
+
+RESULTS_FILE = "maxentResults.csv"
+
+# rows of every replicate's grid summarised at a time
+BLOCK_ROWS = 512
+
+# folds are dealt with a fixed seed so a rerun makes the same folds, as Maxent does unless randomseed is set; they are
+# dealt by numpy rather than by Maxent's own generator, so they are not the folds Maxent itself would make
+FOLD_SEED = 0
+
+
+def make_folds(samples_csv, replicates, out_folder, seed=FOLD_SEED):
+
+    # cross-validation folds as Maxent makes them, each species' samples dealt at random into replicates folds of
+    # near equal size; replicate i trains on every fold but i and is tested on fold i, returns
+    # [(replicate folder, training csv, test csv)]
+    with open_text(samples_csv, "r") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = [row for row in reader if row and row[0].strip()]
+
+    random = numpy.random.RandomState(seed)
+    fold = numpy.zeros(len(rows), dtype=numpy.int64)
+    species = numpy.array([row[0].strip() for row in rows])
+    for name in numpy.unique(species):
+        members = numpy.nonzero(species == name)[0]
+        fold[random.permutation(members)] = numpy.arange(len(members)) % replicates
+
+    folds = []
+    for i in range(replicates):
+        folder = os.path.join(out_folder, "replicate_{}".format(i))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        train, test = os.path.join(folder, "train.csv"), os.path.join(folder, "test.csv")
+        for path, keep in ((train, fold != i), (test, fold == i)):
+            with open_text(path, "w") as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                writer.writerows(row for row, k in zip(rows, keep) if k)
+        folds.append((folder, train, test))
+
+    return folds
+
+
+def replicate_jobs(pars, folds):
+
+    # one single replicate Maxent run per fold, tested on its held out samples
+    jobs = []
+    for i, (folder, train, test) in enumerate(folds):
+        command = maxent_command(pars, train, folder) + ["testsamplesfile={}".format(test), "replicates=1"]
+        jobs.append(MaxentJob("replicate {}".format(i), train, folder, command))
+
+    return jobs
+
+
+def merge_grids(folders, out_folder, block_rows=BLOCK_ROWS):
+
+    # avg, stddev, min and max of each grid every replicate wrote, written beside Maxent's own outputs as
+    # <name>_avg.<ext> and so on; the replicates' grids are memory-mapped (ASCII ones through a .flt in scratch) and
+    # summarised a band of rows at a time into memory-mapped summaries, so memory stays at a few bands whatever the
+    # grids' size or the number of replicates
+    names = None
+    for folder in folders:
+        found = set(fn for fn in os.listdir(folder) if os.path.splitext(fn)[1].lower() in EXTENSIONS)
+        names = found if names is None else names & found
+
+    scratch = tempfile.mkdtemp(prefix="maxent_replicates_")
+    written = []
+
+    try:
+        for name in sorted(names or []):
+            grids = [read_grid(mappable(os.path.join(folder, name), scratch, str(i)), raw=True) for i, folder in enumerate(folders)]
+            header = grids[0].header
+            for folder, grid in zip(folders, grids):
+                if grid.header[:5] != header[:5]:
+                    raise ValueError("'{}' does not line up with '{}'".format(os.path.join(folder, name), os.path.join(folders[0], name)))
+
+            shape = (header.nrows, header.ncols)
+            summaries = dict((summary, numpy.memmap(os.path.join(scratch, summary + ".dat"), dtype=numpy.float64, mode="w+", shape=shape))
+                             for summary in GRID_SUMMARIES)
+            n = float(len(grids))
+
+            for row in range(0, header.nrows, block_rows):
+                total = squares = low = high = None
+                for grid in grids:
+                    data = numpy.array(grid.data[row:row + block_rows], dtype=numpy.float64)
+                    if grid.header.nodata is not None:
+                        data[data == grid.header.nodata] = numpy.nan
+                    if total is None:
+                        total, squares, low, high = numpy.zeros(data.shape), numpy.zeros(data.shape), data.copy(), data.copy()
+                    total += data
+                    squares += data * data
+                    low, high = numpy.fmin(low, data), numpy.fmax(high, data)
+
+                mean = total / n
+                summaries["avg"][row:row + block_rows] = mean
+                summaries["stddev"][row:row + block_rows] = numpy.sqrt(numpy.maximum(squares / n - mean * mean, 0.0))
+                summaries["min"][row:row + block_rows] = low
+                summaries["max"][row:row + block_rows] = high
+
+            stem, extension = os.path.splitext(name)
+            for summary in GRID_SUMMARIES:
+                written.append(write_grid(os.path.join(out_folder, "{}_{}{}".format(stem, summary, extension)), summaries[summary], header))
+
+            # the maps are let go before the next grid's conversions reuse their scratch files
+            del grids[:]
+            summaries.clear()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    return written
+
+
+def merge_results(folders, out_path, folds=None):
+
+    # every replicate's maxentResults.csv rows renamed <species>_<fold> as Maxent does, followed by an average and a
+    # standard deviation row per species over the numeric columns; folds are the fold numbers of the folders, which
+    # differ from their positions once a replicate has failed
+    fields, rows = None, OrderedDict()
+    for i, folder in zip(range(len(folders)) if folds is None else folds, folders):
+        path = os.path.join(folder, RESULTS_FILE)
+        if not os.path.exists(path):
+            continue
+        with open_text(path, "r") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            fields = fields or header
+            for row in reader:
+                if row:
+                    rows.setdefault(row[0], []).append(["{}_{}".format(row[0], i)] + row[1:])
+
+    if fields is None:
+        return None
+
+    with open_text(out_path, "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        for species, species_rows in rows.items():
+            writer.writerows(species_rows)
+            values = numpy.array([[numeric(v) for v in row[1:]] for row in species_rows], dtype=numpy.float64)
+            for label, summary in (("average", mean_of), ("stddev", std_of)):
+                writer.writerow(["{} ({})".format(species, label)] + ["" if numpy.isnan(v) else repr(float(v)) for v in summary(values)])
+
+    return out_path
+
+
+def numeric(value):
+
+    try:
+        return float(value)
+    except ValueError:
+        return numpy.nan
+
+
+def mean_of(values):
+
+    # column means ignoring non numeric cells, NaN for a column with none
+    count = (~numpy.isnan(values)).sum(axis=0)
+    return numpy.where(count > 0, numpy.nansum(values, axis=0) / numpy.maximum(count, 1), numpy.nan)
+
+
+def std_of(values):
+
+    count = (~numpy.isnan(values)).sum(axis=0)
+    deviation = numpy.where(numpy.isnan(values), 0.0, values - mean_of(values))
+    return numpy.where(count > 0, numpy.sqrt((deviation * deviation).sum(axis=0) / numpy.maximum(count, 1)), numpy.nan)
@@ -0,0 +1,71 @@
+import os
+from multiprocessing import cpu_count
+from maxent_batch import MEMORY_FRACTION, concurrent_jobs, physical_memory_mb
+from raster_io import EXTENSIONS, read_header
+
+RESOURCE_PROFILES = ["Manual", "Auto"]
+
+# the JVM and Maxent's own needs before any layer is loaded
+BASE_HEAP_MB = 256
+
+# Maxent holds every layer in memory as 4 byte floats, with headroom for the garbage collector and the features
+BYTES_PER_CELL = 4
+HEAP_HEADROOM = 1.5
+
+# samples with data are held as text and then as doubles, a few times the file's size
+SWD_SIZE_FACTOR = 4
+
+MIN_HEAP_MB = 512
+
+HEAP_STEP_MB = 64
+
+
+def layers_size(layers):
+
+    # (cells per layer, layers) of a layers folder from the grid headers alone
+    cells, count = 0, 0
+    for fn in sorted(os.listdir(layers)):
+        if os.path.splitext(fn)[1].lower() in EXTENSIONS:
+            header = read_header(os.path.join(layers, fn))
+            cells = max(cells, header.nrows * header.ncols)
+            count += 1
+
+    return cells, count
+
+
+def estimate_heap_mb(layers):
+
+    # the heap Maxent needs for the layers folder, or for a samples with data background file
+    if os.path.isfile(layers):
+        needed = os.path.getsize(layers) * SWD_SIZE_FACTOR
+    else:
+        cells, count = layers_size(layers)
+        needed = cells * count * BYTES_PER_CELL * HEAP_HEADROOM
+
+    heap = BASE_HEAP_MB + needed / (1024.0 * 1024.0)
+
+    return max(MIN_HEAP_MB, int(-(-heap // HEAP_STEP_MB)) * HEAP_STEP_MB)
+
+
+def auto_resources(layers, parallel=False, memory_mb=None, processes=None, cores=None):
+
+    # (heap MB, models at once, Maxent threads, notes saying what was chosen and why): the heap the layers need,
+    # capped by the memory available, as many models at once as that heap allows when running in parallel, and the
+    # cores shared between them
+    cores = cores or cpu_count()
+    physical = physical_memory_mb()
+    budget = int(memory_mb or (physical or 0) * MEMORY_FRACTION) or None
+
+    notes = []
+    needed = estimate_heap_mb(layers)
+    heap = needed
+    notes.append("Layers in '{}' need an estimated {} MB of heap".format(layers, needed))
+    if budget and heap > budget:
+        heap = max(MIN_HEAP_MB, budget // HEAP_STEP_MB * HEAP_STEP_MB)
+        notes.append("Heap capped at {} MB of the {} MB available, Maxent may run short of memory".format(heap, budget))
+
+    slots = concurrent_jobs(heap, budget, processes or cores) if parallel else 1
+    threads = max(1, cores // slots)
+    notes.append("{} MB heap, {} model(s) at once, {} Maxent thread(s) each on {} cores, .mxe layer caching on".format(heap, slots, threads, cores))
+
+    return heap, slots, threads, notes
@@ -0,0 +1,262 @@
+import argparse
+import csv
+import os
+import re
+import numpy
+from collections import OrderedDict
+from maxent_batch import open_text
+
+RESULTS_FILE = "maxentResults.csv"
+
+# the rows Maxent adds to summarise replicates, left out of rankings so replicated species do not count twice
+SUMMARY_SUFFIXES = (" (average)", " (stddev)")
+
+# the table's own columns ahead of the maxentResults.csv columns
+RUN_COLUMN = "run"
+
+
+def text(value):
+
+    # csv gives bytes on python 2, the table holds unicode so a table saved by either python loads in the other
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def typed_column(values):
+
+    # float64 with NaN for empty cells when every value is a number, unicode strings otherwise
+    try:
+        return numpy.array([float(v) if v.strip() else numpy.nan for v in values], dtype=numpy.float64)
+    except ValueError:
+        return numpy.array([text(v) for v in values], dtype="U")
+
+
+def read_results(path):
+
+    # (column names, {column: typed array}) of one maxentResults.csv
+    with open_text(path, "r") as f:
+        reader = csv.reader(f)
+        fields = [text(field) for field in next(reader)]
+        rows = [row + [""] * (len(fields) - len(row)) for row in reader if row]
+
+    columns = OrderedDict((field, typed_column([row[i] for row in rows])) for i, field in enumerate(fields))
+
+    return fields, columns, len(rows)
+
+
+def filler(column, count):
+
+    if column.dtype.kind == "f":
+        return numpy.full(count, numpy.nan)
+
+    return numpy.zeros(count, dtype="U")
+
+
+def concatenate(first, first_count, second, second_count):
+
+    # two sets of columns one above the other, a column missing from one side is NaN or empty there and a column
+    # that is numeric on one side only becomes text
+    columns = OrderedDict()
+    for name in list(first) + [name for name in second if name not in first]:
+        top = first[name] if name in first else filler(second[name], first_count)
+        bottom = second[name] if name in second else filler(first[name], second_count)
+        if top.dtype.kind != bottom.dtype.kind:
+            top, bottom = top.astype("U"), bottom.astype("U")
+        columns[name] = numpy.concatenate([top, bottom])
+
+    return columns
+
+
+class ResultsTable(object):
+
+    def __init__(self):
+
+        # the rows of many maxentResults.csv files as one typed column per field, each row tagged with the index of
+        # the run (results file) it came from; runs remembers each file's size and modification time so an update
+        # only parses files that are new or changed
+        self.columns = OrderedDict()
+        self.rows = 0
+        self.runs = []
+
+        return
+
+    @classmethod
+    def load(cls, path):
+
+        # a table saved by save, or an empty one when there is none yet
+        table = cls()
+        if not os.path.exists(path):
+            return table
+
+        with open(path, "rb") as f:
+            data = numpy.load(f)
+            names = [text(name) for name in data["names"]]
+            table.columns = OrderedDict((name, data["column_{}".format(i)]) for i, name in enumerate(names))
+            table.runs = [[text(p), int(size), float(mtime)] for p, size, mtime in zip(data["run_paths"], data["run_sizes"], data["run_mtimes"])]
+        table.rows = len(table.columns[RUN_COLUMN]) if RUN_COLUMN in table.columns else 0
+
+        return table
+
+    def save(self, path):
+
+        # a compressed .npz of plain arrays, loaded without pickling; written under a temporary name and moved
+        # into place so an interrupted save leaves the previous table
+        arrays = dict(("column_{}".format(i), column) for i, column in enumerate(self.columns.values()))
+        arrays["names"] = numpy.array(list(self.columns), dtype="U")
+        arrays["run_paths"] = numpy.array([run[0] for run in self.runs], dtype="U")
+        arrays["run_sizes"] = numpy.array([run[1] for run in self.runs], dtype=numpy.int64)
+        arrays["run_mtimes"] = numpy.array([run[2] for run in self.runs], dtype=numpy.float64)
+
+        temp = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp, "wb") as f:
+            numpy.savez_compressed(f, **arrays)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temp, path)
+
+        return path
+
+    def keep_rows(self, keep):
+
+        for name in self.columns:
+            self.columns[name] = self.columns[name][keep]
+        self.rows = int(numpy.count_nonzero(keep))
+
+        return
+
+    def update(self, folder):
+
+        # adds every maxentResults.csv under folder that is new or changed since it was last read and drops the rows
+        # of those that changed or went away; returns (runs parsed, runs dropped)
+        found = OrderedDict()
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            if RESULTS_FILE in files:
+                path = os.path.abspath(os.path.join(root, RESULTS_FILE))
+                stat = os.stat(path)
+                found[path] = [path, stat.st_size, stat.st_mtime]
+
+        known = dict((run[0], i) for i, run in enumerate(self.runs))
+        prefix = os.path.join(os.path.abspath(folder), "")
+        stale = [i for i, run in enumerate(self.runs) if run[0].startswith(prefix) and found.get(run[0]) != run]
+        new = [run for path, run in found.items() if path not in known or self.runs[known[path]] != run]
+
+        if stale:
+            # the stale runs' rows go and the remaining runs are renumbered, looked up by run index as numpy.isin
+            # is newer than the numpy ArcMap ships and numpy.in1d is gone from numpy 2.4
+            is_stale = numpy.zeros(len(self.runs), dtype=bool)
+            is_stale[stale] = True
+            self.keep_rows(~is_stale[self.columns[RUN_COLUMN]])
+            renumber = numpy.cumsum([i not in stale for i in range(len(self.runs))]) - 1
+            self.columns[RUN_COLUMN] = renumber[self.columns[RUN_COLUMN]]
+            self.runs = [run for i, run in enumerate(self.runs) if i not in stale]
+
+        for run in new:
+            fields, columns, count = read_results(run[0])
+            columns = OrderedDict([(RUN_COLUMN, numpy.full(count, len(self.runs), dtype=numpy.int64))] + list(columns.items()))
+            self.columns = concatenate(self.columns, self.rows, columns, count) if self.columns else columns
+            self.rows += count
+            self.runs.append(run)
+
+        return len(new), len(stale)
+
+    def species(self):
+
+        # the first maxentResults.csv column names what each row models
+        names = [name for name in self.columns if name != RUN_COLUMN]
+
+        return self.columns[names[0]] if names else numpy.zeros(0, dtype="U")
+
+    def model_rows(self):
+
+        # rows of fitted models, without Maxent's replicate summary rows
+        species = self.species()
+
+        return numpy.array([not s.endswith(SUMMARY_SUFFIXES) for s in species], dtype=bool)
+
+    def sort(self, column, descending=True, rows=None):
+
+        # row indices ordered by a column, NaN last
+        values = self.columns[column]
+        order = numpy.arange(self.rows) if rows is None else numpy.nonzero(rows)[0]
+        if values.dtype.kind == "f":
+            keys = values[order]
+            order = order[numpy.lexsort((-keys if descending else keys, numpy.isnan(keys)))]
+        else:
+            order = order[numpy.argsort(values[order], kind="mergesort")]
+            order = order[::-1] if descending else order
+
+        return order
+
+    def group_by(self, key, column, rows=None):
+
+        # (groups, mean, count) of a numeric column per value of the key column, NaN ignored
+        rows = self.model_rows() if rows is None else rows
+        groups, inverse = numpy.unique(self.columns[key][rows], return_inverse=True)
+        values = self.columns[column][rows]
+        valid = ~numpy.isnan(values)
+        count = numpy.bincount(inverse[valid], minlength=len(groups))
+        total = numpy.bincount(inverse[valid], weights=values[valid], minlength=len(groups))
+
+        return groups, numpy.where(count > 0, total / numpy.maximum(count, 1), numpy.nan), count
+
+    def species_keys(self):
+
+        # the species each row models, replicate rows <species>_<i> of a species with a "<species> (average)" row
+        # belong to that species
+        species = self.species()
+        averaged = set(s[:-len(SUMMARY_SUFFIXES[0])] for s in species if s.endswith(SUMMARY_SUFFIXES[0]))
+        keys = []
+        for s in species:
+            base = re.sub(r"_\d+$", "", s)
+            keys.append(base if base in averaged else s)
+
+        return numpy.array(keys, dtype="U")
+
+    def variable_ranking(self, measure="contribution", rows=None):
+
+        # [(variable, mean, species)] over the "<variable> <measure>" columns, highest mean first; each species'
+        # models are averaged first, so a species with many replicates counts once like any other
+        rows = self.model_rows() if rows is None else rows
+        groups, inverse = numpy.unique(self.species_keys()[rows], return_inverse=True)
+        suffix = " " + measure
+        ranking = []
+        for name, values in self.columns.items():
+            if name.endswith(suffix) and values.dtype.kind == "f":
+                selected = values[rows]
+                valid = ~numpy.isnan(selected)
+                count = numpy.bincount(inverse[valid], minlength=len(groups))
+                total = numpy.bincount(inverse[valid], weights=selected[valid], minlength=len(groups))
+                means = total[count > 0] / count[count > 0]
+                ranking.append((name[:-len(suffix)], float(means.mean()) if len(means) else numpy.nan, len(means)))
+
+        return sorted(ranking, key=lambda item: (numpy.isnan(item[1]), -item[1] if not numpy.isnan(item[1]) else 0.0))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Collect the maxentResults.csv files under a folder into one table")
+    parser.add_argument("folder", help="folder searched for maxentResults.csv files")
+    parser.add_argument("--table", help="table file, updated in place (default maxent_results.npz in folder)")
+    parser.add_argument("--top", type=int, default=10, help="variables listed by mean contribution")
+    parser.add_argument("--sort", default="Training AUC", help="column the best models are listed by")
+    args = parser.parse_args()
+
+    table_path = args.table or os.path.join(args.folder, "maxent_results.npz")
+    table = ResultsTable.load(table_path)
+    parsed, dropped = table.update(args.folder)
+    table.save(table_path)
+    print("{} runs parsed, {} dropped, {} rows from {} runs in '{}'".format(parsed, dropped, table.rows, len(table.runs), table_path))
+
+    for variable, mean, species in table.variable_ranking()[:args.top]:
+        print("{:<40} {:8.2f} ({} species)".format(variable, mean, species))
+
+    if args.sort in table.columns:
+        species = table.species()
+        for row in table.sort(args.sort, rows=table.model_rows())[:args.top]:
+            print("{:<40} {} {}".format(species[row], args.sort, table.columns[args.sort][row]))
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+
+# bumped whenever what goes into a run key changes, older entries then simply never match
+CACHE_VERSION = 2
+
+# parameters that do not change what Maxent computes
+IGNORED_PARAMETERS = ["summary", "outputdirectory", "mem", "skipifexists", "warnings", "verbose",
+                      "batch_memory", "batch_processes", "run_cache", "resources", "threads", "cache_layers",
+                      "projection_workers", "postprocess", "threshold_rule"]
+
+# parameters naming a file or folder, keyed by content rather than by path
+PATH_PARAMETERS = ["jar", "samplesfile", "environmentallayers", "projection_layers", "batch_samples"]
+
+HASH_BLOCK_BYTES = 1 << 20
+
+HASHES_FILE = "content_hashes.json"
+
+# folders in an output directory rewritten on every run whether or not Maxent runs, the samples with data extracted
+# ahead of the run and the thresholded grids made from its results, so they are not part of what a run wrote
+DERIVED_FOLDERS = ["swd", "postprocess"]
+
+
+def file_hash(path):
+
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def write_json(path, value):
+
+    # written under a temporary name and moved into place, a cache file that cannot be written only costs a
+    # rehash or a rerun next time, so that is not an error
+    temp = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(temp, "w") as f:
+            json.dump(value, f, indent=1, sort_keys=True)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temp, path)
+    except (IOError, OSError):
+        return None
+
+    return path
+
+
+def output_manifest(folder):
+
+    # {relative path: [size, modification time]} of everything a run wrote
+    manifest = {}
+    for root, dirs, files in os.walk(folder):
+        if root == folder:
+            dirs[:] = [d for d in dirs if d not in DERIVED_FOLDERS]
+        for fn in files:
+            path = os.path.join(root, fn)
+            info = os.stat(path)
+            manifest[os.path.relpath(path, folder).replace(os.sep, "/")] = [info.st_size, info.st_mtime]
+
+    return manifest
+
+
+class RunCache(object):
+
+    def __init__(self, folder):
+
+        # one json entry per run key naming the output directory of the run and what it held, with the content
+        # hashes of the input files remembered by path, size and modification time so unchanged files are not reread
+        self.folder = folder
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        try:
+            with open(os.path.join(folder, HASHES_FILE)) as f:
+                self.hashes = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.hashes = {}
+        self.hashes_changed = False
+
+        return
+
+    def content_hash(self, path):
+
+        # a file's content hash, or a folder's from the names and content hashes of the files directly in it; Maxent
+        # reads layers and samples from the folder itself, subfolders such as the maxent.cache of .mxe files its
+        # layer caching writes into the layers folder are not inputs and would change the hash of every first run
+        if os.path.isdir(path):
+            h = hashlib.sha1()
+            for fn in sorted(os.listdir(path)):
+                child = os.path.join(path, fn)
+                if os.path.isfile(child):
+                    h.update("{}={}\n".format(fn, self.content_hash(child)).encode("utf-8"))
+            return h.hexdigest()
+
+        stat = os.stat(path)
+        full_path = os.path.abspath(path)
+        known = self.hashes.get(full_path)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime:
+            return known[2]
+
+        digest = file_hash(path)
+        self.hashes[full_path] = [stat.st_size, stat.st_mtime, digest]
+        self.hashes_changed = True
+
+        return digest
+
+    def run_key(self, pars, samplesfile=None):
+
+        # sha1 of the parameters that shape the model with files and folders replaced by their content, samplesfile
+        # stands in for the samples of one job of a batch
+        values = {}
+        for name, value in pars.items():
+            if name in IGNORED_PARAMETERS:
+                continue
+            if name in PATH_PARAMETERS and value and os.path.exists(value):
+                value = self.content_hash(value)
+            values[name] = value
+
+        if samplesfile:
+            values["samplesfile"] = self.content_hash(samplesfile)
+            values.pop("batch_samples", None)
+
+        key = hashlib.sha1("{}|{}".format(CACHE_VERSION, json.dumps(values, sort_keys=True)).encode("utf-8")).hexdigest()
+        self.save_hashes()
+
+        return key
+
+    def path(self, key):
+
+        return os.path.join(self.folder, "run_{}.json".format(key))
+
+    def get(self, key):
+
+        # the output directory of an earlier run with the same key, as long as it still holds what the run wrote,
+        # unchanged in size and modification time
+        try:
+            with open(self.path(key)) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+
+        folder = entry.get("output_directory")
+        for name, (size, mtime) in entry.get("files", {}).items():
+            path = os.path.join(folder, *name.split("/"))
+            info = os.stat(path) if os.path.isfile(path) else None
+            if info is None or info.st_size != size or info.st_mtime != mtime:
+                self.misses += 1
+                return None
+
+        self.hits += 1
+
+        return folder
+
+    def put(self, key, output_directory):
+
+        return write_json(self.path(key), {"output_directory": os.path.abspath(output_directory), "files": output_manifest(output_directory)})
+
+    def save_hashes(self):
+
+        if self.hashes_changed:
+            write_json(os.path.join(self.folder, HASHES_FILE), self.hashes)
+            self.hashes_changed = False
+
+        return
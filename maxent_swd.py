@@ -0,0 +1,201 @@
+import csv
+import hashlib
+import os
+import numpy
+from collections import OrderedDict
+from maxent_batch import open_text
+from raster_io import EXTENSIONS, binary_header_path, mappable, read_grid, read_header
+
+# background points Maxent samples from the layers when given a directory (its maximumbackground)
+DEFAULT_BACKGROUND = 10000
+
+# rounds of random candidate cells drawn before settling for fewer background points than asked for
+MAX_DRAWS = 20
+
+SWD_FOLDER = "swd"
+
+
+def layer_grids(folder, mapped_folder):
+
+    # {variable name: raw memory-mapped Grid} for the grids in a layers folder, named by file stem as Maxent names
+    # them; the grids must share their rows, columns and georeferencing, which is checked from their headers before
+    # any values are read, and ASCII grids are streamed once into .flt files in mapped_folder, kept for reuse
+    paths = OrderedDict()
+    for fn in sorted(os.listdir(folder)):
+        stem, extension = os.path.splitext(fn)
+        if extension.lower() in EXTENSIONS:
+            paths[stem] = os.path.join(folder, fn)
+
+    if not paths:
+        raise ValueError("No grids {} found in '{}'".format(EXTENSIONS, folder))
+
+    first_name, first = None, None
+    for name, path in paths.items():
+        header = read_header(path)
+        first_name, first = first_name or name, first or header
+        if header[:5] != first[:5]:
+            raise ValueError("Layer '{}' does not line up with layer '{}'".format(name, first_name))
+
+    if not os.path.isdir(mapped_folder):
+        os.makedirs(mapped_folder)
+
+    grids = OrderedDict()
+    for name, path in paths.items():
+        # a .flt is only used once its header, written after its values, is there too
+        flt_path = os.path.join(mapped_folder, name + ".flt")
+        if path.lower().endswith(".asc") and os.path.exists(binary_header_path(flt_path)):
+            path = flt_path
+        grids[name] = read_grid(mappable(path, mapped_folder), raw=True)
+
+    return grids
+
+
+def layer_values(grids, rows, cols):
+
+    # (points, layers) values at the cells, NoData as NaN, read in file order so a memmap is paged in once
+    values = numpy.empty((len(rows), len(grids)), dtype=numpy.float64)
+    if not len(rows):
+        return values
+
+    ncols = list(grids.values())[0].header.ncols
+    order = numpy.argsort(rows * ncols + cols, kind="mergesort")
+    rows, cols = rows[order], cols[order]
+
+    for i, grid in enumerate(grids.values()):
+        column = numpy.asarray(grid.data[rows, cols], dtype=numpy.float64)
+        if grid.header.nodata is not None:
+            column[column == grid.header.nodata] = numpy.nan
+        values[order, i] = column
+
+    return values
+
+
+def point_cells(header, x, y):
+
+    # rows and columns of the cells holding the points, and which points fall on the grid
+    cols = numpy.floor((x - header.xmin) / header.cell_size).astype(numpy.int64)
+    rows = numpy.floor((header.ymin + header.nrows * header.cell_size - y) / header.cell_size).astype(numpy.int64)
+    inside = (rows >= 0) & (rows < header.nrows) & (cols >= 0) & (cols < header.ncols)
+
+    return rows, cols, inside
+
+
+def background_cells(grids, count, seed=0):
+
+    # up to count distinct random cells with data in every layer, as Maxent's background; candidates are drawn in
+    # batches and tested together rather than scanning the grids, so only the cells drawn are read
+    header = list(grids.values())[0].header
+    total = header.nrows * header.ncols
+    random = numpy.random.RandomState(seed)
+
+    chosen = numpy.zeros(0, dtype=numpy.int64)
+    for draw in range(MAX_DRAWS):
+        wanted = count - len(chosen)
+        if wanted <= 0:
+            break
+        if total <= 2 * count:
+            candidates = random.permutation(total)
+        else:
+            candidates = numpy.unique(random.randint(0, total, size=2 * wanted))
+            candidates = random.permutation(numpy.setdiff1d(candidates, chosen, assume_unique=True))
+        values = layer_values(grids, candidates // header.ncols, candidates % header.ncols)
+        chosen = numpy.concatenate([chosen, candidates[~numpy.isnan(values).any(axis=1)][:wanted]])
+        if total <= 2 * count:
+            break
+
+    return chosen // header.ncols, chosen % header.ncols
+
+
+def write_swd(path, names, species, x, y, values):
+
+    with open_text(path, "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(["species", "x", "y"] + list(names))
+        for s, px, py, row in zip(species, x, y, values):
+            writer.writerow([s, repr(float(px)), repr(float(py))] + ["{:.10g}".format(v) for v in row])
+
+    return path
+
+
+def extract_samples(samples_csv, grids, out_path):
+
+    # the samples csv (species, x, y) with each layer's value at the sample added as Maxent's samples with data
+    # format, samples off the grids or on NoData in any layer are left out as Maxent leaves them out; returns the
+    # path and how many were left out
+    with open_text(samples_csv, "r") as f:
+        reader = csv.reader(f)
+        next(reader)
+        rows = [row for row in reader if row and row[0].strip()]
+
+    species = [row[0].strip() for row in rows]
+    x = numpy.array([float(row[1]) for row in rows], dtype=numpy.float64)
+    y = numpy.array([float(row[2]) for row in rows], dtype=numpy.float64)
+
+    header = list(grids.values())[0].header
+    cell_rows, cell_cols, inside = point_cells(header, x, y)
+    values = numpy.full((len(rows), len(grids)), numpy.nan)
+    values[inside] = layer_values(grids, cell_rows[inside], cell_cols[inside])
+    keep = ~numpy.isnan(values).any(axis=1)
+
+    write_swd(out_path, grids.keys(), [s for s, k in zip(species, keep) if k], x[keep], y[keep], values[keep])
+
+    return out_path, int((~keep).sum())
+
+
+def layers_key(folder):
+
+    # names, sizes and modification times of the layer files, so what is derived from the layers is reused until
+    # a layer changes
+    digest = hashlib.sha1()
+    for fn in sorted(os.listdir(folder)):
+        path = os.path.join(folder, fn)
+        if os.path.isfile(path):
+            info = os.stat(path)
+            digest.update("{}|{}|{!r}\n".format(fn, info.st_size, info.st_mtime).encode("utf-8"))
+
+    return digest.hexdigest()[:16]
+
+
+def count_points(path):
+
+    # rows of a samples with data file, less its header
+    with open_text(path, "r") as f:
+        return max(sum(1 for row in csv.reader(f) if row) - 1, 0)
+
+
+def extract_background(grids, path, count=DEFAULT_BACKGROUND, seed=0):
+
+    # the background points with their layer values as a samples with data file, which Maxent takes as its
+    # environmental layers; returns how many points were written, fewer than count where the layers have fewer
+    # cells with data
+    header = list(grids.values())[0].header
+    rows, cols = background_cells(grids, count, seed)
+    x = header.xmin + (cols + 0.5) * header.cell_size
+    y = header.ymin + (header.nrows - rows - 0.5) * header.cell_size
+
+    temp_path = path + ".tmp"
+    write_swd(temp_path, grids.keys(), ["background"] * len(rows), x, y, layer_values(grids, rows, cols))
+    os.rename(temp_path, path)
+
+    return len(rows)
+
+
+def samples_with_data(samples_csv, layers_folder, out_folder, count=DEFAULT_BACKGROUND, seed=0):
+
+    # samples and background files for Maxent in samples with data format, in an swd folder in out_folder; the
+    # background and the layers mapped for reading are kept there by the layers' key and reused until a layer
+    # changes; returns (samples path, background path, samples left out, background points, background reused)
+    swd_folder = os.path.join(out_folder, SWD_FOLDER)
+    if not os.path.isdir(swd_folder):
+        os.makedirs(swd_folder)
+
+    key = layers_key(layers_folder)
+    background_path = os.path.join(swd_folder, "background_{}_{}_{}.csv".format(key, count, seed))
+    reused = os.path.exists(background_path)
+
+    grids = layer_grids(layers_folder, os.path.join(swd_folder, "layers_{}".format(key)))
+    samples_path = os.path.join(swd_folder, os.path.splitext(os.path.basename(samples_csv))[0] + "_swd.csv")
+    samples_path, dropped = extract_samples(samples_csv, grids, samples_path)
+    points = count_points(background_path) if reused else extract_background(grids, background_path, count, seed)
+
+    return samples_path, background_path, dropped, points, reused
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import numpy
+from nearest_centroid_engine import PointGrid, Result, nearest_to_centroid
+from point_in_polygon import PolygonRings
+
+# bumped whenever the layout of the cache file changes, older caches are then ignored
+CACHE_VERSION = 1
+
+
+def polygon_hash(polygon):
+
+    # the centroid is hashed with the rings as it decides the result as much as the outline does
+    h = hashlib.sha1()
+    h.update(numpy.asarray(polygon.centroid, dtype=numpy.float64).tobytes())
+    for part in polygon.parts:
+        h.update(b"|")
+        for ring in part:
+            h.update(numpy.ascontiguousarray(ring, dtype=numpy.float64).tobytes())
+            h.update(b";")
+
+    return h.hexdigest()
+
+
+class ResultCache(object):
+
+    def __init__(self, path):
+
+        self.path = path
+        self.k = None
+        self.polygons = {}
+        self.results = {}
+        self.point_oids = numpy.empty(0, dtype=numpy.int64)
+        self.point_x = numpy.empty(0)
+        self.point_y = numpy.empty(0)
+
+        if path and os.path.exists(path):
+            self.load()
+
+        return
+
+    def load(self):
+
+        data = numpy.load(self.path)
+        if int(data["version"]) != CACHE_VERSION:
+            return
+
+        self.k = int(data["k"])
+        self.polygons = dict(zip(data["polygon_oids"].tolist(), data["polygon_hashes"].tolist()))
+        self.results = dict((oid, []) for oid in self.polygons)
+        for row in zip(data["result_polygon_oids"].tolist(), data["result_point_oids"].tolist(), data["result_distances"].tolist(), data["result_ranks"].tolist()):
+            self.results[row[0]].append(Result(*row))
+        self.point_oids, self.point_x, self.point_y = data["point_oids"], data["point_x"], data["point_y"]
+
+        return
+
+    def save(self):
+
+        results = [r for oid in self.polygons for r in self.results.get(oid, [])]
+        oids = list(self.polygons.keys())
+
+        with open(self.path, "wb") as f:
+            numpy.savez_compressed(
+                f,
+                version=CACHE_VERSION,
+                k=self.k,
+                polygon_oids=numpy.array(oids, dtype=numpy.int64),
+                polygon_hashes=numpy.array([self.polygons[oid] for oid in oids], dtype="S40"),
+                result_polygon_oids=numpy.array([r.polygon_oid for r in results], dtype=numpy.int64),
+                result_point_oids=numpy.array([r.point_oid for r in results], dtype=numpy.int64),
+                result_distances=numpy.array([r.distance for r in results], dtype=numpy.float64),
+                result_ranks=numpy.array([r.rank for r in results], dtype=numpy.int64),
+                point_oids=numpy.asarray(self.point_oids, dtype=numpy.int64),
+                point_x=numpy.asarray(self.point_x, dtype=numpy.float64),
+                point_y=numpy.asarray(self.point_y, dtype=numpy.float64))
+
+        return
+
+    def changed_points(self, point_oids, x, y):
+
+        # coordinates a changed point set could affect: new or moved points where they are now, removed or moved
+        # points where they were, a point is keyed on its coordinates so these are its geometry hash
+        point_oids = numpy.asarray(point_oids, dtype=numpy.int64)
+        x = numpy.asarray(x, dtype=numpy.float64)
+        y = numpy.asarray(y, dtype=numpy.float64)
+
+        if not len(self.point_oids):
+            return x, y
+
+        order = numpy.argsort(self.point_oids)
+        pos = numpy.clip(numpy.searchsorted(self.point_oids, point_oids, sorter=order), 0, len(order) - 1)
+        match = order[pos]
+        same = (self.point_oids[match] == point_oids) & (self.point_x[match] == x) & (self.point_y[match] == y)
+
+        kept = numpy.zeros(len(self.point_oids), dtype=bool)
+        kept[match[same]] = True
+
+        return numpy.concatenate([x[~same], self.point_x[~kept]]), numpy.concatenate([y[~same], self.point_y[~kept]])
+
+
+def incremental_nearest_to_centroid(polygons, point_oids, x, y, cache_path, k=1, compute=nearest_to_centroid):
+
+    # returns ([(polygon, results)] in input order, polygons reused, polygons recomputed) and refreshes the cache
+    cache = ResultCache(cache_path)
+    if cache.k != k:
+        cache = ResultCache(None)
+
+    hashes = [polygon_hash(p) for p in polygons]
+    dirty_x, dirty_y = cache.changed_points(point_oids, x, y)
+    dirty = PointGrid(dirty_x, dirty_y)
+
+    recompute = []
+    for i, (polygon, h) in enumerate(zip(polygons, hashes)):
+        if cache.polygons.get(polygon.oid) != h.encode("ascii"):
+            recompute.append(i)
+            continue
+
+        # an unchanged polygon is still stale when a point arrived in, left or moved within it
+        rings = PolygonRings(polygon.parts)
+        if not len(dirty_x) or rings.bounds is None:
+            continue
+        candidates = dirty.query(*rings.bounds)
+        if len(candidates) and rings.contains(dirty.x[candidates], dirty.y[candidates]).any():
+            recompute.append(i)
+
+    results = [cache.results.get(p.oid, []) for p in polygons]
+    if recompute:
+        for i, (polygon, polygon_results) in zip(recompute, compute([polygons[i] for i in recompute], point_oids, x, y, k=k)):
+            results[i] = polygon_results
+
+    cache.k = k
+    cache.polygons = dict((p.oid, h.encode("ascii")) for p, h in zip(polygons, hashes))
+    cache.results = dict((p.oid, r) for p, r in zip(polygons, results))
+    cache.point_oids = numpy.asarray(point_oids, dtype=numpy.int64)
+    cache.point_x = numpy.asarray(x, dtype=numpy.float64)
+    cache.point_y = numpy.asarray(y, dtype=numpy.float64)
+    cache.path = cache_path
+    cache.save()
+
+    return list(zip(polygons, results)), len(polygons) - len(recompute), len(recompute)
@@ -0,0 +1,199 @@
+import numpy
+from collections import namedtuple
+from math import sqrt, ceil
+from multiprocessing import Pool, cpu_count
+from point_in_polygon import PolygonRings
+
+# target average number of points per grid cell when the cell size is not given
+POINTS_PER_CELL = 16
+
+# tiles per worker when the tile size is not given, more tiles than workers evens out the load
+TILES_PER_WORKER = 4
+
+# a polygon read once from the input layer, parts is a list of parts, each part a list of (n, 2) ring arrays
+Polygon = namedtuple("Polygon", ["oid", "centroid", "parts"])
+
+# a winning point for a polygon, rank 1 is the nearest to the centroid
+Result = namedtuple("Result", ["polygon_oid", "point_oid", "distance", "rank"])
+
+
+class PointGrid(object):
+
+    def __init__(self, x, y, cell_size=None):
+
+        self.x = numpy.asarray(x, dtype=numpy.float64)
+        self.y = numpy.asarray(y, dtype=numpy.float64)
+
+        n = len(self.x)
+
+        if n:
+            self.xmin, self.xmax = float(self.x.min()), float(self.x.max())
+            self.ymin, self.ymax = float(self.y.min()), float(self.y.max())
+        else:
+            self.xmin = self.xmax = self.ymin = self.ymax = 0.0
+
+        width, height = self.xmax - self.xmin, self.ymax - self.ymin
+
+        if not cell_size:
+            cell_size = sqrt(width * height * POINTS_PER_CELL / n) if n and width and height else 0.0
+        if not cell_size:
+            cell_size = max(width, height) / max(sqrt(n), 1.0) or 1.0
+
+        self.cell_size = float(cell_size)
+        self.cols = int(width // self.cell_size) + 1
+        self.rows = int(height // self.cell_size) + 1
+
+        cell_ids = self._rows(self.y) * self.cols + self._cols(self.x)
+
+        # points ordered by cell, with the offsets of each cell's run in that order
+        self.order = numpy.argsort(cell_ids, kind="mergesort")
+        self.offsets = numpy.searchsorted(cell_ids[self.order], numpy.arange(self.rows * self.cols + 1))
+
+        return
+
+    def _cols(self, x):
+
+        return numpy.clip(((x - self.xmin) // self.cell_size).astype(numpy.int64), 0, self.cols - 1)
+
+    def _rows(self, y):
+
+        return numpy.clip(((y - self.ymin) // self.cell_size).astype(numpy.int64), 0, self.rows - 1)
+
+    def query(self, xmin, ymin, xmax, ymax):
+
+        # indices of the points in the grid cells overlapping the box, a superset of the points inside it
+        if not len(self.x) or xmax < self.xmin or xmin > self.xmax or ymax < self.ymin or ymin > self.ymax:
+            return numpy.empty(0, dtype=numpy.int64)
+
+        c0, c1 = self._cols(numpy.array([xmin, xmax]))
+        r0, r1 = self._rows(numpy.array([ymin, ymax]))
+
+        # the cells of a grid row are contiguous in the sorted order, so take one slice per row
+        runs = [self.order[self.offsets[r * self.cols + c0]:self.offsets[r * self.cols + c1 + 1]] for r in range(r0, r1 + 1)]
+
+        return numpy.concatenate(runs)
+
+
+def assign_points(polygons, grid):
+
+    # yields (polygon, indices of contained points in ascending order) for every polygon in a single pass
+    for polygon in polygons:
+        rings = PolygonRings(polygon.parts)
+        if rings.bounds is None:
+            yield polygon, numpy.empty(0, dtype=numpy.int64)
+            continue
+
+        candidates = grid.query(*rings.bounds)
+        if len(candidates):
+            candidates = candidates[rings.contains(grid.x[candidates], grid.y[candidates])]
+            candidates.sort()
+        yield polygon, candidates
+
+
+def nearest_to_centroid(polygons, point_oids, x, y, cell_size=None, k=1):
+
+    # yields (polygon, up to k ranked results), ties are broken by the lower point oid
+    point_oids = numpy.asarray(point_oids)
+    order = numpy.argsort(point_oids, kind="mergesort")
+    point_oids = point_oids[order]
+
+    grid = PointGrid(numpy.asarray(x, dtype=numpy.float64)[order], numpy.asarray(y, dtype=numpy.float64)[order], cell_size)
+
+    for polygon, contained in assign_points(polygons, grid):
+        if not len(contained):
+            yield polygon, []
+            continue
+
+        cx, cy = polygon.centroid
+        dists = numpy.hypot(grid.x[contained] - cx, grid.y[contained] - cy)
+        nearest = k_smallest(dists, k)
+
+        yield polygon, [Result(polygon.oid, point_oids[contained[i]].item(), float(dists[i]), rank + 1) for rank, i in enumerate(nearest)]
+
+
+def k_smallest(values, k):
+
+    # positions of the k smallest values in ascending order, equal values keep their positional order, without a full sort
+    if k == 1:
+        return [numpy.argmin(values)]
+
+    if k < len(values):
+        kth = numpy.partition(values, k - 1)[k - 1]
+        below = numpy.nonzero(values < kth)[0]
+        tied = numpy.nonzero(values == kth)[0][:k - len(below)]
+        selected = numpy.concatenate([below, tied])
+    else:
+        selected = numpy.arange(len(values))
+
+    return selected[numpy.lexsort((selected, values[selected]))]
+
+
+def make_tiles(polygons, tile_size=None, workers=1):
+
+    # each polygon belongs to the one tile holding its extent's centre, the tile's extent grows to cover all of its
+    # polygons so every point a polygon could contain is routed to that polygon's tile
+    extents = [PolygonRings(p.parts).bounds for p in polygons]
+    valid = numpy.array([extent is not None for extent in extents], dtype=bool)
+    if not valid.any():
+        return []
+
+    bounds = numpy.zeros((len(polygons), 4))
+    bounds[valid] = [extents[i] for i in numpy.nonzero(valid)[0]]
+
+    centre_x = (bounds[:, 0] + bounds[:, 2]) / 2.0
+    centre_y = (bounds[:, 1] + bounds[:, 3]) / 2.0
+    xmin, ymin = centre_x[valid].min(), centre_y[valid].min()
+
+    if not tile_size:
+        span = max(centre_x[valid].max() - xmin, centre_y[valid].max() - ymin)
+        tile_size = span / ceil(sqrt(max(workers, 1) * TILES_PER_WORKER)) or 1.0
+
+    keys = numpy.floor((centre_x - xmin) / tile_size).astype(numpy.int64) * (1 << 32) + numpy.floor((centre_y - ymin) / tile_size).astype(numpy.int64)
+
+    # group the polygons by tile key, keeping input order within each tile
+    indices = numpy.nonzero(valid)[0]
+    indices = indices[numpy.argsort(keys[indices], kind="mergesort")]
+    splits = numpy.nonzero(numpy.diff(keys[indices]))[0] + 1
+
+    tiles = []
+    for members in numpy.split(indices, splits):
+        box = bounds[members]
+        tiles.append((members, (box[:, 0].min(), box[:, 1].min(), box[:, 2].max(), box[:, 3].max())))
+
+    return tiles
+
+
+def tiled_nearest_to_centroid(polygons, point_oids, x, y, tile_size=None, workers=None, cell_size=None, k=1):
+
+    # same results as nearest_to_centroid, computed per spatial tile in a pool of processes
+    workers = workers or cpu_count()
+    point_oids = numpy.asarray(point_oids)
+    grid = PointGrid(x, y, cell_size)
+
+    def tile_jobs():
+
+        for members, (xmin, ymin, xmax, ymax) in make_tiles(polygons, tile_size, workers):
+            idx = grid.query(xmin, ymin, xmax, ymax)
+            idx = idx[(grid.x[idx] >= xmin) & (grid.x[idx] <= xmax) & (grid.y[idx] >= ymin) & (grid.y[idx] <= ymax)]
+            yield members, [polygons[i] for i in members], point_oids[idx], grid.x[idx], grid.y[idx], k
+
+    results = [[] for _ in polygons]
+
+    pool = Pool(workers)
+    try:
+        for members, tile_results in pool.imap_unordered(_nearest_in_tile, tile_jobs()):
+            for i, result in zip(members, tile_results):
+                results[i] = result
+    finally:
+        pool.close()
+        pool.join()
+
+    for polygon, result in zip(polygons, results):
+        yield polygon, result
+
+
+def _nearest_in_tile(job):
+
+    members, tile_polygons, point_oids, x, y, k = job
+
+    return members, [results for polygon, results in nearest_to_centroid(tile_polygons, point_oids, x, y, k=k)]
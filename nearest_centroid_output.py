@@ -0,0 +1,49 @@
+import csv
+import json
+import sys
+
+# columns written for each winning point
+FIELDS = ["point_id", "polygon_id", "distance", "rank", "x", "y"]
+
+
+def open_text(path):
+
+    # the csv module wants binary files on python 2 and untranslated newlines on python 3
+    if sys.version_info[0] < 3:
+        return open(path, "wb")
+
+    return open(path, "w", newline="")
+
+
+def write_csv(path, rows):
+
+    # rows are (point_id, polygon_id, distance, rank, x, y), written as they arrive
+    count = 0
+    with open_text(path) as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+
+    return count
+
+
+def write_geojson(path, rows, crs=None):
+
+    # a FeatureCollection streamed one feature per line so nothing is held in memory
+    count = 0
+    with open(path, "w") as f:
+        f.write('{"type": "FeatureCollection",\n')
+        if crs:
+            f.write('"crs": {},\n'.format(json.dumps({"type": "name", "properties": {"name": crs}})))
+        f.write('"features": [\n')
+        for point_id, polygon_id, distance, rank, x, y in rows:
+            feature = {"type": "Feature",
+                       "geometry": {"type": "Point", "coordinates": [x, y]},
+                       "properties": {"point_id": point_id, "polygon_id": polygon_id, "distance": distance, "rank": rank}}
+            f.write((",\n" if count else "") + json.dumps(feature))
+            count += 1
+        f.write("\n]}\n")
+
+    return count
@@ -1,7 +1,9 @@
 import arcpy
 import arcpy.mapping
 import numpy
+import os
 from collections import OrderedDict
+from raster_io import EXTENSIONS, read_grid
 
 
 class PercentilesTool(object):
@@ -60,12 +62,17 @@ class PercentilesTool(object):
         in_layer_path = in_layer_desc.catalogPath
         in_layer_dtype = in_layer_desc.dataType
 
-        arr = arcpy.da.FeatureClassToNumPyArray(in_layer, in_fieldname).astype(numpy.float32)
-        ndv = arcpy.Raster(in_layer).noDataValue
+        if os.path.splitext(in_layer_path)[1].lower() in EXTENSIONS:
+            # grid files are read straight from disk, NoData comes back as NaN
+            arr = read_grid(in_layer_path).data
+            ndv = numpy.nan
+        else:
+            arr = arcpy.da.FeatureClassToNumPyArray(in_layer, in_fieldname).astype(numpy.float32)
+            ndv = arcpy.Raster(in_layer).noDataValue
 
-        messages.addMessage("Input layer path, type, ndv = '{}', '{}', '{}'".format(in_layer_path, in_layer_dtype))
+        messages.addMessage("Input layer path, type, ndv = '{}', '{}', '{}'".format(in_layer_path, in_layer_dtype, ndv))
 
-        arr = arr[arr != ndv]
+        arr = arr[~numpy.isnan(arr)] if ndv != ndv else arr[arr != ndv]
         messages.addMessage(arr)
 
         v = []
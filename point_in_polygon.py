@@ -0,0 +1,88 @@
+import numpy
+
+# upper bound on the points x edges block evaluated at once, keeps temporaries to a few tens of MB
+MAX_BLOCK_CELLS = 1 << 20
+
+
+class PolygonRings(object):
+
+    def __init__(self, parts):
+
+        # parts is a list of parts, each a list of (n, 2) ring arrays, exterior ring first then any holes
+        self.parts = []
+
+        for part in parts:
+            rings = [numpy.asarray(ring, dtype=numpy.float64) for ring in part if len(ring) > 2]
+            if not rings:
+                continue
+
+            coords = numpy.concatenate(rings)
+            bounds = coords[:, 0].min(), coords[:, 1].min(), coords[:, 0].max(), coords[:, 1].max()
+
+            # edges of all rings in the part, horizontal edges never cross a horizontal ray so are dropped
+            a = coords
+            b = numpy.concatenate([numpy.roll(ring, -1, axis=0) for ring in rings])
+            keep = a[:, 1] != b[:, 1]
+            a, b = a[keep], b[keep]
+
+            ylo = numpy.minimum(a[:, 1], b[:, 1])
+            yhi = numpy.maximum(a[:, 1], b[:, 1])
+            slope = (b[:, 0] - a[:, 0]) / (b[:, 1] - a[:, 1])
+
+            self.parts.append((bounds, a[:, 0], a[:, 1], ylo, yhi, slope))
+
+        if self.parts:
+            boxes = numpy.array([p[0] for p in self.parts])
+            self.bounds = boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max()
+        else:
+            self.bounds = None
+
+        return
+
+    def contains(self, x, y):
+
+        x = numpy.asarray(x, dtype=numpy.float64)
+        y = numpy.asarray(y, dtype=numpy.float64)
+        inside = numpy.zeros(x.shape, dtype=bool)
+
+        for (xmin, ymin, xmax, ymax), ax, ay, ylo, yhi, slope in self.parts:
+
+            # most points fall outside a part's bounding box and never reach the ray cast
+            idx = numpy.nonzero((x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax))[0]
+            if not len(idx):
+                continue
+
+            step = max(1, MAX_BLOCK_CELLS // max(len(ax), 1))
+            for start in range(0, len(idx), step):
+                block = idx[start:start + step]
+                px = x[block][:, numpy.newaxis]
+                py = y[block][:, numpy.newaxis]
+
+                # even-odd rule over every ring of the part, so holes subtract themselves
+                crossings = (ylo <= py) & (py < yhi) & (px < ax + (py - ay) * slope)
+                inside[block] |= (crossings.sum(axis=1) & 1).astype(bool)
+
+        return inside
+
+
+def points_in_polygon(parts, x, y):
+
+    return PolygonRings(parts).contains(x, y)
+
+
+def geometry_parts(shape):
+
+    # arcpy polygon parts list the exterior ring then any interior rings, separated by None
+    parts = []
+    for part in shape:
+        rings, ring = [], []
+        for pnt in part:
+            if pnt is None:
+                rings.append(ring)
+                ring = []
+            else:
+                ring.append((pnt.X, pnt.Y))
+        rings.append(ring)
+        parts.append([numpy.array(r, dtype=numpy.float64) for r in rings if len(r) > 2])
+
+    return parts
@@ -0,0 +1,13 @@
+import multiprocessing
+import os
+import sys
+
+
+def use_python_for_pools():
+
+    # a pool started by a tool inside ArcMap or ArcCatalog would launch that application as its workers, so on
+    # Windows the pool is pointed at python itself, pythonw so no console opens per worker
+    if os.name == "nt":
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, "pythonw.exe"))
+
+    return
@@ -1,16 +1,23 @@
 from __future__ import print_function
 import arcpy
 import os
+import numpy
 from datetime import datetime
 from collections import OrderedDict
 from random import random
-from math import sqrt, pi, cos, sin
+from math import pi
 import logging
 import logging.handlers
+from point_in_polygon import PolygonRings, geometry_parts
 
 MAX_ITS = 100000
 POINTS = []
 FAIL_COUNT = 0
+CANDIDATE_BATCH = 1024
+
+# (u, v) draws made for a batch but not used by the point it was drawn for, handed to the next point first so the
+# sequence of random() calls is the one a draw per iteration gives
+PENDING_DRAWS = numpy.zeros((0, 2))
 
 
 class PseudoRandomAbsenceGenerator(object):
@@ -140,10 +147,11 @@ class PseudoRandomAbsenceGenerator(object):
         in_sample_points, in_points_id_field, in_offset_max, in_offset_min, in_study_layer, in_proximity_max, \
         in_out_ws, in_out_lyr, max_its = parameter_dictionary.values()
 
-        global MAX_ITS, POINTS, FAIL_COUNT
+        global MAX_ITS, POINTS, FAIL_COUNT, PENDING_DRAWS
         MAX_ITS = float(max_its)
         POINTS = []
         FAIL_COUNT = 0
+        PENDING_DRAWS = numpy.zeros((0, 2))
 
         # cast inputs to float
         in_offset_max = float(in_offset_max) if in_offset_max not in [None, "#"] else 0
@@ -185,11 +193,11 @@ class PseudoRandomAbsenceGenerator(object):
 
             study_point_count = int(arcpy.GetCount_management("points_layer").getOutput(0))
             add_message("Points layer contains {} features within study area '{}'".format(study_point_count, in_study_layer))
-            study_feats = [f[0] for f in arcpy.da.SearchCursor("study_layer", ["SHAPE@"])]
+            study_feats = [PolygonRings(geometry_parts(f[0])) for f in arcpy.da.SearchCursor("study_layer", ["SHAPE@"])]
         else:
             study_feats = []
 
-        add_message("study features: {}".format(study_feats))
+        add_message("study features: {}".format(len(study_feats)))
 
         add_message("Generating pseudo-points...")
 
@@ -222,52 +230,47 @@ class PseudoRandomAbsenceGenerator(object):
 
 def generate_pseudo_point(point, max_offset, min_offset=0, study_features=[], max_proximity=0, print_func=print):
 
-    global POINTS, FAIL_COUNT
+    global POINTS, FAIL_COUNT, PENDING_DRAWS
 
     n, unsolved = 0, True
     start = datetime.now()
 
     xy = "{}, {}".format(point.X, point.Y)
 
+    candidates, draws, used = [], PENDING_DRAWS[:0], 0
+    batch_size = 8
+
     while unsolved:
         if n > MAX_ITS:
+            PENDING_DRAWS = numpy.concatenate([draws[used:], PENDING_DRAWS])
             POINTS.append(arcpy.Point(-9999, -9999))
             FAIL_COUNT += 1
             return xy, "{}, {}".format(-9999, -9999), n-1, str(datetime.now() - start), "maximum iterations reached", (-9999, -9999)
 
         n += 1
 
-        u = random()
-        v = random()
+        # candidates are drawn and tested for containment in batches, then accepted or rejected in draw order
+        if used == len(candidates):
+            draws, PENDING_DRAWS = take_draws(PENDING_DRAWS, batch_size)
+            candidates, used = candidate_batch(point.X, point.Y, draws, max_offset, min_offset, study_features), 0
+            batch_size = min(batch_size * 2, CANDIDATE_BATCH)
 
-        w = max_offset * sqrt(u)
-        t = 2.0 * pi * v
-        x = point.X + w * cos(t)
-        y = point.Y + w * sin(t)
+        x, y, too_near, contained = candidates[used]
+        used += 1
 
-        if min_offset:
-            if sqrt((x - point.X)**2 + (y - point.Y)**2) < min_offset:
-                print_func("too close to original")
-                # REJECTED
-                continue
+        if too_near:
+            print_func("too close to original")
+            # REJECTED
+            continue
 
         # RE-USING POINT OBJECT !!
         point.X, point.Y = x, y
 
         # is point within study area
-        if study_features:
-            contained = False
-            for s in study_features:  # is point within study area
-                if not s.contains(point):
-                    # REJECTED
-                    contained = False
-                    print_func("NOT CONTAINED")
-                    break
-                else:
-                    contained = True
-
-            if not contained:
-                continue
+        if not contained:
+            # REJECTED
+            print_func("NOT CONTAINED")
+            continue
 
         # is point too close to previously generated pseudo-points
         if max_proximity:
@@ -286,12 +289,46 @@ def generate_pseudo_point(point, max_offset, min_offset=0, study_features=[], ma
         # if execution gets here, we should have a solution
         unsolved = False
 
+    PENDING_DRAWS = numpy.concatenate([draws[used:], PENDING_DRAWS])
     POINTS.append(arcpy.PointGeometry(point))
     print_func("Pseudo-point count: {}".format(len(POINTS)))
 
     return xy, "{}, {}".format(point.X, point.Y), n, str(datetime.now() - start), "solved", (point.X, point.Y)  # xy
 
 
+def take_draws(pending, size):
+
+    # (size (u, v) draws, pending left), the pending draws first and then one random() call each for u and v
+    fresh = numpy.array([random() for _ in range(2 * max(0, size - len(pending)))]).reshape(-1, 2)
+
+    return numpy.concatenate([pending[:size], fresh]), pending[size:]
+
+
+def candidate_batch(x0, y0, draws, max_offset, min_offset=0, study_features=[]):
+
+    # a candidate per (u, v) draw, in draw order
+    size = len(draws)
+    w = max_offset * numpy.sqrt(draws[:, 0])
+    t = 2.0 * pi * draws[:, 1]
+    dx, dy = w * numpy.cos(t), w * numpy.sin(t)
+
+    if min_offset:
+        too_near = numpy.sqrt(dx ** 2 + dy ** 2) < min_offset
+    else:
+        too_near = numpy.zeros(size, dtype=bool)
+
+    # the point object is re-used, so every candidate not rejected as too near moves the origin of the next one
+    x = numpy.cumsum(numpy.concatenate([[x0], numpy.where(too_near, 0.0, dx)]))[:-1] + dx
+    y = numpy.cumsum(numpy.concatenate([[y0], numpy.where(too_near, 0.0, dy)]))[:-1] + dy
+
+    # a point must be within every study feature
+    contained = numpy.ones(size, dtype=bool)
+    for s in study_features:
+        contained &= s.contains(x, y)
+
+    return list(zip(x.tolist(), y.tolist(), too_near.tolist(), contained.tolist()))
+
+
 def init_log(print_func=print):
 
     log_filename = 'pseudo-absences.log'
@@ -0,0 +1,304 @@
+import numpy
+import os
+from collections import namedtuple
+
+# georeferencing shared by every format here, (xmin, ymin) is the lower left corner of the lower left cell
+GridHeader = namedtuple("GridHeader", ["ncols", "nrows", "xmin", "ymin", "cell_size", "nodata"])
+
+# a grid's values, NoData as NaN unless read raw, with its header
+Grid = namedtuple("Grid", ["data", "header"])
+
+# the file extensions read_grid and write_grid understand
+EXTENSIONS = [".asc", ".bil", ".flt", ".grd"]
+
+DEFAULT_NODATA = -9999.0
+
+# bytes of an ASCII grid parsed at a time, a chunk ends on whitespace so no number is split
+ASCII_CHUNK_BYTES = 1 << 24
+
+# pixel types of BIL headers and the data types of DIVA-GIS .grd headers (as Maxent writes them)
+BIL_TYPES = {("SIGNEDINT", 8): "i1", ("SIGNEDINT", 16): "i2", ("SIGNEDINT", 32): "i4",
+             ("UNSIGNEDINT", 8): "u1", ("UNSIGNEDINT", 16): "u2", ("UNSIGNEDINT", 32): "u4",
+             ("FLOAT", 32): "f4", ("FLOAT", 64): "f8"}
+GRD_TYPES = {"INT1S": "i1", "INT1U": "u1", "INT2S": "i2", "INT2U": "u2", "INT4S": "i4", "INT4U": "u4", "FLT4S": "f4", "FLT8S": "f8",
+             "1BYTEINT": "i1", "2BYTEINT": "i2", "4BYTEINT": "i4", "4BYTEFLOAT": "f4", "8BYTEFLOAT": "f8"}
+
+
+def header_values(lines):
+
+    # "key value" or "key=value" lines as a dict with lower case keys, [section] lines are skipped
+    values = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("["):
+            continue
+        key, _, value = line.replace("=", " ", 1).partition(" ")
+        values[key.strip().lower()] = value.strip()
+
+    return values
+
+
+def to_nan(data, nodata):
+
+    # a float copy of the values with NoData as NaN
+    data = numpy.array(data, dtype=numpy.float64)
+    if nodata is not None:
+        data[data == nodata] = numpy.nan
+
+    return data
+
+
+def read_ascii_header(f):
+
+    # the header lines of an open ESRI ASCII grid, leaving the file at the first row of values
+    values = {}
+    while True:
+        position = f.tell()
+        line = f.readline()
+        key = line.split()[0].lower() if line.strip() else b""
+        if not key or not key[:1].isalpha():
+            f.seek(position)
+            break
+        values[key.decode("ascii")] = line.split()[1].decode("ascii")
+
+    return esri_header(values)
+
+
+def esri_header(values):
+
+    # the keys of ESRI ASCII grid and .flt headers, the lower left given by its corner or by its cell's centre
+    cell_size = float(values["cellsize"])
+    xmin = float(values["xllcorner"]) if "xllcorner" in values else float(values["xllcenter"]) - cell_size / 2.0
+    ymin = float(values["yllcorner"]) if "yllcorner" in values else float(values["yllcenter"]) - cell_size / 2.0
+    nodata = float(values["nodata_value"]) if "nodata_value" in values else None
+
+    return GridHeader(int(values["ncols"]), int(values["nrows"]), xmin, ymin, cell_size, nodata)
+
+
+def read_ascii(path, out=None, raw=False):
+
+    # an ESRI ASCII grid parsed a chunk at a time straight into out (e.g. a memmap), or a new float64 array
+    with open(path, "rb") as f:
+        header = read_ascii_header(f)
+        if out is None:
+            out = numpy.empty((header.nrows, header.ncols), dtype=numpy.float64)
+        flat = out.reshape(-1) if out.flags.c_contiguous else None
+        filled, rest = 0, b""
+        size = header.nrows * header.ncols
+
+        while filled < size:
+            chunk = f.read(ASCII_CHUNK_BYTES)
+            text = rest + chunk
+            if chunk:
+                cut = max(text.rfind(b" "), text.rfind(b"\n"), text.rfind(b"\t"))
+                text, rest = text[:cut + 1], text[cut + 1:]
+            elif not text.strip():
+                raise ValueError("'{}' holds {} of its {} values".format(path, filled, size))
+            values = numpy.array(text.split(), dtype=numpy.float64)[:size - filled]
+            if not raw and header.nodata is not None:
+                values[values == header.nodata] = numpy.nan
+            if flat is not None:
+                flat[filled:filled + len(values)] = values
+            else:
+                cells = numpy.arange(filled, filled + len(values))
+                out[cells // header.ncols, cells % header.ncols] = values
+            filled += len(values)
+            rest = rest if chunk else b""
+
+    return Grid(out, header)
+
+
+def write_ascii(path, data, header, block_rows=256):
+
+    # an ESRI ASCII grid written a block of rows at a time, NaN written as the header's NoData value
+    nodata = DEFAULT_NODATA if header.nodata is None else header.nodata
+    with open(path, "w") as f:
+        f.write("ncols {}\nnrows {}\nxllcorner {!r}\nyllcorner {!r}\ncellsize {!r}\nNODATA_value {}\n".format(
+            header.ncols, header.nrows, header.xmin, header.ymin, header.cell_size, nodata))
+        for row in range(0, header.nrows, block_rows):
+            block = numpy.asarray(data[row:row + block_rows], dtype=numpy.float64)
+            numpy.savetxt(f, numpy.where(numpy.isnan(block), nodata, block), fmt="%.10g")
+
+    return path
+
+
+def binary_header_path(path):
+
+    return os.path.splitext(path)[0] + ".hdr"
+
+
+def map_bil(path, raw=False, band=0):
+
+    # a BIL grid mapped read only as a numpy memmap through its .hdr, no values are read or copied unless NoData has
+    # to become NaN, which the caller can defer with raw and do on the parts it reads
+    with open(binary_header_path(path)) as f:
+        values = header_values(f)
+
+    nrows, ncols, nbands = int(values["nrows"]), int(values["ncols"]), int(values.get("nbands", 1))
+    nbits = int(values.get("nbits", 8))
+    pixel_type = values.get("pixeltype", "UNSIGNEDINT").upper()
+    dtype = numpy.dtype(BIL_TYPES[(pixel_type, nbits)]).newbyteorder(">" if values.get("byteorder", "I").upper().startswith("M") else "<")
+
+    # ULXMAP and ULYMAP are the centre of the upper left cell, defaulting as ArcGIS does
+    xdim = float(values.get("xdim", 1.0))
+    ulx, uly = float(values.get("ulxmap", 0.0)), float(values.get("ulymap", (nrows - 1) * xdim))
+    nodata = float(values["nodata"]) if "nodata" in values else None
+    header = GridHeader(ncols, nrows, ulx - xdim / 2.0, uly + xdim / 2.0 - nrows * xdim, xdim, nodata)
+
+    data = numpy.memmap(path, dtype=dtype, mode="r", offset=int(values.get("skipbytes", 0)), shape=(nrows, nbands, ncols))[:, band, :]
+
+    return Grid(data if raw else to_nan(data, nodata), header)
+
+
+def write_bil_header(path, header, dtype="<f4"):
+
+    # the .hdr of a single band little endian BIL of one of the BIL_TYPES, e.g. "<u1" for compact class grids
+    dtype = numpy.dtype(dtype)
+    pixel_type, nbits = [key for key, value in BIL_TYPES.items() if numpy.dtype(value).kind == dtype.kind and key[1] == dtype.itemsize * 8][0]
+    nodata = DEFAULT_NODATA if header.nodata is None else header.nodata
+    with open(binary_header_path(path), "w") as f:
+        f.write("BYTEORDER I\nLAYOUT BIL\nNROWS {}\nNCOLS {}\nNBANDS 1\nNBITS {}\nPIXELTYPE {}\nBANDROWBYTES {}\nTOTALROWBYTES {}\n".format(
+            header.nrows, header.ncols, nbits, pixel_type, header.ncols * dtype.itemsize, header.ncols * dtype.itemsize))
+        f.write("ULXMAP {!r}\nULYMAP {!r}\nXDIM {!r}\nYDIM {!r}\nNODATA {}\n".format(
+            header.xmin + header.cell_size / 2.0, header.ymin + header.nrows * header.cell_size - header.cell_size / 2.0,
+            header.cell_size, header.cell_size, nodata))
+
+    return nodata
+
+
+def write_bil(path, data, header, dtype="<f4"):
+
+    # a single band little endian BIL with its .hdr, float32 unless dtype says otherwise, NaN written as the
+    # header's NoData value
+    nodata = write_bil_header(path, header, dtype)
+    write_rows(path, data, nodata, dtype)
+
+    return path
+
+
+def map_flt(path, raw=False):
+
+    # an ESRI .flt float grid mapped as a numpy memmap through its .hdr, which has the ASCII grid's keys
+    with open(binary_header_path(path)) as f:
+        values = header_values(f)
+
+    header = esri_header(values)
+    nodata = header.nodata
+
+    dtype = ">f4" if values.get("byteorder", "LSBFIRST").upper().startswith("MSB") else "<f4"
+    data = numpy.memmap(path, dtype=dtype, mode="r", shape=(header.nrows, header.ncols))
+
+    return Grid(data if raw else to_nan(data, nodata), header)
+
+
+def write_flt_header(path, header):
+
+    # the .hdr of a little endian float32 .flt, for values written by write_rows or straight into a memmap
+    nodata = DEFAULT_NODATA if header.nodata is None else header.nodata
+    with open(binary_header_path(path), "w") as f:
+        f.write("ncols {}\nnrows {}\nxllcorner {!r}\nyllcorner {!r}\ncellsize {!r}\nNODATA_value {}\nbyteorder LSBFIRST\n".format(
+            header.ncols, header.nrows, header.xmin, header.ymin, header.cell_size, nodata))
+
+    return nodata
+
+
+def write_flt(path, data, header):
+
+    nodata = write_flt_header(path, header)
+    write_rows(path, data, nodata, "<f4")
+
+    return path
+
+
+def map_grd(path, raw=False):
+
+    # a DIVA-GIS .grd header with its .gri values mapped as a numpy memmap
+    with open(path) as f:
+        values = header_values(f)
+
+    nrows, ncols = int(values["rows"]), int(values["columns"])
+    xmin, ymin = float(values["minx"]), float(values["miny"])
+    cell_size = float(values.get("resolutionx", (float(values["maxx"]) - xmin) / ncols))
+    nodata = float(values["nodatavalue"]) if "nodatavalue" in values else None
+    header = GridHeader(ncols, nrows, xmin, ymin, cell_size, nodata)
+
+    order = ">" if values.get("byteorder", "little").lower().startswith("big") else "<"
+    dtype = numpy.dtype(GRD_TYPES[values.get("datatype", "FLT4S").upper()]).newbyteorder(order)
+    data = numpy.memmap(os.path.splitext(path)[0] + ".gri", dtype=dtype, mode="r", shape=(nrows, ncols))
+
+    return Grid(data if raw else to_nan(data, nodata), header)
+
+
+def write_grd(path, data, header):
+
+    nodata = DEFAULT_NODATA if header.nodata is None else header.nodata
+    with open(path, "w") as f:
+        f.write("[General]\nVersion= 1.0\n[GeoReference]\nColumns= {}\nRows= {}\nMinX= {!r}\nMaxX= {!r}\nMinY= {!r}\nMaxY= {!r}\n"
+                "ResolutionX= {!r}\nResolutionY= {!r}\n[Data]\nDataType= FLT4S\nByteOrder= little\nNoDataValue= {}\n".format(
+                    header.ncols, header.nrows, header.xmin, header.xmin + header.ncols * header.cell_size,
+                    header.ymin, header.ymin + header.nrows * header.cell_size, header.cell_size, header.cell_size, nodata))
+    write_rows(os.path.splitext(path)[0] + ".gri", data, nodata, "<f4")
+
+    return path
+
+
+def write_rows(path, data, nodata, dtype, block_rows=256):
+
+    # raw values a block of rows at a time, NaN as nodata
+    with open(path, "wb") as f:
+        for row in range(0, len(data), block_rows):
+            block = numpy.asarray(data[row:row + block_rows], dtype=numpy.float64)
+            numpy.where(numpy.isnan(block), nodata, block).astype(dtype).tofile(f)
+
+    return
+
+
+def read_header(path):
+
+    # a grid's header alone, an ASCII grid's values are not parsed and a binary grid's are only mapped
+    if os.path.splitext(path)[1].lower() == ".asc":
+        with open(path, "rb") as f:
+            return read_ascii_header(f)
+
+    return read_grid(path, raw=True).header
+
+
+def mappable(path, scratch, name=None):
+
+    # a path to the grid that can be memory-mapped, an ASCII grid is streamed once into a .flt in scratch named after
+    # the grid unless given a name, grids of one name from different folders need their own names
+    if os.path.splitext(path)[1].lower() != ".asc":
+        return path
+
+    header = read_header(path)
+    flt_path = os.path.join(scratch, (name or os.path.splitext(os.path.basename(path))[0]) + ".flt")
+    read_ascii(path, out=numpy.memmap(flt_path, dtype="<f4", mode="w+", shape=(header.nrows, header.ncols)))
+    write_flt_header(flt_path, header)
+
+    return flt_path
+
+
+def read_grid(path, raw=False):
+
+    # any of the supported formats by extension, binary formats are memory-mapped when raw
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".asc":
+        return read_ascii(path, raw=raw)
+    if extension == ".bil":
+        return map_bil(path, raw)
+    if extension == ".flt":
+        return map_flt(path, raw)
+    if extension == ".grd":
+        return map_grd(path, raw)
+
+    raise ValueError("'{}' is not one of the grid formats {}".format(path, EXTENSIONS))
+
+
+def write_grid(path, data, header):
+
+    extension = os.path.splitext(path)[1].lower()
+    writers = {".asc": write_ascii, ".bil": write_bil, ".flt": write_flt, ".grd": write_grd}
+    if extension not in writers:
+        raise ValueError("'{}' is not one of the grid formats {}".format(path, EXTENSIONS))
+
+    return writers[extension](path, data, header._replace(nrows=data.shape[0], ncols=data.shape[1]))
@@ -0,0 +1,152 @@
+import numpy
+from math import ceil, floor
+
+# upper bound on the rows x edges and rows x columns blocks filled at once, keeps temporaries to a few tens of MB
+MAX_BLOCK_CELLS = 1 << 20
+
+
+def cell_rows_cols(x, y, xmin, ymax, cell_size):
+
+    # (row, col) of the cells holding the coordinates, rows count down from the top of the grid
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+
+    return (numpy.floor((ymax - y) / cell_size).astype(numpy.int64), numpy.floor((x - xmin) / cell_size).astype(numpy.int64))
+
+
+def set_cells(labels, rows, cols, value):
+
+    inside = (rows >= 0) & (rows < labels.shape[0]) & (cols >= 0) & (cols < labels.shape[1])
+    labels[rows[inside], cols[inside]] = value
+
+    return
+
+
+def fill_polygon(labels, parts, value, xmin, ymax, cell_size):
+
+    # scanline fill of every cell whose centre falls inside the polygon, as FeatureToRaster does, parts is a list of
+    # parts, each a list of (n, 2) ring arrays; rings are filled by the even-odd rule so holes subtract themselves
+    rings = [numpy.asarray(ring, dtype=numpy.float64) for part in parts for ring in part if len(ring) > 2]
+    if not rings:
+        return
+
+    a = numpy.concatenate(rings)
+    b = numpy.concatenate([numpy.roll(ring, -1, axis=0) for ring in rings])
+    keep = a[:, 1] != b[:, 1]
+    a, b = a[keep], b[keep]
+    if not len(a):
+        return
+
+    ylo = numpy.minimum(a[:, 1], b[:, 1])
+    yhi = numpy.maximum(a[:, 1], b[:, 1])
+    slope = (b[:, 0] - a[:, 0]) / (b[:, 1] - a[:, 1])
+
+    # only the rows and columns whose centres can fall inside the polygon's extent are scanned
+    rows, cols = labels.shape
+    row0 = max(int(ceil((ymax - yhi.max()) / cell_size - 0.5)), 0)
+    row1 = min(int(floor((ymax - ylo.min()) / cell_size - 0.5)), rows - 1) + 1
+    col0 = max(int(ceil((a[:, 0].min() - xmin) / cell_size - 0.5)), 0)
+    col1 = min(int(floor((a[:, 0].max() - xmin) / cell_size - 0.5)), cols - 1) + 1
+    if row0 >= row1 or col0 >= col1:
+        return
+
+    step = max(1, MAX_BLOCK_CELLS // max(len(a), col1 - col0 + 1))
+    for start in range(row0, row1, step):
+        block_rows = numpy.arange(start, min(start + step, row1))
+        yc = (ymax - (block_rows + 0.5) * cell_size)[:, numpy.newaxis]
+
+        # the crossings of each row's centre line, sorted so consecutive pairs bound the runs inside the polygon,
+        # a run takes the centres from its first crossing up to but not on its second as point_in_polygon does
+        crossing = (ylo <= yc) & (yc < yhi)
+        xs = numpy.where(crossing, a[:, 0] + (yc - a[:, 1]) * slope, numpy.inf)
+        xs.sort(axis=1)
+        if xs.shape[1] % 2:
+            xs = numpy.concatenate([xs, numpy.full((len(xs), 1), numpy.inf)], axis=1)
+
+        x0, x1 = xs[:, 0::2], xs[:, 1::2]
+        r, k = numpy.nonzero(numpy.isfinite(x1))
+        first = numpy.maximum(numpy.ceil((x0[r, k] - xmin) / cell_size - 0.5).astype(numpy.int64), col0) - col0
+        last = numpy.minimum(numpy.ceil((x1[r, k] - xmin) / cell_size - 0.5).astype(numpy.int64) - 1, col1 - 1) - col0
+        run = first <= last
+        r, first, last = r[run], first[run], last[run]
+
+        # runs are marked at their ends and filled by a cumulative sum along each row
+        marks = numpy.zeros((len(block_rows), col1 - col0 + 1), dtype=numpy.int32)
+        numpy.add.at(marks, (r, first), 1)
+        numpy.add.at(marks, (r, last + 1), -1)
+        inside = numpy.cumsum(marks, axis=1)[:, :-1] > 0
+
+        target = labels[block_rows[0]:block_rows[-1] + 1, col0:col1]
+        target[inside] = value
+
+    return
+
+
+def line_cells(coords, xmin, ymax, cell_size):
+
+    # (rows, cols) of the cells on the path through the vertices, each segment stepped along its major axis with
+    # the minor axis rounded as Bresenham's algorithm does
+    rows, cols = cell_rows_cols(coords[:, 0], coords[:, 1], xmin, ymax, cell_size)
+    if len(rows) == 1:
+        return rows, cols
+
+    r0, c0 = rows[:-1], cols[:-1]
+    dr, dc = rows[1:] - r0, cols[1:] - c0
+    n = numpy.maximum(numpy.abs(dr), numpy.abs(dc))
+
+    segment = numpy.repeat(numpy.arange(len(n)), n + 1)
+    t = numpy.arange(len(segment)) - numpy.repeat(numpy.cumsum(n + 1) - (n + 1), n + 1)
+    span = numpy.maximum(n[segment], 1)
+
+    return (r0[segment] + (2 * t * dr[segment] + span) // (2 * span), c0[segment] + (2 * t * dc[segment] + span) // (2 * span))
+
+
+def draw_line(labels, parts, value, xmin, ymax, cell_size):
+
+    # parts is a list of (n, 2) vertex arrays
+    for part in parts:
+        coords = numpy.asarray(part, dtype=numpy.float64)
+        if len(coords):
+            rows, cols = line_cells(coords, xmin, ymax, cell_size)
+            set_cells(labels, rows, cols, value)
+
+    return
+
+
+def draw_points(labels, coords, value, xmin, ymax, cell_size):
+
+    coords = numpy.asarray(coords, dtype=numpy.float64).reshape(-1, 2)
+    rows, cols = cell_rows_cols(coords[:, 0], coords[:, 1], xmin, ymax, cell_size)
+    set_cells(labels, rows, cols, value)
+
+    return
+
+
+def rasterize(features, shape, xmin, ymax, cell_size, out=None):
+
+    # a label grid of the given shape and top left corner holding each feature's value, NaN elsewhere, features are
+    # (value, kind, parts) with kind "polygon", "polyline" or "point" and parts as fill_polygon, draw_line or
+    # draw_points take them; a later feature overwrites an earlier one where they meet
+    labels = numpy.empty(shape, dtype=numpy.float64) if out is None else out
+    labels[:] = numpy.nan
+    draw = {"polygon": fill_polygon, "polyline": draw_line, "point": draw_points, "multipoint": draw_points}
+
+    for value, kind, parts in features:
+        draw[kind](labels, parts, float(value), xmin, ymax, float(cell_size))
+
+    return labels
+
+
+def value_index(labels):
+
+    # {value: flat indices of its cells in ascending order} from a single pass over the labels, so seeding a value
+    # touches only its own cells
+    flat = numpy.asarray(labels).ravel()
+    cells = numpy.flatnonzero(~numpy.isnan(flat))
+    values = flat[cells]
+
+    order = numpy.argsort(values, kind="mergesort")
+    cells, values = cells[order], values[order]
+    splits = numpy.nonzero(numpy.diff(values))[0] + 1
+
+    return dict((float(group[0]), c) for group, c in zip(numpy.split(values, splits), numpy.split(cells, splits)) if len(group))
@@ -60,6 +60,24 @@ import sys
 import csv
 import subprocess
 import collections
+from multiprocessing import cpu_count
+from maxent_batch import JobStatus, batch_jobs, concurrent_jobs, maxent_command, run_batch, write_status_table
+from maxent_postprocess import THRESHOLD_RULES, postprocess
+from maxent_progress import STDOUT_LOG, progress_text, stream_process
+from maxent_projection import project_lambdas, projection_name
+from maxent_resources import RESOURCE_PROFILES, auto_resources
+from maxent_results_table import ResultsTable
+from maxent_replicates import FOLD_SEED, make_folds, merge_grids, merge_results, replicate_jobs
+from maxent_run_cache import RunCache
+from maxent_swd import DEFAULT_BACKGROUND, samples_with_data
+from pool_python import use_python_for_pools
+
+# stderr lines passed on as messages, the rest are only in the log
+MAX_STDERR_MESSAGES = 100
+
+# the table a batch collects its species' results into, and how many variables it reports from it
+RESULTS_TABLE = "maxent_results.npz"
+TOP_VARIABLES = 10
 
 
 class MaxentModellingTool(object):
@@ -300,10 +318,131 @@ class MaxentModellingTool(object):
 
         hinge_features.value = False
 
+        batch = arcpy.Parameter(
+            displayName="Model each species separately, several at once",
+            name="batch",
+            datatype="GPBoolean",
+            parameterType="Optional",
+            direction="Input",
+            category="Batch")
+
+        batch.value = False
+
+        batch_samples = arcpy.Parameter(
+            displayName="Batch Samples (CSV of many species, or folder of CSVs)",
+            name="batch_samples",
+            datatype=["DEFile", "DEFolder"],
+            parameterType="Optional",
+            direction="Input",
+            category="Batch")
+
+        batch_memory = arcpy.Parameter(
+            displayName="Memory for all models together (MB)",
+            name="batch_memory",
+            datatype="GPLong",
+            parameterType="Optional",
+            direction="Input",
+            category="Batch")
+
+        batch_processes = arcpy.Parameter(
+            displayName="Most models at once",
+            name="batch_processes",
+            datatype="GPLong",
+            parameterType="Optional",
+            direction="Input",
+            category="Batch")
+
+        parallel_replicates = arcpy.Parameter(
+            displayName="Cross-validation replicates, each run as its own model at once",
+            name="parallel_replicates",
+            datatype="GPLong",
+            parameterType="Optional",
+            direction="Input",
+            category="Batch")
+
+        swd = arcpy.Parameter(
+            displayName="Extract layer values at the samples and background first (no prediction grids unless projecting)",
+            name="swd",
+            datatype="GPBoolean",
+            parameterType="Optional",
+            direction="Input",
+            category="Samples With Data")
+
+        swd.value = False
+
+        swd_background = arcpy.Parameter(
+            displayName="Background points",
+            name="swd_background",
+            datatype="GPLong",
+            parameterType="Optional",
+            direction="Input",
+            category="Samples With Data")
+
+        swd_background.value = DEFAULT_BACKGROUND
+
+        run_cache = arcpy.Parameter(
+            displayName="Run Cache Folder (identical runs reuse earlier results)",
+            name="run_cache",
+            datatype="DEFolder",
+            parameterType="Optional",
+            direction="Input",
+            category="Run Cache")
+
+        resources = arcpy.Parameter(
+            displayName="Memory and Threads (Auto sizes the heap from the layers and uses every core)",
+            name="resources",
+            datatype="GPString",
+            parameterType="Optional",
+            direction="Input",
+            category="Main Options")
+
+        resources.filter.list = RESOURCE_PROFILES
+        resources.value = RESOURCE_PROFILES[0]
+
+        parallel_projection = arcpy.Parameter(
+            displayName="Project the fitted models here in parallel row bands rather than in Maxent",
+            name="parallel_projection",
+            datatype="GPBoolean",
+            parameterType="Optional",
+            direction="Input",
+            category="Main Options")
+
+        parallel_projection.value = False
+
+        projection_workers = arcpy.Parameter(
+            displayName="Projection Workers (all cores if empty)",
+            name="projection_workers",
+            datatype="GPLong",
+            parameterType="Optional",
+            direction="Input",
+            category="Main Options")
+
+        postprocess = arcpy.Parameter(
+            displayName="Threshold the predictions and combine replicates into mean, deviation and presence grids",
+            name="postprocess",
+            datatype="GPBoolean",
+            parameterType="Optional",
+            direction="Input",
+            category="Post-processing")
+
+        postprocess.value = False
+
+        threshold_rule = arcpy.Parameter(
+            displayName="Threshold Rule",
+            name="threshold_rule",
+            datatype="GPString",
+            parameterType="Optional",
+            direction="Input",
+            category="Post-processing")
+
+        threshold_rule.filter.list = THRESHOLD_RULES
+        threshold_rule.value = THRESHOLD_RULES[0]
+
         return [jar, mem, samplesfile, environmentallayers, outputdirectory, autorun,
                 outputformat, outputfiletype, projection_layers,
                 responsecurves, pictures, jacknife, skip_existing, warnings,
-                auto_features, linear_features, quadratic_features, product_features, threshold_features, hinge_features, verbose]
+                auto_features, linear_features, quadratic_features, product_features, threshold_features, hinge_features, verbose,
+                batch, batch_samples, batch_memory, batch_processes, parallel_replicates, swd, swd_background, run_cache, resources, parallel_projection, projection_workers, postprocess, threshold_rule]
 
     def isLicensed(self):
 
@@ -440,6 +579,32 @@ class MaxentModellingTool(object):
         messages.addMessage("")
         messages.addMessage("Parameter Summary: {}".format(self._parameters["summary"]))
 
+        if self._parameters["swd"]:
+            self.prepare_swd(messages)
+
+        cache = RunCache(self._parameters["run_cache"]) if self._parameters["run_cache"] else None
+
+        if self._parameters["batch"]:
+            self.execute_batch(messages, cache)
+            return
+
+        key = cache.run_key(self._parameters) if cache else None
+        cached = cache.get(key) if cache else None
+        if cached:
+            messages.addMessage("")
+            messages.addMessage("Inputs and settings are unchanged since the run in '{}', its results are used".format(cached))
+            self.add_results(cached, messages)
+            return
+
+        if (self._parameters["parallel_replicates"] or 0) > 1:
+            failed = self.execute_replicates(messages)
+            if cache and not failed:
+                cache.put(key, self._parameters["outputdirectory"])
+            elif cache:
+                messages.addWarningMessage("Not all replicates succeeded, the run is not cached")
+            return
+
+        self.plan_resources(messages)
         cmdargs = build_commands(self._parameters)
         cmdstr = " ".join(cmdargs)
 
@@ -447,9 +612,25 @@ class MaxentModellingTool(object):
         messages.addMessage("Starting Maxent with command line:")
         messages.addMessage(cmdstr)
 
-        process = subprocess.Popen(cmdstr, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)  # can't get working with shell=False and cmdargs = [...]
-        stdout, stderr = process.communicate()
-        retcode = process.returncode
+        out_dir = self._parameters["outputdirectory"]
+        stdout_log = os.path.join(out_dir, STDOUT_LOG)
+
+        # output is streamed to a rotating log as it arrives, only progress and stderr lines reach the messages,
+        # a list holds the stderr count so the callback can update it on python 2
+        stderr_lines = [0]
+
+        def report_progress(progress):
+            arcpy.SetProgressorLabel("Maxent: {}".format(progress_text(progress)))
+            messages.addMessage("Progress: {}".format(progress_text(progress)))
+
+        def report_stderr(line):
+            stderr_lines[0] += 1
+            if stderr_lines[0] <= MAX_STDERR_MESSAGES:
+                messages.addWarningMessage("stderr: {}".format(line))
+
+        arcpy.SetProgressor("default", "Running Maxent")
+        retcode = stream_process(cmdargs, stdout_log, report_progress, report_stderr)
+        arcpy.ResetProgressor()
         retstr = "Return Code {}".format(retcode)
 
         messages.addMessage("")
@@ -458,14 +639,15 @@ class MaxentModellingTool(object):
         else:
             messages.addMessage(retstr + " Failure")
 
-        messages.addMessage("")
-        messages.addMessage("stdout:")
-        messages.addMessage(stdout)
-        messages.addMessage("")
-        messages.addMessage("stderr:")
-        messages.addMessage(stderr)
+        if self._parameters["parallel_projection"] and not retcode:
+            self.project(out_dir, messages)
 
-        out_dir = self._parameters["outputdirectory"]
+        if cache and not retcode:
+            cache.put(key, out_dir)
+
+        if stderr_lines[0] > MAX_STDERR_MESSAGES:
+            messages.addWarningMessage("{} more stderr lines not shown".format(stderr_lines[0] - MAX_STDERR_MESSAGES))
+        messages.addMessage("Console output logged to '{}'".format(stdout_log))
 
         log = os.path.join(out_dir, "maxent.log")
         messages.addMessage("")
@@ -473,14 +655,22 @@ class MaxentModellingTool(object):
             messages.addMessage("{} not found".format(log))
         else:
             messages.addMessage("Log contents:")
-            for line in list(open(log)):
+            for line in open(log):
                 line = line.strip()
                 if line:
                     messages.addMessage(line)
 
+        self.add_results(out_dir, messages)
+
+        return
+
+    def add_results(self, out_dir, messages):
+
         out_fmt = self._parameters["outputfiletype"]
         out_files = [fn for fn in os.listdir(out_dir) if fn.endswith(out_fmt)]
         out_files = [os.path.join(out_dir, fn) for fn in out_files]
+        if self._parameters["postprocess"]:
+            out_files += self.postprocess_results(out_dir, messages)
 
         messages.addMessage("")
         messages.addMessage("Result files generated:")
@@ -504,6 +694,219 @@ class MaxentModellingTool(object):
 
         return
 
+    def postprocess_results(self, out_dir, messages, folds=None):
+
+        # thresholds from maxentResults.csv applied to the prediction grids and replicates combined, the grids are
+        # streamed a block of rows at a time so any size of grid or number of replicates fits in memory; folds are
+        # the parallel replicates that succeeded
+        pars = self._parameters
+        rule = pars["threshold_rule"] or THRESHOLD_RULES[0]
+
+        messages.addMessage("")
+        messages.addMessage("Thresholding predictions in '{}' at the {} threshold".format(out_dir, rule))
+        try:
+            written = postprocess(out_dir, rule, pars["outputformat"], pars["outputfiletype"], folds)
+        except (IOError, OSError, ValueError) as e:
+            messages.addWarningMessage("Could not post-process '{}': {}".format(out_dir, e))
+            return []
+
+        paths = []
+        for species, species_paths in written.items():
+            messages.addMessage("{}: {}".format(species, ", ".join(os.path.basename(path) for path in species_paths)))
+            paths.extend(species_paths)
+
+        return paths
+
+    def prepare_swd(self, messages):
+
+        # the layer values are read once here, at the samples and a background sample, and Maxent is given the
+        # samples with data files in place of the samples and layers so it does no grid reading of its own
+        pars = self._parameters
+        layers = pars["environmentallayers"]
+        count = pars["swd_background"] or DEFAULT_BACKGROUND
+
+        messages.addMessage("")
+        messages.addMessage("Extracting values from the layers in '{}'".format(layers))
+
+        samples, background, dropped, points, reused = samples_with_data(pars["samplesfile"], layers, pars["outputdirectory"], count)
+        messages.addMessage("Samples with data written to '{}'".format(samples))
+        if dropped:
+            messages.addWarningMessage("{} samples off the layers or on NoData left out".format(dropped))
+        messages.addMessage("Background of {} points {} '{}'".format(points, "reused from" if reused else "written to", background))
+        if points < count:
+            messages.addWarningMessage("Only {} of the {} background points asked for have data in every layer".format(points, count))
+
+        batch_samples = pars["batch_samples"]
+        if batch_samples and os.path.isfile(batch_samples):
+            pars["batch_samples"] = samples_with_data(batch_samples, layers, pars["outputdirectory"], count)[0]
+            messages.addMessage("Batch samples with data written to '{}'".format(pars["batch_samples"]))
+
+        pars["samplesfile"], pars["environmentallayers"] = samples, background
+
+        return
+
+    def project(self, out_dir, messages, workers=None):
+
+        # each fitted model in out_dir projected onto the projection layers, the layers split into row bands that
+        # are evaluated from the .lambdas file by a pool of processes and written as one grid named as Maxent would;
+        # workers caps the pool when other models are still running, the projection workers parameter overrides it
+        pars = self._parameters
+        layers = pars["projection_layers"]
+        if not layers:
+            messages.addWarningMessage("No projection layers given, nothing projected")
+            return
+
+        use_python_for_pools()
+
+        for fn in sorted(os.listdir(out_dir)):
+            if not fn.endswith(".lambdas"):
+                continue
+            lambdas = os.path.join(out_dir, fn)
+            out_path = os.path.join(out_dir, projection_name(lambdas, layers, "." + pars["outputfiletype"]))
+            messages.addMessage("Projecting '{}' onto '{}'".format(fn, layers))
+            try:
+                for done, bands in project_lambdas(lambdas, layers, out_path, pars["outputformat"], workers=pars["projection_workers"] or workers):
+                    arcpy.SetProgressorLabel("Projecting {}: band {} of {}".format(fn, done, bands))
+            except ValueError as e:
+                messages.addWarningMessage("Could not project '{}': {}".format(fn, e))
+                continue
+            messages.addMessage("Projection written to '{}'".format(out_path))
+
+        return
+
+    def plan_resources(self, messages, parallel=False):
+
+        # how many models run at once, with the Auto profile the heap, Maxent threads and layer caching are set
+        # here as well, before any command line is built
+        pars = self._parameters
+        if pars["resources"] != "Auto":
+            return concurrent_jobs(pars["mem"], pars["batch_memory"], pars["batch_processes"]) if parallel else 1
+
+        heap, slots, threads, notes = auto_resources(pars["environmentallayers"], parallel, pars["batch_memory"], pars["batch_processes"])
+        pars["mem"], pars["threads"], pars["cache_layers"] = heap, threads, True
+
+        messages.addMessage("")
+        for note in notes:
+            messages.addMessage(note)
+
+        return slots
+
+    def job_progress(self, messages):
+
+        # a run_batch callback reporting what each model's output says of its progress, as a single run does
+        def report(job, progress):
+            arcpy.SetProgressorLabel("Maxent {}: {}".format(job.species, progress_text(progress)))
+            messages.addMessage("Progress of {}: {}".format(job.species, progress_text(progress)))
+
+        return report
+
+    def execute_batch(self, messages, cache=None):
+
+        pars = self._parameters
+        samples = pars["batch_samples"] or pars["samplesfile"]
+
+        slots = self.plan_resources(messages, parallel=True)
+        jobs = batch_jobs(pars, samples)
+
+        # species whose samples, layers and settings are unchanged since an earlier run keep its results
+        statuses, keys = [], {}
+        if cache:
+            for job in list(jobs):
+                keys[job.species] = cache.run_key(pars, job.samples)
+                cached = cache.get(keys[job.species])
+                if cached:
+                    statuses.append(JobStatus(job.species, "cached", 0, 0.0, cached, os.path.join(cached, STDOUT_LOG)))
+                    jobs.remove(job)
+            messages.addMessage("")
+            messages.addMessage("{} species unchanged since an earlier run, their results are reused".format(len(statuses)))
+
+        total = len(jobs) + len(statuses)
+        messages.addMessage("")
+        messages.addMessage("Modelling {} species from '{}', {} at a time with {} MB each".format(len(jobs), samples, slots, pars["mem"]))
+
+        # a species is projected while the other models run, so its pool gets one model's share of the cores
+        projection_workers = pars.get("threads") or max(1, cpu_count() // slots)
+
+        for status in run_batch(jobs, slots, on_progress=self.job_progress(messages)):
+            statuses.append(status)
+            if status.status == "success" and pars["parallel_projection"]:
+                self.project(status.output_directory, messages, projection_workers)
+            if status.status == "success" and pars["postprocess"]:
+                self.postprocess_results(status.output_directory, messages)
+            if cache and status.status == "success":
+                cache.put(keys[status.species], status.output_directory)
+            report = messages.addMessage if status.status == "success" else messages.addWarningMessage
+            report("{} of {}: '{}' {} (return code {}) in {} s, output in '{}'".format(
+                len(statuses), total, status.species, status.status, status.return_code, status.seconds, status.output_directory))
+
+        table = write_status_table(os.path.join(pars["outputdirectory"], "batch_status.csv"), statuses)
+
+        messages.addMessage("")
+        messages.addMessage("Batch status ({}):".format(table))
+        for status in sorted(statuses):
+            messages.addMessage("{:<40} {:<12} {:>6} {:>10}".format(status.species, status.status, str(status.return_code), status.seconds))
+        messages.addMessage("{} succeeded, {} reused, {} failed".format(sum(1 for s in statuses if s.status == "success"), sum(1 for s in statuses if s.status == "cached"),
+                                                                      sum(1 for s in statuses if s.status not in ["success", "cached"])))
+
+        # every species' maxentResults.csv gathered into one table, only the runs new since the last batch are read
+        table_path = os.path.join(pars["outputdirectory"], RESULTS_TABLE)
+        results = ResultsTable.load(table_path)
+        parsed, dropped = results.update(pars["outputdirectory"])
+        results.save(table_path)
+
+        messages.addMessage("")
+        messages.addMessage("Results table '{}': {} runs read, {} rows from {} runs".format(table_path, parsed, results.rows, len(results.runs)))
+        for variable, mean, species in results.variable_ranking()[:TOP_VARIABLES]:
+            messages.addMessage("{:<40} mean contribution {:6.2f} over {} species".format(variable, mean, species))
+
+        return
+
+    def execute_replicates(self, messages):
+
+        # Maxent would run cross-validation replicates one after another in one JVM, here each fold is a model of
+        # its own and the folds run side by side, then their outputs are merged as Maxent would summarise them;
+        # returns the output directories of the replicates that failed
+        pars = self._parameters
+        out_dir = pars["outputdirectory"]
+        replicates = pars["parallel_replicates"]
+
+        slots = self.plan_resources(messages, parallel=True)
+        folds = make_folds(pars["samplesfile"], replicates, out_dir)
+        jobs = replicate_jobs(pars, folds)
+
+        messages.addMessage("")
+        messages.addMessage("Running {} cross-validation replicates, {} at a time with {} MB each, folds dealt with seed {}".format(
+            replicates, slots, pars["mem"], FOLD_SEED))
+
+        failed = []
+        for status in run_batch(jobs, slots, on_progress=self.job_progress(messages)):
+            if status.status == "success":
+                messages.addMessage("{} finished in {} s".format(status.species, status.seconds))
+            else:
+                messages.addWarningMessage("{} {} (return code {}), see '{}'".format(status.species, status.status, status.return_code, status.log))
+                failed.append(status.output_directory)
+
+        survivors = [(i, folder) for i, (folder, train, test) in enumerate(folds) if folder not in failed]
+        if not survivors:
+            raise ValueError("No replicate ran successfully")
+
+        indices, folders = [list(column) for column in zip(*survivors)]
+
+        # the replicates' commands leave projecting to this tool, each replicate is projected and the projections
+        # are then summarised with the other grids
+        if pars["parallel_projection"]:
+            for folder in folders:
+                self.project(folder, messages)
+        results = merge_results(folders, os.path.join(out_dir, "maxentResults.csv"), indices)
+        messages.addMessage("Replicate results merged into '{}'".format(results))
+        for path in merge_grids(folders, out_dir):
+            messages.addMessage("Wrote {}".format(path))
+
+        if pars["postprocess"]:
+            self.postprocess_results(out_dir, messages, indices)
+
+        return failed
+
 
 def locate_maxent_runnable():
 
@@ -543,37 +946,7 @@ def enable_parameter_by_name(parameters, parameter_name, value):
 
 def build_commands(pars):
 
-    cmd = 'java'
-
-    cmd += ' -mx{}m'.format(pars['mem'])
-
-    cmd += ' -jar "{}"'.format(pars['jar'])
-
-    cmd += ' samplesfile="{}"'.format(pars['samplesfile'])
-
-    cmd += ' environmentallayers="{}"'.format(pars['environmentallayers'])
-
-    cmd += ' outputdirectory="{}"'.format(pars['outputdirectory'])
-
-    cmd += ' outputformat={}'.format(pars['outputformat'])
-
-    cmd += ' outputfiletype={}'.format(pars['outputfiletype'])
-
-    cmd += ['', ' responsecurves'][pars['responsecurves']]
-
-    cmd += ['', ' pictures'][pars['pictures']]
-
-    cmd += ['', ' jackknife'][pars['jacknife']]
-
-    cmd += ['', ' skipifexists'][pars['skipifexists']]
-
-    cmd += ['', ' warnings'][pars['warnings']]
-
-    cmd += ['', ' autorun'][pars['autorun']]
-
-    cmd += ['', ' verbose'][pars['verbose']]
-
-    return cmd.split()
+    return maxent_command(pars, pars["samplesfile"], pars["outputdirectory"])
 
 
 # features, features_fieldname, cost_raster, max_cost_distance, out_raster_cellsize, out_ws, delete_costs = parameter_dictionary.values()
@@ -1,8 +1,23 @@
 import arcpy
 import arcpy.mapping
 import os
+import shutil
+import tempfile
 import numpy
 from collections import OrderedDict
+from numpy.lib.format import open_memmap
+from cost_distance import AGGREGATIONS, ALGORITHMS, CostSurface, accumulate, bucket_layout, coarsen, coarsen_cells, expand, parallel_cost_distance_sum
+from tiled_cost_distance import TiledCostDistance, tile_bounds, tile_size_for_budget
+from rasterize import rasterize, value_index
+from cost_distance_cache import DEFAULT_CACHE_MB, SurfaceCache, grid_hash, surface_key
+from point_in_polygon import geometry_parts
+from pool_python import use_python_for_pools
+
+# Spatial Analyst's CostDistance, or the in-process engine that needs neither the extension nor ArcGIS rasters
+ENGINES = ["Spatial Analyst", "NumPy"]
+
+# stands in for NoData when arrays are written back to rasters
+NODATA = -9999.0
 
 
 class SumWeightedCostDistancesTool(object):
@@ -72,7 +87,78 @@ class SumWeightedCostDistancesTool(object):
 
         param6.value = False
 
-        return [param0, param1, param2, param3, param4, param5, param6]
+        param7 = arcpy.Parameter(
+            displayName="Cost Distance Engine",
+            name="in_engine",
+            datatype="GPString",
+            parameterType="Optional",
+            direction="Input")
+
+        param7.filter.list = ENGINES
+        param7.value = ENGINES[0]
+
+        param8 = arcpy.Parameter(
+            displayName="Weight Costs by Field Value",
+            name="weight_by_value",
+            datatype="GPBoolean",
+            parameterType="Optional",
+            direction="Input")
+
+        param8.value = False
+
+        param9 = arcpy.Parameter(
+            displayName="Parallel Workers (NumPy engine)",
+            name="in_workers",
+            datatype="GPLong",
+            parameterType="Optional",
+            direction="Input")
+
+        param9.value = 1
+
+        param10 = arcpy.Parameter(
+            displayName="Tile Memory Budget in MB (NumPy engine, rasters larger than memory)",
+            name="in_tile_budget",
+            datatype="GPLong",
+            parameterType="Optional",
+            direction="Input")
+
+        param11 = arcpy.Parameter(
+            displayName="Cost Surface Cache Folder (NumPy engine)",
+            name="in_cache_folder",
+            datatype="DEFolder",
+            parameterType="Optional",
+            direction="Input")
+
+        param12 = arcpy.Parameter(
+            displayName="Cost Surface Cache Size in MB",
+            name="in_cache_size",
+            datatype="GPLong",
+            parameterType="Optional",
+            direction="Input")
+
+        param12.value = DEFAULT_CACHE_MB
+
+        param13 = arcpy.Parameter(
+            displayName="Cost Distance Algorithm (NumPy engine)",
+            name="in_algorithm",
+            datatype="GPString",
+            parameterType="Optional",
+            direction="Input")
+
+        param13.filter.list = ALGORITHMS
+        param13.value = ALGORITHMS[0]
+
+        param14 = arcpy.Parameter(
+            displayName="Output Cell Size Aggregation (NumPy engine)",
+            name="in_aggregation",
+            datatype="GPString",
+            parameterType="Optional",
+            direction="Input")
+
+        param14.filter.list = AGGREGATIONS
+        param14.value = AGGREGATIONS[0]
+
+        return [param0, param1, param2, param3, param4, param5, param6, param7, param8, param9, param10, param11, param12, param13, param14]
 
     def isLicensed(self):
 
@@ -92,7 +178,12 @@ class SumWeightedCostDistancesTool(object):
         parameter_summary = ", ".join(["{}: {}".format(k, v) for k, v in parameter_dictionary.iteritems()])
         messages.addMessage("Parameter summary: {}".format(parameter_summary))
 
-        in_layer, in_fieldname, cost_raster, max_cost_distance, out_raster_cellsize, out_ws, delete_costs = parameter_dictionary.values()
+        in_layer, in_fieldname, cost_raster, max_cost_distance, out_raster_cellsize, out_ws, delete_costs, engine, weight_by_value, workers, tile_budget, cache_folder, cache_size, algorithm, aggregation = parameter_dictionary.values()
+        engine = engine or ENGINES[0]
+        algorithm = algorithm or ALGORITHMS[0]
+        aggregation = aggregation or AGGREGATIONS[0]
+        workers = int(workers) if workers else 1
+        tile_budget = int(tile_budget) if tile_budget else None
 
         in_fields = [f.name for f in arcpy.ListFields(in_layer)]
         messages.addMessage("Fields in dataset '{}' are '{}'".format(in_layer, in_fields))
@@ -128,48 +219,168 @@ class SumWeightedCostDistancesTool(object):
         unique_values_count = len(unique_values)
         messages.addMessage("The input dataset field '{}' has {} unique values: {}".format(in_fieldname, unique_values_count, unique_values))
 
-        cost_raster_names = OrderedDict([(value, make_output_name("cost_{}".format(value), out_ws)) for value in unique_values])
-
-        messages.addMessage("Cost rasters to be generated: {}".format(cost_raster_names.values()))
-
-        temp_layer = "temp_layer"
-
-        for value in unique_values:
-            messages.addMessage("Processing field value = {}".format(value))
-
-            if arcpy.Exists(temp_layer):
-                arcpy.Delete_management(temp_layer)
-
-            where = '"{}" = {}'.format(in_fieldname, value)
-            try:
-                arcpy.SelectLayerByAttribute_management(in_layer, "NEW_SELECTION", where)
-                cost = arcpy.sa.CostDistance(in_layer, cost_raster, max_cost_distance)
-                messages.addMessage("\tCreated cost raster")
-            except:
-                messages.addWarningMessage("\tCould not create cost raster")
-                cost_raster_names.pop(value)
-                continue
-            try:
-                out_name = cost_raster_names[value]
-                cost.save(out_name)
-                messages.addMessage("\tSaved cost raster '{}'".format(out_name))
-            except:
-                messages.addWarningMessage("\tCould not create cost raster for field value = {}".format(value))
-                cost_raster_names.pop(value)
-                continue
-
-        if not len(cost_raster_names):
+        keep_costs = delete_costs != "true"
+        weight_by_value = weight_by_value == "true"
+
+        out_cell_size = cell_size_value(out_raster_cellsize)
+        if out_cell_size and engine != "NumPy":
+            messages.addWarningMessage("Output cell size is honoured by the NumPy engine, running at the cost raster's cell size")
+            out_cell_size = None
+
+        cost_grid = CostGrid(cost_raster, out_cell_size, aggregation)
+        if cost_grid.factor > 1:
+            messages.addMessage("Cost raster coarsened from cell size {} to {} by the {} of each {} x {} block".format(
+                cost_grid.native_cell_size, cost_grid.cell_size, aggregation.lower(), cost_grid.factor, cost_grid.factor))
+        tile_size = tile_size_for_budget(tile_budget) if tile_budget and engine == "NumPy" else None
+        scratch = None
+
+        if tile_budget and engine != "NumPy":
+            messages.addWarningMessage("Tiled processing needs the NumPy engine, reading the cost raster whole")
+        if (workers > 1 and engine != "NumPy") or (workers > 1 and tile_size):
+            messages.addWarningMessage("Parallel workers need the in-memory NumPy engine, running serially")
+        if cache_folder and (engine != "NumPy" or tile_size):
+            messages.addWarningMessage("The cost surface cache needs the in-memory NumPy engine, not using it")
+            cache_folder = None
+
+        summed_values = []
+        weights = [float(value) if weight_by_value else 1.0 for value in unique_values]
+
+        if tile_size:
+            # cost, labels and the sum live in memory-mapped files, only a tile of each is read in at a time
+            messages.addMessage("Cost raster of {} x {} cells processed in tiles of {} x {} cells".format(cost_grid.shape[0], cost_grid.shape[1], tile_size, tile_size))
+            scratch = tempfile.mkdtemp(prefix="cost_tiles_")
+            cost = cost_grid.read_aligned(cost_grid.raster, open_memmap(os.path.join(scratch, "cost.npy"), "w+", numpy.float64, cost_grid.shape), tile_size)
+            source_labels = cost_grid.source_labels(in_layer_path, in_layer_dtype, in_fieldname,
+                                                    open_memmap(os.path.join(scratch, "native_labels.npy"), "w+", numpy.float64, cost_grid.native_shape), tile_size)
+            if cost_grid.factor > 1:
+                source_labels = cost_grid.coarse_labels(source_labels, open_memmap(os.path.join(scratch, "labels.npy"), "w+", numpy.float64, cost_grid.shape), tile_size)
+            cost_sum = open_memmap(os.path.join(scratch, "cost_sum.npy"), "w+", numpy.float64, cost_grid.shape)
+            tiled = TiledCostDistance(cost, source_labels, cost_grid.cell_size, tile_size, scratch, algorithm)
+            kept = open_memmap(os.path.join(scratch, "kept.npy"), "w+", numpy.float64, cost_grid.shape) if keep_costs else None
+
+            for value, weight in zip(unique_values, weights):
+                messages.addMessage("Processing field value = {}".format(value))
+                try:
+                    reached = tiled.distance(float(value), max_cost_distance)
+                except:
+                    messages.addWarningMessage("\tCould not create cost raster")
+                    continue
+
+                tiled.accumulate(cost_sum, reached, weight)
+                summed_values.append(value)
+                messages.addMessage("\tAdded to summed cost, {} tiles reached in {} sweeps".format(len(reached), tiled.sweeps))
+                if keep_costs:
+                    save_cost_raster(cost_grid, tiled.surface(reached, kept), value, out_ws, messages, tile_size)
+
+            del cost, source_labels, tiled, kept
+
+        else:
+            messages.addMessage("Cost raster read as a {} x {} array".format(*cost_grid.cost.shape))
+
+            # each cost surface is folded into the sum as soon as it is made, so only one is ever held at a time
+            cost_sum = numpy.zeros(cost_grid.shape, dtype=numpy.float64)
+
+            if engine == "NumPy":
+                source_cells = cost_grid.coarse_cells(value_index(cost_grid.source_labels(in_layer_path, in_layer_dtype, in_fieldname)))
+                messages.addMessage("Sources rasterised on the cost raster grid, {} cells".format(sum(len(c) for c in source_cells.values())))
+
+            # surfaces are keyed on their source cells and the cost grid, unchanged values are loaded, not recomputed
+            cache, cache_keys = None, {}
+            if cache_folder:
+                cache = SurfaceCache(cache_folder, cache_size)
+                cost_hash = grid_hash(cost_grid.cost)
+                cache_keys = dict((value, surface_key(source_cells.get(float(value), []), cost_hash, cost_grid.cell_size, max_cost_distance))
+                                  for value in unique_values)
+                messages.addMessage("Using cost surface cache '{}'".format(cache_folder))
+
+            if engine == "NumPy" and workers > 1:
+                use_python_for_pools()
+                messages.addMessage("Processing field values with {} workers".format(workers))
+
+                # cached values are summed here, only the rest go to the pool, which writes them to the cache
+                pending, pending_weights = [], []
+                for value, weight in zip(unique_values, weights):
+                    hit = cache.get(cache_keys[value]) if cache else None
+                    if hit is None:
+                        pending.append(value)
+                        pending_weights.append(weight)
+                        continue
+                    accumulate(cost_sum, hit[0], weight, hit[1])
+                    summed_values.append(value)
+                    messages.addMessage("\tAdded field value {} to summed cost from cache".format(value))
+                    if keep_costs:
+                        save_cost_raster(cost_grid, expand(hit[0], hit[1], cost_sum.shape), value, out_ws, messages)
+
+                cache_paths = dict((value, cache.path(cache_keys[value])) for value in pending) if cache else None
+                keep_folder = tempfile.mkdtemp(prefix="cost_rasters_") if keep_costs else None
+                try:
+                    for done, failed, kept in parallel_cost_distance_sum(cost_sum, cost_grid.cost, source_cells, pending, pending_weights,
+                                                                         cost_grid.cell_size, max_cost_distance, workers, keep_folder, cache_paths, algorithm):
+                        summed_values.extend(done)
+                        messages.addMessage("\tAdded field values {} to summed cost ({} of {})".format(done, len(summed_values), unique_values_count))
+                        for value in failed:
+                            messages.addWarningMessage("\tCould not create cost raster for field value = {}".format(value))
+                        for value, path in kept:
+                            save_cost_raster(cost_grid, numpy.load(path), value, out_ws, messages)
+                            os.remove(path)
+                finally:
+                    if keep_folder:
+                        shutil.rmtree(keep_folder, ignore_errors=True)
+            else:
+                if engine == "NumPy":
+                    cost_surface = CostSurface(cost_grid.cost, cost_grid.cell_size, algorithm=algorithm)
+                    if algorithm == "Bucket" and not bucket_layout(cost_surface.steps, cost_surface.min_cost, cost_surface.max_cost):
+                        messages.addWarningMessage("Cost values span too wide a range for the bucket queue, using the heap")
+
+                temp_layer = "temp_layer"
+
+                for value, weight in zip(unique_values, weights):
+                    messages.addMessage("Processing field value = {}".format(value))
+
+                    if arcpy.Exists(temp_layer):
+                        arcpy.Delete_management(temp_layer)
+
+                    where = '"{}" = {}'.format(in_fieldname, value)
+                    try:
+                        hit = cache.get(cache_keys[value]) if engine == "NumPy" and cache else None
+                        if hit is not None:
+                            cost, offset = hit
+                        elif engine == "NumPy":
+                            cost, offset = cost_surface.cells_distance(source_cells.get(float(value), []), max_cost_distance)
+                            if cache:
+                                cache.put(cache_keys[value], cost, offset)
+                        else:
+                            arcpy.SelectLayerByAttribute_management(in_layer, "NEW_SELECTION", where)
+                            cost, offset = cost_grid.read_aligned(arcpy.sa.CostDistance(in_layer, cost_raster, max_cost_distance)), (0, 0)
+                        messages.addMessage("\tLoaded cost raster from cache" if hit is not None else "\tCreated cost raster")
+                    except:
+                        messages.addWarningMessage("\tCould not create cost raster")
+                        continue
+
+                    accumulate(cost_sum, cost, weight, offset)
+                    summed_values.append(value)
+                    messages.addMessage("\tAdded to summed cost")
+
+                    if keep_costs:
+                        save_cost_raster(cost_grid, expand(cost, offset, cost_sum.shape), value, out_ws, messages)
+
+                    del cost
+
+            if cache:
+                evicted = cache.evict()
+                messages.addMessage("Cost surface cache: {} hits, {} misses, {} evicted".format(cache.hits, cache.misses, evicted))
+
+        if not summed_values:
 
             raise ValueError("No cost rasters to sum")
 
-        cost_rasters = cost_raster_names.values()
-
-        sum_raster = nulls_to_zero(cost_rasters[0])
-        for cost_raster in cost_rasters[1:]:
-            sum_raster += nulls_to_zero(cost_raster)
-
         out_name = make_output_name("cost_sum", out_ws)
-        sum_raster.save(out_name)
+        try:
+            cost_grid.save(cost_sum, out_name, tile_size)
+        finally:
+            if scratch:
+                del cost_sum
+                shutil.rmtree(scratch, ignore_errors=True)
         messages.addMessage("\tSaved summed cost raster to '{}'".format(out_name))
 
         try:
@@ -178,12 +389,6 @@ class SumWeightedCostDistancesTool(object):
         except:
             messages.addMessage("Could not add '{}' to map".format(out_name))
 
-        if delete_costs == "true":
-            messages.addMessage("Deleting individual cost rasters...")
-            for r in cost_raster_names.values():
-                arcpy.Delete_management(r)
-                messages.addMessage("\tDeleted cost raster '{}'".format(r))
-
         try:
             arcpy.Compact_management(out_ws)
             messages.addMessage("Output workspace '{}' compacted".format(out_ws))
@@ -196,6 +401,18 @@ class SumWeightedCostDistancesTool(object):
             pass
 
 
+def save_cost_raster(cost_grid, cost, value, out_ws, messages, tile_size=None):
+
+    try:
+        out_name = make_output_name("cost_{}".format(value), out_ws)
+        cost_grid.save(cost, out_name, tile_size)
+        messages.addMessage("\tSaved cost raster '{}'".format(out_name))
+    except:
+        messages.addWarningMessage("\tCould not create cost raster for field value = {}".format(value))
+
+    return
+
+
 def make_output_name(like_name, out_ws):
 
     like_name = arcpy.ValidateTableName(like_name, out_ws)
@@ -204,6 +421,174 @@ def make_output_name(like_name, out_ws):
     return os.path.join(out_ws, like_name)
 
 
-def nulls_to_zero(in_raster):
+def cell_size_value(cell_size):
+
+    # a cell size parameter is a number or a raster to take it from, anything else leaves the cell size alone
+    if not cell_size:
+        return None
+    try:
+        return float(cell_size)
+    except ValueError:
+        pass
+    try:
+        return arcpy.Raster(cell_size).meanCellWidth
+    except:
+        return None
+
+
+def source_parts(shape):
+
+    # an arcpy geometry's coordinates as rasterize takes them for its type
+    if shape.type == "polygon":
+        return geometry_parts(shape)
+    if shape.type == "polyline":
+        return [numpy.array([(pnt.X, pnt.Y) for pnt in part if pnt is not None], dtype=numpy.float64) for part in shape]
+    if shape.type == "multipoint":
+        return numpy.array([(pnt.X, pnt.Y) for pnt in shape], dtype=numpy.float64)
+
+    return numpy.array([(shape.firstPoint.X, shape.firstPoint.Y)], dtype=numpy.float64)
+
+
+class CostGrid(object):
+
+    def __init__(self, cost_raster, cell_size=None, method="Mean"):
+
+        # the cost raster's grid, or a coarser one of whole blocks of its cells when a larger cell size is asked for,
+        # with its values as a float64 array with NaN for NoData read on first use
+        self.raster = arcpy.Raster(cost_raster)
+        self.left, self.top = self.raster.extent.XMin, self.raster.extent.YMax
+        self.native_cell_size = self.raster.meanCellWidth
+        self.native_shape = self.raster.height, self.raster.width
+
+        self.factor = max(1, int(round(float(cell_size) / self.native_cell_size))) if cell_size else 1
+        self.method = method
+        self.cell_size = self.native_cell_size * self.factor
+        self.shape = -(-self.native_shape[0] // self.factor), -(-self.native_shape[1] // self.factor)
+        self._cost = None
+
+        return
+
+    @property
+    def cost(self):
+
+        if self._cost is None:
+            self._cost = self.read_aligned(self.raster)
+
+        return self._cost
+
+    def block_corner(self, row0, row1, col0, cell_size=None):
+
+        # lower left corner of the block of rows row0 to row1 starting at column col0, rows count down from the top
+        cell_size = cell_size or self.cell_size
+        return arcpy.Point(self.left + col0 * cell_size, self.top - row1 * cell_size)
+
+    def blocks(self, tile_size=None):
+
+        # (grid block, native block) pairs as (row0, row1, col0, col1) covering the grid, a native block is the
+        # factor x factor cells behind each cell of its grid block, tile_size bounds the native block
+        tile_size = max(1, tile_size // self.factor) if tile_size else max(self.shape)
+        rows, cols = self.native_shape
+        for row0, row1, col0, col1 in tile_bounds(self.shape, tile_size).values():
+            yield (row0, row1, col0, col1), (row0 * self.factor, min(row1 * self.factor, rows), col0 * self.factor, min(col1 * self.factor, cols))
+
+    def read_aligned(self, raster, out=None, tile_size=None, convert=None, native=False):
+
+        # a raster read over exactly the cost raster's rows and columns, NoData as NaN, whole or tile by tile into out,
+        # aggregated to the grid's cell size unless native
+        raster = raster if isinstance(raster, arcpy.Raster) else arcpy.Raster(raster)
+        if out is None:
+            out = numpy.empty(self.native_shape if native else self.shape, dtype=numpy.float64)
+            tile_size = None
 
-    return arcpy.sa.Con(arcpy.sa.IsNull(in_raster), 0, in_raster)
+        for (row0, row1, col0, col1), (n_row0, n_row1, n_col0, n_col1) in self.blocks(tile_size):
+            if native:
+                row0, row1, col0, col1 = n_row0, n_row1, n_col0, n_col1
+            block = arcpy.RasterToNumPyArray(raster, self.block_corner(n_row0, n_row1, n_col0, self.native_cell_size),
+                                             n_col1 - n_col0, n_row1 - n_row0).astype(numpy.float64)
+            if raster.noDataValue is not None:
+                block[block == raster.noDataValue] = numpy.nan
+            block = convert(block) if convert else block
+            out[row0:row1, col0:col1] = block if native else coarsen(block, self.factor, self.method)
+
+        return out
+
+    def coarse_labels(self, labels, out=None, tile_size=None):
+
+        # native labels on the grid, a block takes the highest value among its sources
+        if self.factor == 1:
+            return labels
+
+        out = numpy.empty(self.shape, dtype=numpy.float64) if out is None else out
+        for (row0, row1, col0, col1), (n_row0, n_row1, n_col0, n_col1) in self.blocks(tile_size):
+            out[row0:row1, col0:col1] = coarsen(labels[n_row0:n_row1, n_col0:n_col1], self.factor, "Max")
+
+        return out
+
+    def coarse_cells(self, index):
+
+        # a value index of native cells on the grid, unlike coarse_labels no value loses a block to another
+        if self.factor == 1:
+            return index
+
+        return dict((value, coarsen_cells(cells, self.factor, self.native_shape[1])) for value, cells in index.items())
+
+    def source_labels(self, in_layer_path, in_layer_dtype, in_fieldname, out=None, tile_size=None):
+
+        # the field value of the source under each cell of the cost raster itself, NaN elsewhere; the environment is
+        # put back afterwards so the caller's snap raster, extent and cell size are left as they were
+        saved = arcpy.env.snapRaster, arcpy.env.extent, arcpy.env.cellSize
+        arcpy.env.snapRaster = self.raster
+        arcpy.env.extent = self.raster.extent
+        arcpy.env.cellSize = self.native_cell_size
+
+        try:
+            if in_layer_dtype in ["RasterDataset", "RasterLayer"]:
+                # map cell values to the field through the raster attribute table
+                table = arcpy.da.TableToNumPyArray(in_layer_path, ["Value", in_fieldname])
+                order = numpy.argsort(table["Value"])
+                keys, fields = table["Value"][order], table[in_fieldname][order].astype(numpy.float64)
+
+                def lookup(cells):
+                    pos = numpy.clip(numpy.searchsorted(keys, cells), 0, len(keys) - 1)
+                    return numpy.where(keys[pos] == cells, fields[pos], numpy.nan)
+
+                return self.read_aligned(in_layer_path, out, tile_size, lookup, native=True)
+
+            # features are read once and burnt into the grid here, not selected and converted once per value
+            with arcpy.da.SearchCursor(in_layer_path, [in_fieldname, "SHAPE@"], spatial_reference=self.raster.spatialReference) as rows:
+                features = ((value, shape.type, source_parts(shape)) for value, shape in rows if shape is not None and value is not None)
+                return rasterize(features, self.native_shape, self.left, self.top, self.native_cell_size, out)
+        finally:
+            arcpy.env.snapRaster, arcpy.env.extent, arcpy.env.cellSize = saved
+
+    def to_raster(self, grid, row0=0, col0=0):
+
+        # an array, or a block of the grid starting at row0, col0, as a raster on the cost raster's grid
+        grid = numpy.where(numpy.isnan(grid), NODATA, grid)
+        raster = arcpy.NumPyArrayToRaster(grid, self.block_corner(row0, row0 + grid.shape[0], col0), self.cell_size, self.cell_size, NODATA)
+        arcpy.DefineProjection_management(raster, self.raster.spatialReference)
+
+        return raster
+
+    def save(self, grid, out_name, tile_size=None):
+
+        # grids larger than a tile are written block by block and mosaicked, so no more than a tile is held in memory
+        if not tile_size or max(grid.shape) <= tile_size:
+            self.to_raster(numpy.asarray(grid)).save(out_name)
+            return
+
+        blocks = []
+        try:
+            for i, (row0, row1, col0, col1) in enumerate(sorted(tile_bounds(grid.shape, tile_size).values())):
+                block = os.path.join(arcpy.env.scratchFolder, "cost_block_{}.tif".format(i))
+                self.to_raster(numpy.asarray(grid[row0:row1, col0:col1]), row0, col0).save(block)
+                blocks.append(block)
+
+            out_ws, out_raster = os.path.split(out_name)
+            arcpy.MosaicToNewRaster_management(";".join(blocks), out_ws, out_raster, self.raster.spatialReference,
+                                               "64_BIT", self.cell_size, 1)
+        finally:
+            for block in blocks:
+                arcpy.Delete_management(block)
+
+        return
@@ -0,0 +1,30 @@
+import os
+import sys
+import time
+
+# stands in for Maxent in the batch tests: reads key=value arguments as Maxent does, sleeps and exits as the
+# <samplesfile>.stub file beside its samples says ("<seconds> <exit code>"), and notes when it ran in its output
+# directory
+
+
+def main():
+
+    args = dict(arg.split("=", 1) for arg in sys.argv[1:] if "=" in arg)
+    seconds, code = 0.0, 0
+    spec = args["samplesfile"] + ".stub"
+    if os.path.exists(spec):
+        with open(spec) as f:
+            seconds, code = f.read().split()
+
+    started = time.time()
+    print("stub maxent {}".format(" ".join(sys.argv[1:])))
+    print("Iteration 100 gain 1.25")
+    time.sleep(float(seconds))
+    with open(os.path.join(args["outputdirectory"], "stub_times.txt"), "w") as f:
+        f.write("{} {}\n".format(started, time.time()))
+
+    return int(code)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import os
+import sys
+import unittest
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cost_distance import CostSurface, cost_distance, neighbour_steps
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sum_cost")
+GDB = os.path.join(FIXTURES, "test_sum_cost.gdb")
+COST_RASTER = os.path.join(GDB, "slope30m")
+SOURCE_RASTER = os.path.join(GDB, "stream_strahler")
+
+# distance surfaces from every source class of a fixed cost grid, made once by the engine's dijkstra (or exported
+# from CostDistance over a window of the fixtures' top left corner by export_reference) and kept in the tree, so any
+# later change that moves a distance shows up
+REFERENCE = os.path.join(FIXTURES, "cost_distance_reference.npz")
+REFERENCE_CELLS = 300
+REFERENCE_SHAPE = (60, 80)
+
+# loose enough for CostDistance's 32 bit floats
+RTOL = 1e-5
+ATOL = 1e-3
+
+
+def relaxed_distance(cost, sources, cell_size):
+
+    # accumulated cost by relaxing every cell against its 8 neighbours until nothing changes, slow but independent of
+    # the engine's queue, with CostDistance's step rule: the mean of the two costs times cell size or its diagonal
+    rows, cols = cost.shape
+    dist = numpy.where(sources & ~numpy.isnan(cost), 0.0, numpy.inf)
+    moves = [(dr, dc, factor) for (offset, factor), (dr, dc) in
+             zip(neighbour_steps(cols, cell_size), [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])]
+    padded_cost = numpy.pad(cost, 1, mode="constant", constant_values=numpy.nan)
+
+    while True:
+        padded = numpy.pad(dist, 1, mode="constant", constant_values=numpy.inf)
+        best = dist.copy()
+        for dr, dc, factor in moves:
+            near = padded[1 + dr:1 + dr + rows, 1 + dc:1 + dc + cols]
+            near_cost = padded_cost[1 + dr:1 + dr + rows, 1 + dc:1 + dc + cols]
+            with numpy.errstate(invalid="ignore"):
+                step = near + factor * (near_cost + cost)
+                best = numpy.where(step < best, step, best)
+        best[numpy.isnan(cost)] = numpy.inf
+        if numpy.array_equal(best, dist):
+            break
+        dist = best
+
+    dist[numpy.isinf(dist)] = numpy.nan
+
+    return dist
+
+
+def export_reference(path=REFERENCE, cells=REFERENCE_CELLS):
+
+    # runs CostDistance from every stream order in the fixtures over a window of the cost raster and saves the cost,
+    # the sources and the surfaces, needs ArcGIS with Spatial Analyst
+    import arcpy
+    arcpy.CheckOutExtension("Spatial")
+
+    cost_raster = arcpy.Raster(COST_RASTER)
+    cell_size = cost_raster.meanCellWidth
+    corner = arcpy.Point(cost_raster.extent.XMin, cost_raster.extent.YMax - cells * cell_size)
+    window = arcpy.Extent(corner.X, corner.Y, corner.X + cells * cell_size, cost_raster.extent.YMax)
+
+    saved = arcpy.env.snapRaster, arcpy.env.extent, arcpy.env.cellSize
+    arcpy.env.snapRaster, arcpy.env.extent, arcpy.env.cellSize = cost_raster, window, cell_size
+    try:
+        cost = arcpy.RasterToNumPyArray(cost_raster, corner, cells, cells, numpy.nan).astype(numpy.float64)
+        labels = arcpy.RasterToNumPyArray(SOURCE_RASTER, corner, cells, cells, -1).astype(numpy.float64)
+        values = numpy.unique(labels[labels >= 0])
+
+        surfaces = {}
+        for value in values:
+            sources = arcpy.sa.SetNull(arcpy.sa.Raster(SOURCE_RASTER) != int(value), 1)
+            surface = arcpy.sa.CostDistance(sources, cost_raster)
+            surfaces["distance_{}".format(int(value))] = arcpy.RasterToNumPyArray(surface, corner, cells, cells, numpy.nan).astype(numpy.float64)
+    finally:
+        arcpy.env.snapRaster, arcpy.env.extent, arcpy.env.cellSize = saved
+
+    numpy.savez_compressed(path, cost=cost, labels=labels, values=values, cell_size=cell_size, **surfaces)
+
+    return path
+
+
+def dijkstra_reference(path=REFERENCE, shape=REFERENCE_SHAPE):
+
+    # a slope-like cost grid with NoData holes and three classes of stream-like source cells, with the surfaces the
+    # engine's dijkstra finds from each class, costs are in eighths so the file compresses well
+    random = numpy.random.RandomState(2017)
+    rows, cols = numpy.mgrid[0:shape[0], 0:shape[1]]
+    cost = numpy.round((1.0 + 20.0 * numpy.abs(numpy.sin(rows / 9.0) * numpy.cos(cols / 13.0)) + random.uniform(0, 4, shape)) * 8) / 8
+    cost[random.rand(*shape) < 0.05] = numpy.nan
+
+    labels = numpy.full(shape, -1.0)
+    labels[shape[0] // 3, 5:cols.shape[1] - 5] = 1
+    labels[5:shape[0] - 5, shape[1] // 4] = 2
+    labels[numpy.arange(shape[0] - 10), numpy.arange(shape[0] - 10) + 10] = 3
+    values = numpy.unique(labels[labels >= 0])
+    cell_size = 30.0
+
+    surfaces = dict(("distance_{}".format(int(value)), cost_distance(cost, labels == value, cell_size, algorithm="Heap")) for value in values)
+    numpy.savez_compressed(path, cost=cost, labels=labels, values=values, cell_size=cell_size, **surfaces)
+
+    return path
+
+
+def load_reference():
+
+    with open(REFERENCE, "rb") as f:
+        data = numpy.load(f)
+        return dict((name, data[name]) for name in data.files)
+
+
+class CostDistanceTest(unittest.TestCase):
+
+    def setUp(self):
+
+        random = numpy.random.RandomState(7)
+        self.cost = random.uniform(1.0, 9.0, (40, 50))
+        self.cost[random.rand(40, 50) < 0.1] = numpy.nan
+        self.sources = numpy.zeros(self.cost.shape, dtype=bool)
+        self.sources[random.randint(0, 40, 5), random.randint(0, 50, 5)] = True
+
+    def test_matches_relaxation(self):
+
+        expected = relaxed_distance(self.cost, self.sources, 30.0)
+        for algorithm in ["Heap", "Bucket"]:
+            result = cost_distance(self.cost, self.sources, 30.0, algorithm=algorithm)
+            numpy.testing.assert_allclose(result, expected, rtol=1e-12, equal_nan=True)
+
+    def test_window_matches_whole_grid(self):
+
+        max_distance = 1500.0
+        whole = cost_distance(self.cost, self.sources, 30.0, max_distance)
+        window, (row0, col0) = CostSurface(self.cost, 30.0).windowed_distance(self.sources, max_distance)
+        expanded = numpy.full(self.cost.shape, numpy.nan)
+        expanded[row0:row0 + window.shape[0], col0:col0 + window.shape[1]] = window
+        numpy.testing.assert_allclose(expanded, whole, rtol=1e-12, equal_nan=True)
+
+    def test_matches_reference(self):
+
+        reference = load_reference()
+        for algorithm in ["Heap", "Bucket"]:
+            surface = CostSurface(reference["cost"], float(reference["cell_size"]), algorithm=algorithm)
+            for value in reference["values"]:
+                expected = reference["distance_{}".format(int(value))]
+                result = surface.distance(reference["labels"] == value)
+                numpy.testing.assert_allclose(result, expected, rtol=RTOL, atol=ATOL, equal_nan=True,
+                                              err_msg="{} from source class {}".format(algorithm, int(value)))
+
+
+if __name__ == "__main__":
+    if "--export" in sys.argv:
+        print(export_reference())
+    elif "--dijkstra" in sys.argv:
+        print(dijkstra_reference())
+    else:
+        unittest.main()
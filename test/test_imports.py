@@ -0,0 +1,92 @@
+import ast
+import importlib
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TOOLBOX = os.path.join(ROOT, "kst-custom-tools.pyt")
+
+
+def local_imports(path):
+
+    # (module, names) for every "from module import names" of a module in the toolbox folder
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            if os.path.exists(os.path.join(ROOT, node.module + ".py")):
+                imports.append((node.module, [alias.name for alias in node.names]))
+
+    return imports
+
+
+def top_level_names(path):
+
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+
+    names = set()
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.Assign):
+            names.update(target.id for target in node.targets if isinstance(target, ast.Name))
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.update((alias.asname or alias.name).split(".")[0] for alias in node.names)
+
+    return names
+
+
+def toolbox_modules():
+
+    # every module the toolbox loads, directly or through another module of the toolbox
+    pending, seen = [TOOLBOX], []
+    while pending:
+        for module, names in local_imports(pending.pop()):
+            if module not in seen:
+                seen.append(module)
+                pending.append(os.path.join(ROOT, module + ".py"))
+
+    return seen
+
+
+def needs_arcpy(module):
+
+    try:
+        importlib.import_module(module)
+    except ImportError as e:
+        if "arcpy" in str(e):
+            return True
+        raise
+
+    return False
+
+
+class ToolboxImportTest(unittest.TestCase):
+
+    def test_modules_import(self):
+
+        # the tools need arcpy, everything they import without it has to import cleanly here
+        for module in toolbox_modules():
+            try:
+                needs_arcpy(module)
+            except ImportError as e:
+                self.fail("{}: {}".format(module, e))
+
+    def test_imported_names_exist(self):
+
+        # checked from the source as well so the tool modules are covered where arcpy is missing
+        for path in [TOOLBOX] + [os.path.join(ROOT, m + ".py") for m in toolbox_modules()]:
+            for module, names in local_imports(path):
+                defined = top_level_names(os.path.join(ROOT, module + ".py"))
+                missing = [name for name in names if name != "*" and name not in defined]
+                self.assertEqual(missing, [], "{} imports {} from {}".format(os.path.basename(path), missing, module))
+
+
+if __name__ == "__main__":
+    unittest.main()
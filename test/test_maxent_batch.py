@@ -0,0 +1,154 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from maxent_batch import batch_jobs, concurrent_jobs, maxent_command, run_batch
+from maxent_progress import STDOUT_LOG
+from maxent_run_cache import RunCache
+
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "maxent_stub.py")
+
+
+def stub_executable(folder):
+
+    # a launcher for the stub that maxent_command runs directly, as it does maxent.bat
+    if os.name == "nt":
+        path = os.path.join(folder, "maxent.bat")
+        with open(path, "w") as f:
+            f.write('@"{}" "{}" %*\n'.format(sys.executable, STUB))
+    else:
+        path = os.path.join(folder, "maxent.sh")
+        with open(path, "w") as f:
+            f.write('#!/bin/sh\nexec "{}" "{}" "$@"\n'.format(sys.executable, STUB))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+
+    return path
+
+
+class ConcurrentJobsTest(unittest.TestCase):
+
+    def test_limited_by_memory(self):
+
+        self.assertEqual(concurrent_jobs(1000, 3500, 8), 3)
+
+    def test_limited_by_cores_and_threads(self):
+
+        self.assertEqual(concurrent_jobs(1000, 64000, 8, threads=4), 2)
+
+    def test_never_fewer_than_one(self):
+
+        self.assertEqual(concurrent_jobs(8000, 2000, 1, threads=4), 1)
+
+
+class RunBatchTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp(prefix="maxent_batch_test_")
+        self.samples = os.path.join(self.folder, "samples")
+        self.layers = os.path.join(self.folder, "layers")
+        os.makedirs(self.samples)
+        os.makedirs(self.layers)
+        self.pars = {"jar": stub_executable(self.folder), "mem": 512, "environmentallayers": self.layers,
+                     "outputdirectory": os.path.join(self.folder, "out"), "outputformat": "cloglog", "outputfiletype": "asc"}
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def add_species(self, species, seconds, code):
+
+        path = os.path.join(self.samples, "{}.csv".format(species))
+        with open(path, "w") as f:
+            f.write("species,x,y\n{},1,2\n".format(species))
+        with open(path + ".stub", "w") as f:
+            f.write("{} {}\n".format(seconds, code))
+
+        return path
+
+    def test_command_runs_stub_directly(self):
+
+        command = maxent_command(self.pars, "s.csv", "out")
+        self.assertEqual(command[0], self.pars["jar"])
+        self.assertIn("samplesfile=s.csv", command)
+
+    def test_statuses_and_slots(self):
+
+        for species in ["a", "b", "c", "d"]:
+            self.add_species(species, 0.5, 0)
+        self.add_species("e", 0.0, 3)
+
+        statuses = dict((status.species, status) for status in run_batch(batch_jobs(self.pars, self.samples), 2, poll=0.05))
+
+        self.assertEqual(sorted(statuses), ["a", "b", "c", "d", "e"])
+        self.assertEqual([statuses[s].status for s in "abcd"], ["success"] * 4)
+        self.assertEqual((statuses["e"].status, statuses["e"].return_code), ("failure", 3))
+        with open(statuses["a"].log) as f:
+            self.assertIn("samplesfile=", f.read())
+
+        # never more than two at once, and two did run side by side
+        times = []
+        for species in "abcd":
+            with open(os.path.join(statuses[species].output_directory, "stub_times.txt")) as f:
+                times.append([float(t) for t in f.read().split()])
+        overlaps = [sum(1 for start, end in times if start <= moment < end) for moment, _ in times]
+        self.assertEqual(max(overlaps), 2)
+
+    def test_progress_and_log(self):
+
+        self.add_species("a", 0.0, 0)
+        reported = []
+
+        statuses = list(run_batch(batch_jobs(self.pars, self.samples), 1, poll=0.05, on_progress=lambda job, progress: reported.append((job.species, progress))))
+
+        self.assertEqual(reported, [("a", {"iteration": "100", "gain": "1.25"})])
+        self.assertEqual(os.path.basename(statuses[0].log), STDOUT_LOG)
+        with open(statuses[0].log) as f:
+            self.assertIn("Iteration 100 gain 1.25", f.read())
+
+    def test_missing_executable(self):
+
+        self.add_species("a", 0.0, 0)
+        self.pars["jar"] = os.path.join(self.folder, "no_such_maxent")
+
+        statuses = list(run_batch(batch_jobs(self.pars, self.samples), 1, poll=0.05))
+
+        self.assertEqual([(s.species, s.status) for s in statuses], [("a", "not started")])
+        with open(statuses[0].log) as f:
+            self.assertIn("Could not start", f.read())
+
+    def test_rerun_served_from_cache(self):
+
+        # one samples file of every species, split into the species' output directories on each run as the tool does
+        samples = os.path.join(self.folder, "all_species.csv")
+        with open(samples, "w") as f:
+            f.write("species,x,y\na,1,2\nb,3,4\na,5,6\n")
+        self.pars["batch_samples"] = samples
+        cache = RunCache(os.path.join(self.folder, "cache"))
+
+        jobs = batch_jobs(self.pars, samples)
+        keys = dict((job.species, cache.run_key(self.pars, job.samples)) for job in jobs)
+        for status in run_batch(jobs, 2, poll=0.05):
+            self.assertEqual(status.status, "success")
+            cache.put(keys[status.species], status.output_directory)
+
+        time.sleep(0.05)
+        jobs = batch_jobs(self.pars, samples)
+        self.assertEqual([cache.get(cache.run_key(self.pars, job.samples)) for job in jobs], [os.path.abspath(job.output_directory) for job in jobs])
+        self.assertEqual(cache.hits, 2)
+
+        # a species whose samples changed is split afresh and misses
+        with open(samples, "a") as f:
+            f.write("b,7,8\n")
+        jobs = batch_jobs(self.pars, samples)
+        self.assertEqual([cache.get(cache.run_key(self.pars, job.samples)) is None for job in jobs], [False, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
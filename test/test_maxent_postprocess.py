@@ -0,0 +1,91 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from maxent_postprocess import postprocess, threshold_column
+from raster_io import GridHeader, read_grid, write_grid
+
+HEADER = GridHeader(4, 3, 100.0, 200.0, 10.0, -9999.0)
+
+COLUMN = "10 percentile training presence Cloglog threshold"
+
+
+class PostprocessTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp(prefix="maxent_postprocess_test_")
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def write_results(self, rows):
+
+        with open(os.path.join(self.folder, "maxentResults.csv"), "w") as f:
+            f.write("Species,{}\n".format(COLUMN))
+            for name, threshold in rows:
+                f.write("{},{}\n".format(name, threshold))
+
+    def write_replicates(self, values, extension="asc"):
+
+        # a constant grid per parallel replicate, every one named after the species, with one NoData cell
+        for i, value in enumerate(values):
+            folder = os.path.join(self.folder, "replicate_{}".format(i))
+            os.makedirs(folder)
+            data = numpy.full((HEADER.nrows, HEADER.ncols), value)
+            data[0, 0] = numpy.nan
+            write_grid(os.path.join(folder, "sp.{}".format(extension)), data, HEADER)
+
+    def ensemble(self, folds=None, extension="asc"):
+
+        written = postprocess(self.folder, "10 percentile training presence", "cloglog", extension, folds)
+        self.assertEqual(list(written.keys()), ["sp"])
+
+        return dict((os.path.basename(path)[3:-4], read_grid(path).data) for path in written["sp"])
+
+    def test_same_named_replicate_grids(self):
+
+        self.write_replicates([0.1, 0.5, 0.9])
+        self.write_results([("sp_0", 0.4), ("sp_1", 0.4), ("sp_2", 0.4), ("sp (average)", 0.4)])
+
+        grids = self.ensemble()
+        numpy.testing.assert_allclose(grids["mean"][1:, :], 0.5, rtol=1e-6)
+        numpy.testing.assert_allclose(grids["stddev"][1:, :], numpy.std([0.1, 0.5, 0.9]), rtol=1e-6)
+        self.assertTrue((grids["above"][1:, :] == 2).all())
+        self.assertTrue((grids["binary"][1:, :] == 1).all())
+        for name in ["mean", "stddev", "above", "binary"]:
+            self.assertTrue(numpy.isnan(grids[name][0, 0]), name)
+
+    def test_binary_grids_match_ascii(self):
+
+        self.write_replicates([0.1, 0.5, 0.9], "bil")
+        self.write_results([("sp_0", 0.4), ("sp_1", 0.4), ("sp_2", 0.4), ("sp (average)", 0.4)])
+
+        grids = self.ensemble(extension="bil")
+        numpy.testing.assert_allclose(grids["mean"][1:, :], 0.5, rtol=1e-6)
+        self.assertTrue((grids["above"][1:, :] == 2).all())
+
+    def test_only_given_folds(self):
+
+        self.write_replicates([0.1, 0.5, 0.9])
+        self.write_results([("sp_0", 0.4), ("sp_2", 0.4), ("sp (average)", 0.4)])
+
+        grids = self.ensemble(folds=[0, 2])
+        numpy.testing.assert_allclose(grids["mean"][1:, :], 0.5, rtol=1e-6)
+        self.assertTrue((grids["above"][1:, :] == 1).all())
+
+    def test_threshold_column_needs_output_format(self):
+
+        fields = ["Species", "10 percentile training presence Logistic threshold", COLUMN]
+        self.assertEqual(threshold_column(fields, "10 percentile training presence", "cloglog"), COLUMN)
+        self.assertRaises(ValueError, threshold_column, fields, "10 percentile training presence", "raw")
+
+
+if __name__ == "__main__":
+    unittest.main()
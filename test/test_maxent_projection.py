@@ -0,0 +1,112 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from maxent_projection import evaluate, lambdas_variables, parse_lambdas, project_lambdas
+from raster_io import GridHeader, read_grid, write_grid
+
+# a hand-made model with one feature of each kind over bio1 and bio2, and one with a zero lambda over bio9
+LAMBDAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "projection", "species.lambdas")
+
+# cells (bio1, bio2) and their sums of lambda * feature worked out by hand, the third has bio1 and its hinge above
+# the training range and the reverse hinge of bio2 below it, so it differs when clamped
+BIO1 = [4.0, 1.0, 12.0, 5.0]
+BIO2 = [3.0, 8.0, 0.5, numpy.nan]
+EXPONENT = [2.51, -0.36, 5.0575, numpy.nan]
+EXPONENT_UNCLAMPED = [2.51, -0.36, 6.5375, numpy.nan]
+
+# exp(exponent - linearPredictorNormalizer) / densityNormalizer, then scaled by exp(entropy) for logistic and cloglog
+RAW = [0.0741235, 0.00420272, 0.946937, numpy.nan]
+LOGISTIC = [0.353881, 0.0301188, 0.874953, numpy.nan]
+CLOGLOG = [0.421723, 0.0305769, 0.999085, numpy.nan]
+
+
+class ParseLambdasTest(unittest.TestCase):
+
+    def test_features_and_constants(self):
+
+        features, constants = parse_lambdas(LAMBDAS)
+        self.assertEqual([(kind, variables, parameter) for kind, variables, parameter, weight, low, high in features],
+                         [("linear", ["bio1"], None), ("quadratic", ["bio2"], None), ("product", ["bio1", "bio2"], None),
+                          ("hinge", ["bio1"], None), ("reverse_hinge", ["bio2"], None), ("threshold", ["bio1"], 3.5)])
+        self.assertEqual([weight for kind, variables, parameter, weight, low, high in features], [2.0, -1.0, 0.5, 1.5, 0.8, 0.7])
+        self.assertEqual(constants, {"linearPredictorNormalizer": 1.2, "densityNormalizer": 50.0, "numBackgroundPoints": 10000.0, "entropy": 2.0})
+        self.assertEqual(lambdas_variables(features), ["bio1", "bio2"])
+
+
+class EvaluateTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.features, self.constants = parse_lambdas(LAMBDAS)
+        self.layers = {"bio1": numpy.array([BIO1]), "bio2": numpy.array([BIO2])}
+
+    def test_raw(self):
+
+        result = evaluate(self.features, self.constants, self.layers, "raw")
+        numpy.testing.assert_allclose(result[0], RAW, rtol=1e-5, equal_nan=True)
+        expected = numpy.exp(numpy.array(EXPONENT) - 1.2) / 50.0
+        numpy.testing.assert_allclose(result[0], expected, rtol=1e-12, equal_nan=True)
+
+    def test_logistic(self):
+
+        numpy.testing.assert_allclose(evaluate(self.features, self.constants, self.layers, "logistic")[0], LOGISTIC, rtol=1e-5, equal_nan=True)
+
+    def test_cloglog(self):
+
+        numpy.testing.assert_allclose(evaluate(self.features, self.constants, self.layers, "cloglog")[0], CLOGLOG, rtol=1e-5, equal_nan=True)
+
+    def test_unclamped(self):
+
+        result = evaluate(self.features, self.constants, self.layers, "raw", clamp=False)
+        expected = numpy.exp(numpy.array(EXPONENT_UNCLAMPED) - 1.2) / 50.0
+        numpy.testing.assert_allclose(result[0], expected, rtol=1e-12, equal_nan=True)
+
+
+class ProjectLambdasTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp(prefix="maxent_projection_test_")
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_bands_match_evaluate(self):
+
+        # the hand-made cells repeated over more rows than bands, as ASCII grids streamed to scratch and a BIL mapped
+        layers = os.path.join(self.folder, "future")
+        os.makedirs(layers)
+        header = GridHeader(4, 9, 0.0, 0.0, 1.0, -9999.0)
+        bio1 = numpy.tile(BIO1, (9, 1)) + numpy.arange(9).reshape(-1, 1) * 0.5
+        bio2 = numpy.tile(BIO2, (9, 1))
+        write_grid(os.path.join(layers, "bio1.asc"), bio1, header)
+        write_grid(os.path.join(layers, "bio2.bil"), bio2, header)
+
+        out_path = os.path.join(self.folder, "species_future.asc")
+        bands = list(project_lambdas(LAMBDAS, layers, out_path, "cloglog", workers=2))
+        self.assertEqual(bands[-1][0], bands[-1][1])
+        self.assertTrue(len(bands) > 1)
+
+        features, constants = parse_lambdas(LAMBDAS)
+        expected = evaluate(features, constants, {"bio1": bio1, "bio2": bio2.astype(numpy.float32).astype(numpy.float64)}, "cloglog")
+        numpy.testing.assert_allclose(read_grid(out_path).data, expected, rtol=1e-6, equal_nan=True)
+        numpy.testing.assert_allclose(read_grid(out_path).data[0], CLOGLOG, rtol=1e-5, equal_nan=True)
+
+    def test_missing_variable(self):
+
+        layers = os.path.join(self.folder, "partial")
+        os.makedirs(layers)
+        write_grid(os.path.join(layers, "bio1.asc"), numpy.ones((2, 2)), GridHeader(2, 2, 0.0, 0.0, 1.0, -9999.0))
+
+        self.assertRaises(ValueError, list, project_lambdas(LAMBDAS, layers, os.path.join(self.folder, "out.asc"), workers=1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from maxent_replicates import merge_grids, merge_results
+from raster_io import GridHeader, read_grid, write_grid
+
+HEADER = GridHeader(6, 7, 0.0, 0.0, 1.0, -9999.0)
+
+
+class MergeGridsTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp(prefix="maxent_replicates_test_")
+        random = numpy.random.RandomState(4)
+        self.values = random.uniform(0, 1, (3, HEADER.nrows, HEADER.ncols)).round(6)
+        self.values[1, 2, 3] = numpy.nan
+        self.folders = []
+        for i, values in enumerate(self.values):
+            folder = os.path.join(self.folder, "replicate_{}".format(i))
+            os.makedirs(folder)
+            write_grid(os.path.join(folder, "sp.asc"), values, HEADER)
+            write_grid(os.path.join(folder, "sp_future.bil"), values * 2, HEADER)
+            self.folders.append(folder)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_summaries_in_bands(self):
+
+        # bands of two rows, so the last band is short
+        written = merge_grids(self.folders, self.folder, block_rows=2)
+        self.assertEqual([os.path.basename(path) for path in written],
+                         ["sp_avg.asc", "sp_stddev.asc", "sp_min.asc", "sp_max.asc",
+                          "sp_future_avg.bil", "sp_future_stddev.bil", "sp_future_min.bil", "sp_future_max.bil"])
+
+        with numpy.errstate(invalid="ignore"):
+            expected = {"avg": self.values.mean(axis=0), "stddev": self.values.std(axis=0),
+                        "min": numpy.nanmin(self.values, axis=0), "max": numpy.nanmax(self.values, axis=0)}
+        for summary, values in expected.items():
+            grid = read_grid(os.path.join(self.folder, "sp_{}.asc".format(summary)))
+            self.assertEqual(grid.header, HEADER)
+            numpy.testing.assert_allclose(grid.data, values, rtol=1e-6, atol=1e-7, equal_nan=True, err_msg=summary)
+            numpy.testing.assert_allclose(read_grid(os.path.join(self.folder, "sp_future_{}.bil".format(summary))).data, values * 2,
+                                          rtol=1e-6, atol=1e-7, equal_nan=True, err_msg=summary)
+
+    def test_grids_must_line_up(self):
+
+        write_grid(os.path.join(self.folders[2], "sp.asc"), self.values[2], HEADER._replace(xmin=1.0))
+        self.assertRaises(ValueError, merge_grids, self.folders, self.folder)
+
+    def test_only_grids_every_replicate_wrote(self):
+
+        write_grid(os.path.join(self.folders[0], "extra.asc"), self.values[0], HEADER)
+        written = merge_grids(self.folders, self.folder)
+        self.assertFalse([path for path in written if "extra" in path])
+
+
+class MergeResultsTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp(prefix="maxent_replicates_test_")
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_rows_named_by_fold(self):
+
+        folders = []
+        for fold, auc in [(0, 0.8), (2, 0.6)]:
+            folder = os.path.join(self.folder, "replicate_{}".format(fold))
+            os.makedirs(folder)
+            with open(os.path.join(folder, "maxentResults.csv"), "w") as f:
+                f.write("Species,Training AUC\nsp,{}\n".format(auc))
+            folders.append(folder)
+
+        path = merge_results(folders, os.path.join(self.folder, "maxentResults.csv"), [0, 2])
+        with open(path) as f:
+            rows = [line.strip().split(",") for line in f if line.strip()]
+        self.assertEqual([row[0] for row in rows], ["Species", "sp_0", "sp_2", "sp (average)", "sp (stddev)"])
+        self.assertAlmostEqual(float(rows[3][1]), 0.7)
+        self.assertAlmostEqual(float(rows[4][1]), 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
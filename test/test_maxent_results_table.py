@@ -0,0 +1,110 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from maxent_results_table import RUN_COLUMN, ResultsTable
+
+
+class ResultsTableTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp(prefix="maxent_results_test_")
+        self.table_path = os.path.join(self.folder, "table.npz")
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def write_run(self, name, lines):
+
+        folder = os.path.join(self.folder, "runs", name)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, "maxentResults.csv"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+        return folder
+
+    def update(self, table=None):
+
+        table = table or ResultsTable.load(self.table_path)
+        counts = table.update(os.path.join(self.folder, "runs"))
+        table.save(self.table_path)
+
+        return table, counts
+
+    def rows_by_run(self, table):
+
+        # {run folder name: [species]} from the run column, which must point each row at the file it came from
+        species = table.species()
+        found = {}
+        for row, run in enumerate(table.columns[RUN_COLUMN]):
+            found.setdefault(os.path.basename(os.path.dirname(table.runs[run][0])), []).append(species[row])
+
+        return found
+
+    def test_update_reads_only_changed_runs(self):
+
+        self.write_run("a", ["Species,Training AUC,bio1 contribution", "a,0.8,60", "a2,0.7,50"])
+        self.write_run("b", ["Species,Training AUC,bio1 contribution", "b,0.9,40"])
+        self.write_run("c", ["Species,Training AUC,bio1 contribution", "c,0.6,10"])
+
+        table, counts = self.update()
+        self.assertEqual((counts, table.rows), ((3, 0), 4))
+
+        table, counts = self.update()
+        self.assertEqual((counts, table.rows), ((0, 0), 4))
+
+        # a changed run is dropped and parsed again, one gone is dropped, the runs after them are renumbered
+        self.write_run("a", ["Species,Training AUC,bio1 contribution", "a,0.85,65"])
+        shutil.rmtree(os.path.join(self.folder, "runs", "b"))
+        table, counts = self.update()
+        self.assertEqual((counts, table.rows, len(table.runs)), ((1, 2), 2, 2))
+        self.assertEqual(self.rows_by_run(table), {"a": ["a"], "c": ["c"]})
+        self.assertEqual(table.columns["Training AUC"].tolist(), [0.6, 0.85])
+
+        reloaded = ResultsTable.load(self.table_path)
+        self.assertEqual(list(reloaded.columns), list(table.columns))
+        self.assertEqual(self.rows_by_run(reloaded), {"a": ["a"], "c": ["c"]})
+
+    def test_mixed_columns(self):
+
+        # a column one run lacks is NaN or empty there, one numeric in one run and text in another becomes text
+        self.write_run("a", ["Species,Training AUC,note", "a,0.8,1.5"])
+        self.write_run("b", ["Species,Training AUC,note,bio2 contribution", "b,,fine,30"])
+
+        table, counts = self.update()
+        self.assertEqual(table.columns["note"].tolist(), ["1.5", "fine"])
+        self.assertEqual(table.columns["Training AUC"][0], 0.8)
+        self.assertTrue(numpy.isnan(table.columns["Training AUC"][1]))
+        self.assertTrue(numpy.isnan(table.columns["bio2 contribution"][0]))
+        self.assertEqual(table.columns["bio2 contribution"][1], 30.0)
+
+        reloaded = ResultsTable.load(self.table_path)
+        self.assertEqual(reloaded.columns["note"].tolist(), ["1.5", "fine"])
+
+    def test_variable_ranking_by_species(self):
+
+        # species x has three replicates and its summary rows, y one model; each species counts once
+        self.write_run("x", ["Species,bio1 contribution,bio2 contribution,bio3 contribution",
+                             "x_0,90,10,", "x_1,80,20,", "x_2,70,30,", "x (average),80,20,", "x (stddev),8,8,"])
+        self.write_run("y", ["Species,bio1 contribution,bio2 contribution,bio3 contribution", "y,10,50,40"])
+
+        table, counts = self.update()
+        self.assertEqual(table.species_keys().tolist(), ["x", "x", "x", "x (average)", "x (stddev)", "y"])
+        ranking = table.variable_ranking()
+        self.assertEqual([(variable, species) for variable, mean, species in ranking], [("bio1", 2), ("bio3", 1), ("bio2", 2)])
+        numpy.testing.assert_allclose([mean for variable, mean, species in ranking], [45.0, 40.0, 35.0])
+
+        ranking = table.variable_ranking(rows=table.species_keys() == "x")
+        self.assertEqual([(variable, mean, species) for variable, mean, species in ranking][0], ("bio1", 80.0, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nearest_centroid_cache import incremental_nearest_to_centroid
+from nearest_centroid_engine import Polygon, nearest_to_centroid
+
+
+def square(oid, x, y, size=10.0):
+
+    ring = numpy.array([(x, y), (x, y + size), (x + size, y + size), (x + size, y), (x, y)], dtype=numpy.float64)
+
+    return Polygon(oid, (x + size / 2.0, y + size / 2.0), [[ring]])
+
+
+class IncrementalNearestTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp(prefix="nearest_cache_test_")
+        self.cache = os.path.join(self.folder, "nearest.npz")
+        self.polygons = [square(1, 0, 0), square(2, 20, 0), square(3, 40, 0)]
+        self.oids = [10, 11, 12, 13, 14]
+        self.x = [2.0, 6.0, 24.0, 27.0, 45.0]
+        self.y = [2.0, 4.0, 5.0, 5.0, 5.0]
+        self.computed = []
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def compute(self, polygons, point_oids, x, y, k=1):
+
+        # records the polygons handed to the engine
+        self.computed.append([p.oid for p in polygons])
+
+        return nearest_to_centroid(polygons, point_oids, x, y, k=k)
+
+    def run_incremental(self, oids, x, y, k=1):
+
+        self.computed = []
+        results, reused, recomputed = incremental_nearest_to_centroid(self.polygons, oids, x, y, self.cache, k=k, compute=self.compute)
+        expected = list(nearest_to_centroid(self.polygons, oids, x, y, k=k))
+        self.assertEqual([r for p, r in results], [r for p, r in expected])
+
+        return sum(self.computed, []), reused, recomputed
+
+    def test_unchanged_polygons_reused(self):
+
+        computed, reused, recomputed = self.run_incremental(self.oids, self.x, self.y)
+        self.assertEqual((computed, reused, recomputed), ([1, 2, 3], 0, 3))
+
+        computed, reused, recomputed = self.run_incremental(self.oids, self.x, self.y)
+        self.assertEqual((computed, reused, recomputed), ([], 3, 0))
+
+    def test_point_moved_into_polygon(self):
+
+        self.run_incremental(self.oids, self.x, self.y)
+
+        # point 13 moves from polygon 2 to the centre of polygon 1, polygon 3 saw no change
+        x = list(self.x)
+        x[3] = 5.0
+        y = list(self.y)
+        y[3] = 5.0
+        computed, reused, recomputed = self.run_incremental(self.oids, x, y)
+        self.assertEqual((sorted(computed), reused, recomputed), ([1, 2], 1, 2))
+
+    def test_point_removed(self):
+
+        self.run_incremental(self.oids, self.x, self.y)
+
+        # the only point in polygon 3 goes, its polygon is left without a result
+        computed, reused, recomputed = self.run_incremental(self.oids[:4], self.x[:4], self.y[:4])
+        self.assertEqual((computed, reused, recomputed), ([3], 2, 1))
+
+    def test_new_k_recomputes_everything(self):
+
+        self.run_incremental(self.oids, self.x, self.y)
+
+        computed, reused, recomputed = self.run_incremental(self.oids, self.x, self.y, k=2)
+        self.assertEqual((computed, reused, recomputed), ([1, 2, 3], 0, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+import os
+import sys
+import unittest
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nearest_centroid_engine import Polygon, PointGrid, k_smallest, make_tiles, nearest_to_centroid, tiled_nearest_to_centroid
+from point_in_polygon import PolygonRings
+
+
+def ring(*points):
+
+    return numpy.array(points + points[:1], dtype=numpy.float64)
+
+
+def brute_force(polygons, point_oids, x, y, k):
+
+    # every point tested against every polygon, ranked by distance then oid
+    point_oids, x, y = numpy.asarray(point_oids), numpy.asarray(x, dtype=numpy.float64), numpy.asarray(y, dtype=numpy.float64)
+    results = []
+    for polygon in polygons:
+        inside = numpy.nonzero(PolygonRings(polygon.parts).contains(x, y))[0]
+        dists = numpy.hypot(x[inside] - polygon.centroid[0], y[inside] - polygon.centroid[1])
+        ranked = sorted(zip(dists.tolist(), point_oids[inside].tolist()))[:k]
+        results.append([(polygon.oid, oid, dist, rank + 1) for rank, (dist, oid) in enumerate(ranked)])
+
+    return results
+
+
+def random_polygons(random, count, extent):
+
+    # squares and triangles, some with a hole, scattered over the extent
+    polygons = []
+    for oid in range(count):
+        cx, cy = random.uniform(0, extent, 2)
+        size = random.uniform(2, extent / 4.0)
+        if oid % 3 == 0:
+            parts = [[ring((cx - size, cy - size), (cx - size, cy + size), (cx + size, cy + size), (cx + size, cy - size)),
+                      ring((cx - size / 3, cy - size / 3), (cx + size / 3, cy - size / 3), (cx + size / 3, cy + size / 3), (cx - size / 3, cy + size / 3))]]
+        elif oid % 3 == 1:
+            parts = [[ring((cx - size, cy - size), (cx, cy + size), (cx + size, cy - size))]]
+        else:
+            parts = [[ring((cx - size, cy - size), (cx - size, cy + size), (cx + size, cy + size), (cx + size, cy - size))]]
+        polygons.append(Polygon(oid, (cx, cy), parts))
+
+    return polygons
+
+
+def as_tuples(results):
+
+    return [[(r.polygon_oid, r.point_oid, r.distance, r.rank) for r in polygon_results] for polygon, polygon_results in results]
+
+
+class NearestToCentroidTest(unittest.TestCase):
+
+    def setUp(self):
+
+        random = numpy.random.RandomState(11)
+        self.polygons = random_polygons(random, 30, 100.0)
+
+        # whole coordinates so many points tie on distance, oids out of order so ties are settled by oid not position
+        self.x = random.randint(0, 100, 3000).astype(numpy.float64)
+        self.y = random.randint(0, 100, 3000).astype(numpy.float64)
+        self.oids = random.permutation(3000) + 1
+
+    def check(self, k, cell_size=None):
+
+        results = as_tuples(nearest_to_centroid(self.polygons, self.oids, self.x, self.y, cell_size, k=k))
+        self.assertEqual(results, brute_force(self.polygons, self.oids, self.x, self.y, k))
+
+        return results
+
+    def test_nearest(self):
+
+        results = self.check(1)
+        self.assertTrue(sum(1 for r in results if r) > 20)
+
+    def test_k_nearest(self):
+
+        self.check(5)
+
+    def test_small_cells(self):
+
+        self.check(3, cell_size=0.7)
+
+    def test_k_above_count(self):
+
+        # every contained point comes back, ranked, when k is more than a polygon holds
+        polygon = Polygon(1, (0.0, 0.0), [[ring((-2, -2), (-2, 2), (2, 2), (2, -2))]])
+        results = as_tuples(nearest_to_centroid([polygon], [7, 8, 9], [1.0, 0.5, 5.0], [1.0, 0.0, 5.0], k=4))
+        self.assertEqual(results, [[(1, 8, 0.5, 1), (1, 7, numpy.hypot(1, 1), 2)]])
+
+    def test_ties_go_to_lower_oid(self):
+
+        polygon = Polygon(1, (0.0, 0.0), [[ring((-2, -2), (-2, 2), (2, 2), (2, -2))]])
+        x, y, oids = [1.0, 0.0, -1.0, 0.0], [0.0, 1.0, 0.0, -1.0], [40, 30, 10, 20]
+        self.assertEqual([r[1] for r in as_tuples(nearest_to_centroid([polygon], oids, x, y, k=1))[0]], [10])
+        self.assertEqual([r[1] for r in as_tuples(nearest_to_centroid([polygon], oids, x, y, k=3))[0]], [10, 20, 30])
+
+    def test_empty_polygons(self):
+
+        # a polygon without points in it and one without a ring both come back with no results
+        polygons = [Polygon(1, (50.0, 50.0), [[ring((49, 49), (49, 49.5), (49.5, 49.5), (49.5, 49))]]), Polygon(2, (0.0, 0.0), [])]
+        results = list(nearest_to_centroid(polygons, [1, 2], [0.0, 10.0], [0.0, 10.0]))
+        self.assertEqual([(p.oid, r) for p, r in results], [(1, []), (2, [])])
+
+    def test_no_points(self):
+
+        results = list(nearest_to_centroid(self.polygons[:3], [], [], []))
+        self.assertEqual([r for p, r in results], [[], [], []])
+
+
+class TiledNearestToCentroidTest(unittest.TestCase):
+
+    def setUp(self):
+
+        random = numpy.random.RandomState(13)
+        self.polygons = random_polygons(random, 40, 100.0)
+        self.x = random.randint(0, 100, 3000).astype(numpy.float64)
+        self.y = random.randint(0, 100, 3000).astype(numpy.float64)
+        self.oids = random.permutation(3000) + 1
+
+    def test_matches_single_pass(self):
+
+        # tiles far smaller than the polygons, so most polygons reach across tile boundaries
+        for k in [1, 4]:
+            expected = as_tuples(nearest_to_centroid(self.polygons, self.oids, self.x, self.y, k=k))
+            results = list(tiled_nearest_to_centroid(self.polygons, self.oids, self.x, self.y, tile_size=7.0, workers=2, k=k))
+            self.assertEqual([p.oid for p, r in results], [p.oid for p in self.polygons])
+            self.assertEqual(as_tuples(results), expected)
+            self.assertEqual(expected, brute_force(self.polygons, self.oids, self.x, self.y, k))
+
+    def test_tiles_cover_their_polygons(self):
+
+        tiles = make_tiles(self.polygons + [Polygon(99, (0.0, 0.0), [])], tile_size=7.0)
+        members = sorted(i for tile_members, box in tiles for i in tile_members)
+        self.assertEqual(members, list(range(len(self.polygons))))
+        self.assertTrue(len(tiles) > 10)
+        for tile_members, (xmin, ymin, xmax, ymax) in tiles:
+            for i in tile_members:
+                bxmin, bymin, bxmax, bymax = PolygonRings(self.polygons[i].parts).bounds
+                self.assertTrue(xmin <= bxmin and ymin <= bymin and bxmax <= xmax and bymax <= ymax)
+
+    def test_empty_polygon_in_tiles(self):
+
+        polygons = self.polygons[:5] + [Polygon(99, (0.0, 0.0), [])]
+        results = list(tiled_nearest_to_centroid(polygons, self.oids, self.x, self.y, workers=2))
+        self.assertEqual(as_tuples(results), as_tuples(nearest_to_centroid(polygons, self.oids, self.x, self.y)))
+        self.assertEqual(results[-1][1], [])
+
+
+class PointGridTest(unittest.TestCase):
+
+    def test_query_is_superset(self):
+
+        random = numpy.random.RandomState(5)
+        x, y = random.uniform(0, 50, 500), random.uniform(0, 50, 500)
+        grid = PointGrid(x, y)
+        for xmin, ymin, xmax, ymax in [(10, 10, 20, 30), (0, 0, 50, 50), (-5, -5, 1, 1), (49, 49, 60, 60)]:
+            inside = set(numpy.nonzero((x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax))[0].tolist())
+            self.assertTrue(inside <= set(grid.query(xmin, ymin, xmax, ymax).tolist()))
+        self.assertEqual(len(grid.query(60, 60, 70, 70)), 0)
+
+    def test_single_point(self):
+
+        grid = PointGrid([3.0], [4.0])
+        self.assertEqual(grid.query(0, 0, 5, 5).tolist(), [0])
+
+
+class KSmallestTest(unittest.TestCase):
+
+    def test_ties_keep_positional_order(self):
+
+        values = numpy.array([3.0, 1.0, 2.0, 1.0, 2.0, 0.5])
+        self.assertEqual(list(k_smallest(values, 1)), [5])
+        self.assertEqual(list(k_smallest(values, 3)), [5, 1, 3])
+        self.assertEqual(list(k_smallest(values, 4)), [5, 1, 3, 2])
+        self.assertEqual(list(k_smallest(values, 10)), [5, 1, 3, 2, 4, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import sys
+import unittest
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import point_in_polygon
+from point_in_polygon import PolygonRings, points_in_polygon
+
+
+def ring(*points):
+
+    return numpy.array(points + points[:1], dtype=numpy.float64)
+
+
+def point_in_parts(parts, px, py):
+
+    # the per-point check the kernel replaced, a ray cast over every edge of every ring of a part, inside any part
+    for part in parts:
+        inside = False
+        for r in part:
+            for (x0, y0), (x1, y1) in zip(r[:-1], r[1:]):
+                if (y0 > py) != (y1 > py) and px < x0 + (py - y0) * (x1 - x0) / (y1 - y0):
+                    inside = not inside
+        if inside:
+            return True
+
+    return False
+
+
+SQUARE_WITH_HOLE = [[ring((0, 0), (0, 10), (10, 10), (10, 0)), ring((3, 3), (7, 3), (7, 7), (3, 7))]]
+
+TWO_PARTS = [[ring((0, 0), (0, 4), (4, 4), (4, 0))], [ring((10, 10), (10, 14), (14, 14), (14, 10))]]
+
+TRIANGLE = [[ring((0, 0), (0, 10), (10, 0))]]
+
+
+class PolygonRingsTest(unittest.TestCase):
+
+    def test_hole_is_outside(self):
+
+        inside = points_in_polygon(SQUARE_WITH_HOLE, [1, 5, 8, 5, 11], [1, 5, 5, 2, 5])
+        self.assertEqual(inside.tolist(), [True, False, True, True, False])
+
+    def test_multipart(self):
+
+        rings = PolygonRings(TWO_PARTS)
+        self.assertEqual(rings.bounds, (0.0, 0.0, 14.0, 14.0))
+        self.assertEqual(rings.contains([2, 12, 7, 2], [2, 12, 7, 12]).tolist(), [True, True, False, False])
+
+    def test_bounds_edges(self):
+
+        # points on the bounding box pass the box test and are settled by the ray cast: the triangle's far corner
+        # and right edge are outside it, its corner at the origin and its left and bottom edges inside
+        x = [10, 10, 0, 0, 5, 0]
+        y = [10, 5, 0, 5, 0, 10]
+        self.assertEqual(PolygonRings(TRIANGLE).contains(x, y).tolist(), [point_in_parts(TRIANGLE, px, py) for px, py in zip(x, y)])
+        self.assertEqual(PolygonRings(TRIANGLE).contains(x, y).tolist(), [False, False, True, True, True, False])
+
+    def test_shared_edge_counted_once(self):
+
+        left = [[ring((0, 0), (0, 10), (5, 10), (5, 0))]]
+        right = [[ring((5, 0), (5, 10), (10, 10), (10, 0))]]
+        y = numpy.linspace(0.5, 9.5, 10)
+        x = numpy.full(10, 5.0)
+        self.assertTrue((points_in_polygon(left, x, y) ^ points_in_polygon(right, x, y)).all())
+
+    def test_empty_parts(self):
+
+        rings = PolygonRings([[], [numpy.zeros((2, 2))]])
+        self.assertIsNone(rings.bounds)
+        self.assertEqual(rings.contains([0.0], [0.0]).tolist(), [False])
+
+    def test_matches_per_point_check(self):
+
+        # a star with a hole and a second part, points at random and on the vertices' grid lines, in blocks small
+        # enough that the kernel splits them
+        angles = numpy.linspace(0, 2 * numpy.pi, 15)[:-1]
+        radii = numpy.where(numpy.arange(14) % 2, 4.0, 10.0)
+        star = numpy.column_stack([radii * numpy.cos(angles), radii * numpy.sin(angles)]).round(3)
+        parts = [[numpy.vstack([star, star[:1]]), ring((-1, -1), (1, -1), (1, 1), (-1, 1))], [ring((12, 12), (12, 15), (16, 12))]]
+
+        random = numpy.random.RandomState(3)
+        x = numpy.concatenate([random.uniform(-12, 18, 2000), numpy.repeat(star[:, 0], 5)])
+        y = numpy.concatenate([random.uniform(-12, 18, 2000), numpy.tile(numpy.linspace(-10, 10, 5), len(star))])
+
+        block = point_in_polygon.MAX_BLOCK_CELLS
+        point_in_polygon.MAX_BLOCK_CELLS = 64
+        try:
+            inside = PolygonRings(parts).contains(x, y)
+        finally:
+            point_in_polygon.MAX_BLOCK_CELLS = block
+
+        self.assertEqual(inside.tolist(), [point_in_parts(parts, px, py) for px, py in zip(x, y)])
+        self.assertTrue(100 < inside.sum() < 1900)
+
+
+if __name__ == "__main__":
+    unittest.main()
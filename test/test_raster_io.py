@@ -0,0 +1,128 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import raster_io
+from raster_io import GridHeader, mappable, read_ascii, read_grid, read_header, write_ascii, write_grid
+
+HEADER = GridHeader(5, 4, 300000.0, 6100000.5, 25.0, -9999.0)
+
+
+def sample_grid():
+
+    data = numpy.arange(20, dtype=numpy.float64).reshape(4, 5) * 1.25 - 3.0
+    data[1, 2] = numpy.nan
+    data[3, 0] = numpy.nan
+
+    return data
+
+
+class RasterIoTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp(prefix="raster_io_test_")
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def path(self, *names):
+
+        return os.path.join(self.folder, *names)
+
+    def test_round_trips(self):
+
+        # every format gives back the values, NaN where NoData was, and the header
+        data = sample_grid()
+        for extension in raster_io.EXTENSIONS:
+            path = write_grid(self.path("grid" + extension), data, HEADER)
+            grid = read_grid(path)
+            numpy.testing.assert_allclose(grid.data, data, rtol=1e-7, equal_nan=True, err_msg=extension)
+            self.assertEqual(grid.header, HEADER, extension)
+            self.assertEqual(read_header(path), HEADER, extension)
+
+    def test_raw_keeps_nodata(self):
+
+        data = sample_grid()
+        for extension in [".asc", ".flt"]:
+            grid = read_grid(write_grid(self.path("grid" + extension), data, HEADER), raw=True)
+            self.assertEqual(grid.data[1, 2], -9999.0)
+            self.assertFalse(numpy.isnan(grid.data).any())
+
+    def test_header_without_nodata_or_with_centre(self):
+
+        with open(self.path("centre.asc"), "w") as f:
+            f.write("NCOLS 3\nNROWS 2\nXLLCENTER 10.5\nYLLCENTER 20.5\nCELLSIZE 1\n1 2 -9999\n4 5 6\n")
+
+        grid = read_ascii(self.path("centre.asc"))
+        self.assertEqual(grid.header, GridHeader(3, 2, 10.0, 20.0, 1.0, None))
+        self.assertEqual(grid.data.tolist(), [[1.0, 2.0, -9999.0], [4.0, 5.0, 6.0]])
+
+    def test_ascii_in_chunks(self):
+
+        # chunks far shorter than a row, so numbers meet the chunk ends, read into a memmap as mappable does
+        data = numpy.random.RandomState(2).uniform(-1000, 1000, (30, 40)).round(4)
+        header = GridHeader(40, 30, 0.0, 0.0, 1.0, -9999.0)
+        write_ascii(self.path("big.asc"), data, header, block_rows=7)
+
+        chunk = raster_io.ASCII_CHUNK_BYTES
+        raster_io.ASCII_CHUNK_BYTES = 37
+        try:
+            grid = read_ascii(self.path("big.asc"))
+            out = numpy.memmap(self.path("big.dat"), dtype="<f4", mode="w+", shape=(30, 40))
+            read_ascii(self.path("big.asc"), out=out)
+        finally:
+            raster_io.ASCII_CHUNK_BYTES = chunk
+
+        numpy.testing.assert_array_equal(grid.data, data)
+        numpy.testing.assert_allclose(out, data, rtol=1e-6)
+        del out
+
+    def test_short_ascii_grid(self):
+
+        with open(self.path("short.asc"), "w") as f:
+            f.write("ncols 3\nnrows 2\nxllcorner 0\nyllcorner 0\ncellsize 1\n1 2 3\n4\n")
+
+        self.assertRaises(ValueError, read_ascii, self.path("short.asc"))
+
+    def test_mappable(self):
+
+        data = sample_grid()
+        binary = write_grid(self.path("grid.flt"), data, HEADER)
+        self.assertEqual(mappable(binary, self.folder), binary)
+
+        scratch = self.path("scratch")
+        os.makedirs(scratch)
+        flt = mappable(write_grid(self.path("grid.asc"), data, HEADER), scratch)
+        self.assertEqual(os.path.dirname(flt), scratch)
+        self.assertTrue(isinstance(read_grid(flt, raw=True).data, numpy.memmap))
+        numpy.testing.assert_allclose(read_grid(flt).data, data, rtol=1e-7, equal_nan=True)
+        self.assertEqual(read_grid(flt).header, HEADER)
+
+    def test_mappable_same_name_in_different_folders(self):
+
+        # grids of one name from two folders need names of their own in scratch, or the second overwrites the first
+        scratch = self.path("scratch")
+        paths = []
+        for i, value in enumerate([1.0, 2.0]):
+            os.makedirs(self.path("replicate_{}".format(i)))
+            paths.append(write_grid(self.path("replicate_{}".format(i), "sp.asc"), numpy.full((4, 5), value), HEADER))
+        os.makedirs(scratch)
+
+        mapped = [read_grid(mappable(path, scratch, str(i))) for i, path in enumerate(paths)]
+        self.assertEqual([float(grid.data[0, 0]) for grid in mapped], [1.0, 2.0])
+
+    def test_unknown_format(self):
+
+        self.assertRaises(ValueError, read_grid, self.path("grid.tif"))
+        self.assertRaises(ValueError, write_grid, self.path("grid.tif"), numpy.zeros((2, 2)), HEADER)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+import numpy
+import os
+from math import sqrt
+from numpy.lib.format import open_memmap
+from cost_distance import NODATA, flat_view, neighbour_steps, pad, propagate, to_array
+
+# rough bytes held per cell of a tile while it is solved: the cost and distance blocks, their fast-index copies,
+# the heap and the comparison temporaries
+BYTES_PER_CELL = 64
+
+DEFAULT_TILE_BUDGET_MB = 256
+
+
+def tile_size_for_budget(budget_mb):
+
+    # side of the square tile that fits the memory budget
+    return max(16, int(sqrt(float(budget_mb) * 1024 * 1024 / BYTES_PER_CELL)))
+
+
+def tile_bounds(shape, tile_size):
+
+    # {(tile row, tile col): (row0, row1, col0, col1)} covering the grid
+    rows, cols = shape
+    return dict(((i, j), (i * tile_size, min((i + 1) * tile_size, rows), j * tile_size, min((j + 1) * tile_size, cols)))
+                for i in range((rows + tile_size - 1) // tile_size) for j in range((cols + tile_size - 1) // tile_size))
+
+
+class TiledCostDistance(object):
+
+    def __init__(self, cost, labels, cell_size=1.0, tile_size=None, scratch=None, algorithm="Heap"):
+
+        # cost (NaN for NoData) and labels (source value per cell, NaN elsewhere) are 2d arrays of the same shape,
+        # normally memory-mapped, and only one tile and its one cell halo is ever read into memory at a time
+        self.cost = cost
+        self.labels = labels
+        self.shape = cost.shape
+        self.cell_size = float(cell_size)
+        self.tile_size = tile_size or tile_size_for_budget(DEFAULT_TILE_BUDGET_MB)
+        self.tiles = tile_bounds(self.shape, self.tile_size)
+        self.algorithm = algorithm
+        self.sweeps = 0
+
+        # the distances of the value being propagated, only valid on the tiles it has reached
+        if scratch:
+            self.dist = open_memmap(os.path.join(scratch, "distance.npy"), mode="w+", dtype=numpy.float64, shape=self.shape)
+        else:
+            self.dist = numpy.empty(self.shape, dtype=numpy.float64)
+
+        self.source_tiles = self.index_sources()
+
+        return
+
+    def index_sources(self):
+
+        # {value: [tiles holding its sources]}, one pass over the labels serves every value
+        index = {}
+        for key, (row0, row1, col0, col1) in self.tiles.items():
+            block = numpy.asarray(self.labels[row0:row1, col0:col1])
+            for value in numpy.unique(block[~numpy.isnan(block)]).tolist():
+                index.setdefault(value, []).append(key)
+
+        return index
+
+    def halo(self, key):
+
+        # a tile's bounds grown by the one cell halo whose distances seed it, clipped to the grid
+        row0, row1, col0, col1 = self.tiles[key]
+
+        return max(row0 - 1, 0), min(row1 + 1, self.shape[0]), max(col0 - 1, 0), min(col1 + 1, self.shape[1])
+
+    def neighbours(self, key):
+
+        i, j = key
+        return [(i + di, j + dj) for di in (-1, 0, 1) for dj in (-1, 0, 1) if (di or dj) and (i + di, j + dj) in self.tiles]
+
+    def distance(self, value, max_distance=None):
+
+        # propagates the sources labelled value tile by tile, re-solving any tile whose halo changed, in alternating
+        # sweeps until no tile changes; returns the tiles reached, those holding a finite distance, self.dist holds
+        # their distances
+        limit = numpy.inf if max_distance in [None, ""] else float(max_distance)
+        started = set()
+        active = set(self.source_tiles.get(value, []))
+        self.sweeps = 0
+
+        while active:
+            order = sorted(active, reverse=self.sweeps % 2 == 1)
+            active = set()
+            for key in order:
+                active.update(self.solve(key, value, started, limit))
+            self.sweeps += 1
+
+        # a tile is started whenever a neighbour is solved, so its halo reads are valid, whether or not the value
+        # then gets into it
+        reached = set()
+        for key in started:
+            row0, row1, col0, col1 = self.tiles[key]
+            if numpy.isfinite(self.dist[row0:row1, col0:col1]).any():
+                reached.add(key)
+
+        return reached
+
+    def start(self, key, value, started):
+
+        # the first time a tile is solved or borders one that is, its distances are reset, zero on its sources
+        if key in started:
+            return
+
+        row0, row1, col0, col1 = self.tiles[key]
+        sources = (numpy.asarray(self.labels[row0:row1, col0:col1]) == value) & ~numpy.isnan(self.cost[row0:row1, col0:col1])
+        self.dist[row0:row1, col0:col1] = numpy.where(sources, 0.0, numpy.inf)
+        started.add(key)
+
+        return
+
+    def solve(self, key, value, started, limit):
+
+        # propagates within the tile and its halo, halo distances act as seeds and any they gain are kept too,
+        # returns the neighbouring tiles that now have to be solved again
+        for k in [key] + self.neighbours(key):
+            self.start(k, value, started)
+
+        row0, row1, col0, col1 = self.halo(key)
+        before = numpy.array(self.dist[row0:row1, col0:col1])
+
+        costs = pad(numpy.asarray(self.cost[row0:row1, col0:col1], dtype=numpy.float64), NODATA)
+        start = pad(before, numpy.inf)
+        dist = to_array(start)
+        seeds = numpy.flatnonzero(numpy.isfinite(start)).tolist()
+        valid = costs[~numpy.isnan(costs)]
+        propagate(flat_view(costs), dist, seeds, neighbour_steps(costs.shape[1], self.cell_size), limit, self.algorithm,
+                  float(valid.min()) if len(valid) else 0.0, float(valid.max()) if len(valid) else 0.0)
+
+        after = numpy.frombuffer(dist, dtype=numpy.float64).reshape(costs.shape)[1:-1, 1:-1]
+        changed = after < before
+        if not changed.any():
+            return []
+
+        self.dist[row0:row1, col0:col1] = after
+
+        # a neighbour is stale when anything changed where its own tile and halo overlap this one's
+        woken = []
+        for k in self.neighbours(key):
+            n_row0, n_row1, n_col0, n_col1 = self.halo(k)
+            overlap = changed[max(n_row0, row0) - row0:min(n_row1, row1) - row0, max(n_col0, col0) - col0:min(n_col1, col1) - col0]
+            if overlap.any():
+                woken.append(k)
+
+        return woken
+
+    def accumulate(self, total, reached, weight=1.0):
+
+        # adds the weighted distances into total tile by tile, unreached cells count as zero
+        for key in reached:
+            row0, row1, col0, col1 = self.tiles[key]
+            block = numpy.asarray(self.dist[row0:row1, col0:col1])
+            finite = numpy.isfinite(block)
+            target = total[row0:row1, col0:col1]
+            target[finite] += weight * block[finite]
+
+        return total
+
+    def surface(self, reached, out):
+
+        # the full cost surface written into out, NaN where unreached
+        for key, (row0, row1, col0, col1) in self.tiles.items():
+            if key in reached:
+                block = numpy.array(self.dist[row0:row1, col0:col1])
+                block[numpy.isinf(block)] = numpy.nan
+            else:
+                block = numpy.nan
+            out[row0:row1, col0:col1] = block
+
+        return out